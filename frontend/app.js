@@ -65,6 +65,19 @@ function setCurrentPdf(pdfName, { persist = true } = {}) {
   if (persist) {
     persistCurrentPdfForChat();
   }
+  prefetchPdf(currentPDF);
+}
+
+// Ask the server to load the document's vectors before the first question.
+let prefetchedPdf = null;
+function prefetchPdf(pdfName) {
+  if (!pdfName || pdfName === prefetchedPdf) return;
+  prefetchedPdf = pdfName;
+  fetch("/chat/prefetch", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ source: pdfName }),
+  }).catch((e) => console.error("prefetchPdf", e));
 }
 
 function applyChatPdfPreference(chatId) {
@@ -554,9 +567,48 @@ function updateChatTitleInSidebar(chatId, newTitle) {
   }
 }
 
+const HISTORY_PAGE_SIZE = 50;
+
+function historyMessageEl(m) {
+  const d = document.createElement("div");
+  d.className = "msg " + (m.role === "user" ? "user" : "assistant");
+  d.innerHTML = markdownToHtml(m.message);
+  return d;
+}
+
+function setLoadEarlier(chatId, before) {
+  const existing = document.getElementById("loadEarlier");
+  if (existing) existing.remove();
+  if (before == null) return;
+  const btn = document.createElement("button");
+  btn.id = "loadEarlier";
+  btn.className = "load-earlier";
+  btn.textContent = "Load earlier messages";
+  btn.onclick = () => loadEarlierHistory(chatId, before);
+  chatWindow.prepend(btn);
+}
+
+async function loadEarlierHistory(chatId, before) {
+  try {
+    const res = await fetch(`/api/chats/${chatId}?limit=${HISTORY_PAGE_SIZE}&before=${before}`);
+    if (!res.ok || chatId !== activeChatId) return;
+    const data = await res.json();
+    const anchor = document.getElementById("loadEarlier");
+    const height = chatWindow.scrollHeight;
+    const page = document.createDocumentFragment();
+    for (const m of data.history || []) page.appendChild(historyMessageEl(m));
+    chatWindow.insertBefore(page, anchor ? anchor.nextSibling : chatWindow.firstChild);
+    // Keep the messages the user was reading in place.
+    chatWindow.scrollTop += chatWindow.scrollHeight - height;
+    setLoadEarlier(chatId, data.next_before);
+  } catch (e) {
+    console.error("loadEarlierHistory", e);
+  }
+}
+
 async function loadChatHistory(chatId) {
   try {
-    const res = await fetch(`/api/chats/${chatId}`);
+    const res = await fetch(`/api/chats/${chatId}?limit=${HISTORY_PAGE_SIZE}`);
     if (!res.ok) {
       chatWindow.innerHTML = '<div class="placeholder small">Failed to load chat.</div>';
       return;
@@ -569,11 +621,9 @@ async function loadChatHistory(chatId) {
       return;
     }
     for (const m of history) {
-      const d = document.createElement("div");
-      d.className = "msg " + (m.role === "user" ? "user" : "assistant");
-      d.innerHTML = markdownToHtml(m.message);
-      chatWindow.appendChild(d);
+      chatWindow.appendChild(historyMessageEl(m));
     }
+    setLoadEarlier(chatId, data.next_before);
     chatWindow.scrollTop = chatWindow.scrollHeight;
   } catch (e) {
     console.error("loadChatHistory", e);
@@ -642,15 +692,22 @@ async function sendQuestion() {
     const decoder = new TextDecoder();
     let partial = "";
     let bubble = null;
+    let buffered = "";
     while (true) {
       const { value, done } = await reader.read();
       if (done) break;
-      const chunk = decoder.decode(value, { stream: true });
-      const parts = chunk.split("\n");
-      for (const p of parts) {
-        if (!p) continue;
-        if (!p.startsWith("data: ")) continue;
-        const payload = p.replace("data: ", "");
+      buffered += decoder.decode(value, { stream: true });
+      // Events end with a blank line; a frame may hold several tokens and
+      // multi-line text arrives as several "data:" lines of one event.
+      const events = buffered.split("\n\n");
+      buffered = events.pop();
+      for (const evt of events) {
+        const dataLines = evt
+          .split("\n")
+          .filter((line) => line.startsWith("data:"))
+          .map((line) => line.slice(line.startsWith("data: ") ? 6 : 5));
+        if (!dataLines.length) continue;
+        const payload = dataLines.join("\n");
         if (payload === "[END]") {
           if (bubble) bubble.dataset.partial = "done";
           if (typingBubble) typingBubble.remove();
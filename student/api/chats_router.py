@@ -1,8 +1,8 @@
 # student/api/chats_router.py
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, Request, HTTPException, Query
 from fastapi.responses import JSONResponse
-from typing import Dict
-from student.utils.chat_memory_impl import (
+from typing import Dict, Optional
+from student.utils.chat_memory_async import (
     create_chat, list_chats, get_history, delete_chat, rename_chat
 )
 
@@ -15,34 +15,48 @@ def _get_user_id():
 
 
 @router.get("/api/chats")
-async def api_list_chats():
+async def api_list_chats(limit: int = Query(100, ge=1, le=500), cursor: Optional[str] = None):
+    """Chats, most recent first; pass ``next_cursor`` back as ``cursor`` for more."""
+    if cursor is not None:
+        try:
+            float(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
     user_id = _get_user_id()
-    chats = list_chats(user_id)
-    return {"chats": chats}
+    return await list_chats(user_id, limit=limit, cursor=cursor)
 
 
 @router.post("/api/chats/new")
 async def api_create_chat(payload: Dict):
     user_id = _get_user_id()
     title = payload.get("title") if payload else None
-    cid = create_chat(user_id, title)
+    cid = await create_chat(user_id, title)
     return {"chat_id": cid, "title": title or f"Chat {cid[:6]}"}
 
 
 @router.get("/api/chats/{chat_id}")
-async def api_get_chat(chat_id: str):
+async def api_get_chat(
+    chat_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+):
+    """The newest ``limit`` messages, or those before seq ``before``.
+
+    ``next_before`` pages further back; it is None at the start of the chat.
+    """
     user_id = _get_user_id()
-    history = get_history(user_id, chat_id)
+    history = await get_history(user_id, chat_id, limit=limit, before=before)
     if history is None:
         raise HTTPException(status_code=404, detail="Chat not found")
     title = None  # optional: get title if you need
-    return {"chat_id": chat_id, "title": title, "history": history}
+    next_before = history[0]["seq"] if history and history[0]["seq"] > 1 and len(history) == limit else None
+    return {"chat_id": chat_id, "title": title, "history": history, "next_before": next_before}
 
 
 @router.delete("/api/chats/{chat_id}")
 async def api_delete_chat(chat_id: str):
     user_id = _get_user_id()
-    delete_chat(user_id, chat_id)
+    await delete_chat(user_id, chat_id)
     return JSONResponse({"status": "ok"})
 
 
@@ -52,5 +66,5 @@ async def api_rename_chat(chat_id: str, payload: Dict):
     title = (payload or {}).get("title")
     if not title:
         raise HTTPException(status_code=400, detail="missing title")
-    rename_chat(user_id, chat_id, title)
+    await rename_chat(user_id, chat_id, title)
     return {"status": "ok", "chat_id": chat_id, "title": title}
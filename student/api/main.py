@@ -1,5 +1,6 @@
 import student.core.chromadb_compat  # MUST be first to patch chromadb
 
+import asyncio
 from pathlib import Path
 
 from fastapi import FastAPI
@@ -10,12 +11,15 @@ from sqlalchemy.exc import SQLAlchemyError
 from fastapi.middleware.cors import CORSMiddleware
 
 from student.core.database import create_tables
-from student.doc_summarizer.endpoint import router
+from student.doc_summarizer.endpoint import queue_summary_backfill, router
+from student.doc_summarizer.services.embeddings import warm_models
 from student.routers import auth, students
 from student.routers import bulk_upload
 from student.api import ws_router
 from student.api.chats_router import router as chats_router
 from student.api.websocket_test import router as test_ws_router
+from student.utils import chat_memory_async, context_packing, executor, metrics, ollama_client
+from student.utils.post_processing import post_processor
 
 BASE_DIR = Path(__file__).resolve().parents[2]
 FRONTEND_DIR = BASE_DIR / "frontend"
@@ -24,7 +28,20 @@ FRONTEND_INDEX = FRONTEND_DIR / "index.html"
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_tables()
+    # Model loads (and downloads) must not happen inside a budgeted request.
+    await asyncio.gather(
+        executor.run_blocking(context_packing.load_tokenizer),
+        executor.run_blocking(warm_models),
+    )
+    await ollama_client.startup()
+    await chat_memory_async.startup()
+    await post_processor.start()
+    queue_summary_backfill()
     yield
+    await post_processor.stop()
+    await chat_memory_async.shutdown()
+    await ollama_client.shutdown()
+    executor.shutdown()
 
 # Create FastAPI app
 app = FastAPI(
@@ -56,6 +73,11 @@ app.include_router(chats_router, tags=["chats"])
 
 app.mount("/frontend", StaticFiles(directory=FRONTEND_DIR), name="frontend")
 
+@app.get("/api/metrics", tags=["metrics"])
+def read_metrics():
+    """In-process counters, gauges and latency percentiles."""
+    return metrics.snapshot()
+
 # Root endpoint now serves a simple frontend page. API docs remain available at `/docs`.
 @app.get("/")
 def read_root():
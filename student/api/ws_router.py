@@ -1,124 +1,143 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, StreamingResponse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
 import json
 import httpx
 import os
-
-# Chroma compatibility
-import student.core.chromadb_compat
-import chromadb
-student.core.chromadb_compat.restore_env()
+import time
 
 # Memory system
-from student.utils.chat_memory_impl import save_message, get_history
-from student.core.chroma_memory import add_memory, search_memory
+from student.utils.chat_memory_async import (
+    get_history,
+    get_llm_context,
+    get_summary,
+    save_llm_context,
+    save_message,
+)
+from student.core.chroma_memory import search_memory
+from student.utils.context_packing import (
+    LLM_CONTEXT_WINDOW,
+    Section,
+    pack_prompt,
+)
+from student.doc_summarizer.services.context_cache import chat_context, prefetch
 from student.doc_summarizer.services.embeddings import get_embed
+from student.utils.deadline import DeadlineExceeded, request_deadline, run_stage
+from student.utils.executor import run_blocking, submit_blocking
+from student.utils.ollama_client import GENERATE_ENDPOINT, get_async_client
+from student.utils import metrics
+from student.utils.post_processing import ChatTurn, post_processor
+from student.utils.singleflight import StreamFanout, flight_key
+from student.utils.sse import TokenCoalescer, sse_event
 
 router = APIRouter()
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL_NAME = "llama3.2"
 
-# --------------------------------------------------------
-#   VECTOR DB INIT
-# --------------------------------------------------------
-CHROMA_DB_DIR = "student/chroma_store"
-os.makedirs(CHROMA_DB_DIR, exist_ok=True)
-
-try:
-    chroma_client = chromadb.Client(
-        chromadb.config.Settings(
-            chroma_db_impl="duckdb+parquet",
-            persist_directory=CHROMA_DB_DIR
-        )
-    )
-
-    collection = chroma_client.get_or_create_collection(
-        name="documents",
-        metadata={"hnsw:space": "cosine"}
-    )
-
-    if not hasattr(collection, "_client"):
-        collection._client = chroma_client
-
-except Exception:
-    chroma_client = None
-    collection = None
-
+# Ask Ollama to keep the model (and its prompt cache) resident between turns.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# A reused context longer than this is dropped for a fresh, compact prompt.
+MAX_REUSED_CONTEXT_TOKENS = int(os.getenv("OLLAMA_MAX_REUSED_CONTEXT", 6000))
+# Messages of history considered for the prompt (before token packing).
+HISTORY_TURNS = 10
+# How often a streaming response checks whether its client is still there.
+DISCONNECT_POLL_SECONDS = float(os.getenv("SSE_DISCONNECT_POLL", 0.5))
+# Per-turn deadline and stage budgets (seconds). History, memory, summary and
+# the stored Ollama context are optional: past their budget the turn goes on
+# without them. Generation gets whatever is left.
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", 90))
+CHAT_REDIS_BUDGET = 1.0
+CHAT_EMBED_BUDGET = 5.0
+CHAT_MEMORY_BUDGET = 1.5
+CHAT_CONTEXT_BUDGET = 8.0
+CHAT_PACK_BUDGET = 3.0
 
 # --------------------------------------------------------
 #   LOAD CONTEXT FOR A GIVEN PDF FILE
 # --------------------------------------------------------
-def get_context_for_file(filename: str) -> str:
-    if not collection or not chroma_client:
-        return ""
+def get_context_for_file(filename: str, question: str, embedding) -> list:
+    """Parent passages of ``filename`` for ``question``, most relevant first.
 
+    Retrieved and reranked like ``/ask``, through the chat context cache.
+    """
     try:
-        embedding = get_embed().embed_query(filename)
-
-        try:
-            max_results = chroma_client._count(collection.id)
-        except Exception:
-            max_results = 5
-
-        if max_results == 0:
-            return ""
-
-        n = min(5, max_results)
-
-        results = chroma_client._query(
-            collection.id,
-            query_embeddings=[embedding],
-            n_results=n,
-            where={"source": filename}
-        )
-
-        docs = results.get("documents", [[]])[0]
-        return "\n\n".join(docs)
-
+        return chat_context(filename, question, embedding)
     except Exception as exc:
         print("[context_loader] Context load error:", exc)
-        return ""
+        return []
 
 
 # --------------------------------------------------------
 #   STREAM OLLAMA (Server → Client Tokens)
 # --------------------------------------------------------
-async def stream_ollama(prompt: str):
+async def stream_ollama(prompt: str, context=None, result=None):
+    """Stream tokens for ``prompt``.
+
+    ``context`` is the token context Ollama returned for the previous turn;
+    passing it means ``prompt`` only has to carry what is new. When a
+    ``result`` dict is given, the final context (or an error) is stored in it.
+    """
     payload = {
         "model": MODEL_NAME,
         "prompt": prompt,
         "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
     }
+    if context:
+        payload["context"] = context
 
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", OLLAMA_URL, json=payload) as response:
-
+    client = get_async_client()
+    async with client.stream("POST", GENERATE_ENDPOINT, json=payload) as response:
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as exc:
+            if result is not None:
+                result["error"] = exc.response.status_code
+            yield json.dumps({"error": f"Ollama error: {exc.response.status_code}"})
+            return
+
+        async for line in response.aiter_lines():
+            if not line:
+                continue
             try:
-                response.raise_for_status()
-            except httpx.HTTPStatusError as exc:
-                yield json.dumps({"error": f"Ollama error: {exc.response.status_code}"})
-                return
+                data = json.loads(line)
+            except ValueError:
+                continue
 
-            async for line in response.aiter_lines():
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                except ValueError:
-                    continue
+            if "response" in data:
+                yield data["response"]
 
-                if "response" in data:
-                    yield data["response"]
+            if data.get("done"):
+                if result is not None:
+                    result["context"] = data.get("context")
+                break
+
+
+_streams_in_flight = StreamFanout("chat_stream")
 
-                if data.get("done"):
-                    break
+
+def stream_generation(prompt: str, context=None, result=None):
+    """Stream tokens, sharing one Ollama generation between identical requests."""
+    key = flight_key(model=MODEL_NAME, prompt=prompt, context=context)
+    return _streams_in_flight.subscribe(
+        key,
+        lambda shared_result: stream_ollama(prompt, context=context, result=shared_result),
+        result,
+    )
 
 
 # --------------------------------------------------------
 #   NEW IMPROVED PROMPT
 # --------------------------------------------------------
-def build_prompt(question, source, context, history_text, semantic_text):
+def build_prompt(question, source, context, history_text, semantic_text, summary_text=None):
+
+    summary_block = f"""
+Earlier Conversation (summary):
+{summary_text}
+""" if summary_text is not None else ""
 
     return f"""
 You are a helpful assistant analyzing the PDF: "{source}".
@@ -137,7 +156,7 @@ Avoid:
 
 PDF Context:
 {context}
-
+{summary_block}
 Conversation History:
 {history_text}
 
@@ -151,60 +170,597 @@ Your answer:
 """
 
 
+def build_followup_prompt(question, source, context, semantic_text):
+    """Delta prompt for a turn that continues a reused Ollama context.
+
+    Instructions and history are already in the context, so only the new
+    document excerpts, memory and question are sent.
+    """
+
+    return f"""
+
+Follow-up about the PDF "{source}". Same instructions as before.
+
+PDF Context:
+{context}
+
+Relevant Memory:
+{semantic_text}
+
+User Question:
+{question}
+
+Your answer:
+"""
+
+
+def reusable_context(stored, source, last_seq):
+    """Return the stored Ollama context if it can continue this turn.
+
+    The context must end with the chat's latest message (``last_seq``);
+    one saved before a later message was written is stale.
+    """
+    if not stored:
+        return None
+    if stored.get("model") != MODEL_NAME or stored.get("source") != source:
+        return None
+    if stored.get("seq") != last_seq:
+        return None
+    context = stored.get("context")
+    # The follow-up prompt has to fit in what the reused context leaves free.
+    limit = min(MAX_REUSED_CONTEXT_TOKENS, LLM_CONTEXT_WINDOW // 2)
+    if not context or len(context) > limit:
+        return None
+    return context
+
+
+def passage_hash(passage: str) -> str:
+    return hashlib.sha1(passage.encode("utf-8")).hexdigest()[:16]
+
+
+def _sent_passages(section: Section) -> List[str]:
+    """Hashes of the passages packed whole (a cut last one does not count)."""
+    whole = section.next_item - (1 if section.cut_cost else 0)
+    return [passage_hash(p) for p in section.items[:whole]]
+
+
+def pack_chat_prompt(
+    question, source, passages, history, semantic, llm_context=None, summary=None, sent=()
+):
+    """Build the chat prompt within the model's token budget.
+
+    Document passages come most relevant first, history most recent first,
+    memory as retrieved. ``summary`` is the chat's running summary of the
+    messages before ``history``. With a reused ``llm_context`` only the
+    follow-up delta is packed, into the window the context leaves free;
+    passages whose hash is in ``sent`` are already in that context and are
+    left out. Returns ``(prompt, usage, sent)``, ``sent`` being the hashes of
+    the passages the context holds after this turn.
+    """
+    memory_section = Section("memory", semantic or [], share=0.1, separator="\n")
+
+    if llm_context:
+        sent = list(sent)
+        passages_section = Section(
+            "context", [p for p in passages if passage_hash(p) not in set(sent)], share=0.6
+        )
+        packed = pack_prompt(
+            build_followup_prompt("", source, "", ""),
+            question,
+            [passages_section, memory_section],
+            window=LLM_CONTEXT_WINDOW - len(llm_context),
+        )
+        prompt = build_followup_prompt(
+            question, source, packed.text("context"), packed.text("memory")
+        )
+        packed.usage["reused_context"] = len(llm_context)
+        packed.usage["passages_already_sent"] = len(passages) - len(passages_section.items)
+        return prompt, packed.usage, sent + _sent_passages(passages_section)
+
+    passages_section = Section("context", passages, share=0.6)
+    lines = [f"{h['role']}: {h['message']}" for h in reversed(history)]
+    history_section = Section(
+        "history", lines, share=0.2 if summary else 0.3, separator="\n", chronological=True
+    )
+    sections = [passages_section, history_section, memory_section]
+    if summary:
+        sections.append(Section("summary", [summary], share=0.1))
+    packed = pack_prompt(
+        build_prompt("", source, "", "", "", summary_text="" if summary else None),
+        question,
+        sections,
+    )
+    prompt = build_prompt(
+        question,
+        source,
+        packed.text("context"),
+        packed.text("history"),
+        packed.text("memory"),
+        summary_text=packed.text("summary") if summary else None,
+    )
+    return prompt, packed.usage, _sent_passages(passages_section)
+
+
+async def watch_disconnect(request: Request, gone: asyncio.Event):
+    """Set ``gone`` once the client behind ``request`` has gone away.
+
+    Waiting on the next token never notices a closed tab, so without this a
+    stream keeps Ollama generating until the answer is complete.
+    """
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    gone.set()
+
+
+async def until_set(tokens, gone: asyncio.Event):
+    """Yield from ``tokens`` until ``gone`` is set, then stop waiting.
+
+    The pending read is cancelled, which closes the upstream stream (and
+    Ollama's response, so generation stops). The task running the stream is
+    left alone; it belongs to the server.
+    """
+    iterator = tokens.__aiter__()
+    stop = asyncio.ensure_future(gone.wait())
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({step, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                return
+            try:
+                token = step.result()
+            except StopAsyncIteration:
+                return
+            yield token
+    finally:
+        stop.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+            await asyncio.gather(step, return_exceptions=True)
+
+
+def record_cancelled(tokens_sent: int):
+    """Count a generation abandoned by its client.
+
+    Tokens saved are estimated from the median length of completed replies.
+    """
+    metrics.incr("chat.cancelled")
+    typical = metrics.percentile("chat.reply_tokens", 50)
+    if typical is not None:
+        metrics.incr("chat.tokens_saved_estimate", max(0, typical - tokens_sent))
+
+
 # --------------------------------------------------------
-#                 SSE / HTTP STREAM
+#             TURN PREPARATION (SSE + WEBSOCKET)
 # --------------------------------------------------------
-@router.post("/chat/stream")
-async def http_chat(request: Request):
+@dataclass
+class PreparedTurn:
+    """A chat turn with its prompt built, ready to stream."""
+
+    user_id: str
+    chat_id: str
+    question: str
+    source: str
+    prompt: str
+    llm_context: Optional[list]
+    usage: dict
+    # The question's vector, computed once and reused for the memory insert.
+    embedding: Optional[list] = None
+    # Hashes of the passages in Ollama's context once this turn is done.
+    passages_sent: List[str] = field(default_factory=list)
+
+    def tokens(self, result):
+        """Stream the answer; ``result`` receives Ollama's final context."""
+        return stream_generation(self.prompt, context=self.llm_context, result=result)
+
+    def finished(self, reply_parts, result=None) -> ChatTurn:
+        """The post-processing work for this turn.
+
+        Without a complete ``result`` (error, cancelled) the stored Ollama
+        context is reset so the next turn sends a full prompt.
+        """
+        next_context = None
+        if result and result.get("context") and not result.get("error"):
+            next_context = {
+                "model": MODEL_NAME,
+                "source": self.source,
+                "context": result["context"],
+                "passages": self.passages_sent,
+            }
+        return ChatTurn(
+            user_id=self.user_id,
+            chat_id=self.chat_id,
+            question=self.question,
+            reply="".join(reply_parts),
+            remember=len(self.question.split()) > 4,
+            llm_context=next_context,
+            reset_context=next_context is None,
+            embedding=self.embedding,
+        )
+
+
+async def complete_turn(turn: PreparedTurn, reply_parts, result) -> None:
+    """Save the reply before the stream ends; queue the memory work.
+
+    A follow-up sent right after ``[END]`` (or ``end``) must find the reply
+    in the history, after its question, and the context that ends with it.
+    """
+    finished = turn.finished(reply_parts, result)
+    saved = await save_message(finished.user_id, finished.chat_id, "assistant", finished.reply)
+    finished.reply_saved = saved is not None
+
+    # The Ollama context is stored inline as well, tagged with the reply's
+    # seq: the next turn reuses it only if nothing was written after it.
+    next_context = finished.llm_context if saved else None
+    if next_context:
+        next_context["seq"] = saved["seq"]
+    await save_llm_context(finished.user_id, finished.chat_id, next_context)
+    finished.llm_context, finished.reset_context = None, False
+
+    await post_processor.finish(finished)
 
+
+def missing_field(body) -> Optional[str]:
+    """Return an error for the first required chat field that is absent."""
+    for name in ("chat_id", "question", "source"):
+        if not body.get(name):
+            return f"missing {name}"
+    return None
+
+
+def embed_question(question: str):
+    """The question's bge-m3 vector. Required: a failure fails the turn."""
+    return get_embed().embed_query(question)
+
+
+async def retrieve(user_id, question, source):
+    """Embed the question once; search memory and the document with it.
+
+    Returns ``(embedding, memories, passages)``.
+    """
+    embedding = await run_stage(
+        "embed", run_blocking(embed_question, question), CHAT_EMBED_BUDGET
+    )
+    semantic, passages = await asyncio.gather(
+        run_stage(
+            "memory",
+            run_blocking(search_memory, user_id, question, embedding),
+            CHAT_MEMORY_BUDGET,
+            optional=True,
+            default=[],
+        ),
+        run_stage(
+            "context",
+            run_blocking(get_context_for_file, source, question, embedding),
+            CHAT_CONTEXT_BUDGET,
+        ),
+    )
+    return embedding, semantic, passages
+
+
+async def prepare_turn(user_id, chat_id, question, source) -> PreparedTurn:
+    """Save the question and build the prompt for one chat turn."""
+
+    # Redis calls are async; Chroma and the embedder are blocking and run
+    # on the bounded pool, so this request never stalls the event loop.
+    # History is read alongside the save, so the new question is appended
+    # locally. Each step runs under its stage budget (see CHAT_*_BUDGET).
+    saved, history, retrieved, stored_llm_context, summary = await asyncio.gather(
+        run_stage(
+            "save_question",
+            save_message(user_id, chat_id, "user", question),
+            CHAT_REDIS_BUDGET,
+            optional=True,
+        ),
+        run_stage(
+            "history",
+            get_history(user_id, chat_id, limit=HISTORY_TURNS + 1),
+            CHAT_REDIS_BUDGET,
+            optional=True,
+            default=[],
+        ),
+        retrieve(user_id, question, source),
+        run_stage(
+            "llm_context", get_llm_context(user_id, chat_id), CHAT_REDIS_BUDGET, optional=True
+        ),
+        run_stage("summary", get_summary(user_id, chat_id), CHAT_REDIS_BUDGET, optional=True),
+    )
+    embedding, semantic, passages = retrieved
+
+    # Messages the running summary already covers are sent only as summary.
+    saved_id = saved["id"] if saved else None
+    history = [h for h in history if h.get("id") != saved_id]
+    last_seq = history[-1]["seq"] if history else 0
+    summary_seq = summary["seq"] if summary else 0
+    history = [h for h in history if h["seq"] > summary_seq]
+    history = (history + [{"role": "user", "message": question}])[-HISTORY_TURNS:]
+
+    # Continue Ollama's context from the last turn when we still have it, so
+    # the history is not prefilled again; otherwise send the full prompt.
+    llm_context = reusable_context(stored_llm_context, source, last_seq)
+    sent = (stored_llm_context.get("passages") or []) if llm_context else []
+    prompt, usage, passages_sent = await run_stage(
+        "pack",
+        run_blocking(
+            pack_chat_prompt,
+            question,
+            source,
+            passages,
+            history,
+            semantic,
+            llm_context,
+            summary["text"] if summary else None,
+            sent,
+        ),
+        CHAT_PACK_BUDGET,
+    )
+    print(f"[chat] prompt tokens: {usage}")
+    return PreparedTurn(
+        user_id, chat_id, question, source, prompt, llm_context, usage, embedding, passages_sent
+    )
+
+
+# --------------------------------------------------------
+#                 CONTEXT PREFETCH
+# --------------------------------------------------------
+@router.post("/chat/prefetch")
+async def http_prefetch(request: Request):
+    """Warm a document's vectors when a chat selects it (fire and forget)."""
     try:
         body = await request.json()
     except:
         return JSONResponse({"error": "invalid json"}, status_code=400)
 
-    chat_id = body.get("chat_id")
-    question = body.get("question")
-    source = body.get("source")
-
-    if not chat_id:
-        return JSONResponse({"error": "missing chat_id"}, status_code=400)
-
-    if not question:
-        return JSONResponse({"error": "missing question"}, status_code=400)
-
-    if not source:
+    if not body.get("source"):
         return JSONResponse({"error": "missing source"}, status_code=400)
 
-    user_id = "user123"
+    submit_blocking(prefetch, body["source"])
+    return JSONResponse({"status": "warming"}, status_code=202)
 
-    save_message(user_id, chat_id, "user", question)
 
-    history = get_history(user_id, chat_id)[-10:]
-    history_text = "\n".join(f"{h['role']}: {h['message']}" for h in history)
+# --------------------------------------------------------
+#                 SSE / HTTP STREAM
+# --------------------------------------------------------
+@router.post("/chat/stream")
+async def http_chat(request: Request):
 
-    semantic = search_memory(user_id, question)
-    semantic_text = "\n".join(semantic) if semantic else ""
+    try:
+        body = await request.json()
+    except:
+        return JSONResponse({"error": "invalid json"}, status_code=400)
 
-    context = get_context_for_file(source)
+    error = missing_field(body)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
 
-    prompt = build_prompt(question, source, context, history_text, semantic_text)
+    user_id = "user123"
+    with request_deadline(CHAT_DEADLINE_SECONDS, "chat") as deadline:
+        try:
+            turn = await prepare_turn(user_id, body["chat_id"], body["question"], body["source"])
+        except DeadlineExceeded as exc:
+            print(f"[chat] {exc}: {deadline.report()}")
+            return JSONResponse({"error": str(exc), "timings": deadline.report()}, status_code=504)
+        except Exception as exc:
+            # A required stage failed (the embedder, most likely).
+            print(f"[chat] turn preparation failed: {exc}: {deadline.report()}")
+            return JSONResponse(
+                {"error": f"could not prepare the answer: {exc}", "timings": deadline.report()},
+                status_code=503,
+            )
 
     async def event_generator():
 
-        reply_text = ""
+        # Tokens are grouped into frames; reply_parts still gets every token.
+        coalescer = TokenCoalescer()
+        reply_parts = coalescer.parts
+        result = {}
+        gone = asyncio.Event()
+        watcher = asyncio.create_task(watch_disconnect(request, gone))
+
+        # The generator runs after the endpoint returned, so the deadline is
+        # passed explicitly; it bounds the wait for every token.
+        tokens = deadline.stream("generate", turn.tokens(result))
+        try:
+            async for chunk in coalescer.chunks(until_set(tokens, gone)):
+                if gone.is_set():
+                    break
+                yield sse_event(chunk)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server closed the response: keep what was produced so far.
+            record_cancelled(len(reply_parts))
+            post_processor.finish_nowait(turn.finished(reply_parts))
+            raise
+        except Exception as exc:
+            result["error"] = str(exc)
+            yield sse_event(json.dumps({"error": str(exc)}))
+        finally:
+            watcher.cancel()
+
+        if gone.is_set():
+            # The client left and the upstream stream was closed (Ollama
+            # stops generating); keep what was produced so far.
+            record_cancelled(len(reply_parts))
+            post_processor.finish_nowait(turn.finished(reply_parts))
+            return
+
+        metrics.observe("chat.reply_tokens", len(reply_parts))
+        if coalescer.frames:
+            metrics.observe("chat.tokens_per_frame", len(reply_parts) / coalescer.frames)
+
+        await complete_turn(turn, reply_parts, result)
+        print(f"[chat] timings: {deadline.report()}")
+
+        yield sse_event("[END]")
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"X-Prompt-Tokens": str(turn.usage["total"])},
+    )
 
+
+# --------------------------------------------------------
+#                 WEBSOCKET CHAT
+# --------------------------------------------------------
+# Messages, all JSON objects with a "type":
+#   client -> server  ask {chat_id, question, source}, stop {chat_id}, ping, pong
+#   server -> client  token {chat_id, data}, end {chat_id, usage, timings},
+#                     stopped {chat_id}, error {chat_id?, error}, ping, pong
+# One connection carries any number of turns; turns for different chat_ids
+# stream concurrently, one at a time per chat_id.
+
+# Token messages waiting for a slow client. When full, the turn stops reading
+# tokens; Ollama keeps generating (the shared stream may have other readers)
+# and the rest of the answer is buffered, so memory is bounded by its length.
+# Control messages (stopped, error, end, pong) are never dropped or held back.
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", 256))
+# Idle connections are pinged; one with no running turn and silent for
+# WS_IDLE_TIMEOUT is closed.
+WS_PING_SECONDS = float(os.getenv("WS_PING_SECONDS", 20))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", 60))
+
+
+class ChatConnection:
+    """Per-connection state: running turns and the outgoing queue."""
+
+    def __init__(self, websocket: WebSocket, user_id: str) -> None:
+        self.websocket = websocket
+        self.user_id = user_id
+        # Unbounded; token messages are limited by ``credits`` instead, so
+        # control messages can always be queued.
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.credits = asyncio.Semaphore(WS_SEND_QUEUE)
+        self.turns: Dict[str, asyncio.Task] = {}
+
+    async def send(self, message: dict) -> None:
+        self.outbox.put_nowait((message, False))
+
+    async def send_token(self, message: dict) -> None:
+        """Queue a token message, waiting while WS_SEND_QUEUE are unsent."""
+        await self.credits.acquire()
+        self.outbox.put_nowait((message, True))
+
+    def send_nowait(self, message: dict) -> None:
+        """Queue a message from a context that cannot wait (cancellation)."""
+        self.outbox.put_nowait((message, False))
+
+    async def sender(self) -> None:
+        """Write queued messages; ping when nothing has been sent for a while."""
+        try:
+            while True:
+                try:
+                    message, token = await asyncio.wait_for(self.outbox.get(), WS_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    message, token = {"type": "ping"}, False
+                await self.websocket.send_text(json.dumps(message))
+                if token:
+                    self.credits.release()
+        except (WebSocketDisconnect, RuntimeError):
+            # The receive loop sees the disconnect and cleans up.
+            pass
+
+    async def ask(self, body: dict) -> None:
+        chat_id = body["chat_id"]
+        running = self.turns.get(chat_id)
+        if running and not running.done():
+            await self.send({"type": "error", "chat_id": chat_id, "error": "turn in progress"})
+            return
+        task = asyncio.create_task(self.run_turn(body))
+        self.turns[chat_id] = task
+        task.add_done_callback(lambda _: self._forget(chat_id, task))
+
+    def _forget(self, chat_id: str, task: asyncio.Task) -> None:
+        if self.turns.get(chat_id) is task:
+            del self.turns[chat_id]
+
+    def stop(self, chat_id: str) -> None:
+        running = self.turns.get(chat_id)
+        if running and not running.done():
+            running.cancel()
+
+    async def run_turn(self, body: dict) -> None:
+        chat_id = body["chat_id"]
+        coalescer = TokenCoalescer()
+        reply_parts = coalescer.parts
+        result = {}
+        started = time.perf_counter()
+        turn = None
+        deadline = None
         try:
-            async for token in stream_ollama(prompt):
-                reply_text += token
-                yield f"data: {token}\n\n"
+            with request_deadline(CHAT_DEADLINE_SECONDS, "chat") as deadline:
+                turn = await prepare_turn(self.user_id, chat_id, body["question"], body["source"])
+                tokens = deadline.stream("generate", turn.tokens(result))
+                async for chunk in coalescer.chunks(tokens):
+                    if coalescer.frames == 1:
+                        metrics.observe("chat.ws.ttft", time.perf_counter() - started)
+                    await self.send_token({"type": "token", "chat_id": chat_id, "data": chunk})
+        except asyncio.CancelledError:
+            if turn is not None:
+                record_cancelled(len(reply_parts))
+                post_processor.finish_nowait(turn.finished(reply_parts))
+            self.send_nowait({"type": "stopped", "chat_id": chat_id})
+            raise
         except Exception as exc:
-            yield f"data: {json.dumps({'error': str(exc)})}\n\n"
+            result["error"] = str(exc)
+            await self.send({"type": "error", "chat_id": chat_id, "error": str(exc)})
+            if isinstance(exc, DeadlineExceeded):
+                print(f"[chat] {exc}: {deadline.report()}")
+            if turn is None:
+                return
+
+        metrics.observe("chat.reply_tokens", len(reply_parts))
+        await complete_turn(turn, reply_parts, result)
+        await self.send(
+            {"type": "end", "chat_id": chat_id, "usage": turn.usage, "timings": deadline.report()}
+        )
 
-        save_message(user_id, chat_id, "assistant", reply_text)
+    def close(self) -> None:
+        for task in list(self.turns.values()):
+            task.cancel()
 
-        if len(question.split()) > 4:
-            add_memory(user_id, question)
 
-        yield "data: [END]\n\n"
+@router.websocket("/ws/chat")
+async def ws_chat(websocket: WebSocket):
+    await websocket.accept()
+    connection = ChatConnection(websocket, "user123")
+    sender = asyncio.create_task(connection.sender())
+    metrics.incr("chat.ws.connections")
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if connection.turns:
+                    # Answers are streaming; a client that only reads is not idle.
+                    continue
+                await websocket.close(code=1001)
+                break
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                await connection.send({"type": "error", "error": "invalid json"})
+                continue
+
+            kind = body.get("type")
+            if kind == "ask":
+                error = missing_field(body)
+                if error:
+                    await connection.send({"type": "error", "chat_id": body.get("chat_id"), "error": error})
+                else:
+                    await connection.ask(body)
+            elif kind == "stop":
+                connection.stop(body.get("chat_id"))
+            elif kind == "ping":
+                await connection.send({"type": "pong"})
+            elif kind != "pong":
+                await connection.send({"type": "error", "error": f"unknown type {kind!r}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connection.close()
+        sender.cancel()
+        metrics.incr("chat.ws.disconnects")
@@ -1,85 +1,349 @@
+"""Semantic chat memory, one Chroma collection per user.
+
+Each user's memories live in their own collection, so a search only ever
+touches that user's vectors. Every collection is capped: past
+MEMORY_MAX_PER_USER entries the least recently used ones (inserted, merged
+or returned by a search) are evicted. A new memory that nearly repeats an
+existing one is merged into it instead of being stored again. Collection
+handles and entry counts are cached in-process. Search hits are buffered
+and written to their entries' ``last_used`` by :func:`flush_recency` (run
+by the post-processing queue), so recency is shared by every process and
+survives restarts.
+
+Memories from the old shared ``chat_memory`` collection are moved into the
+user's collection the first time that user is seen.
+"""
+import hashlib
 import os
+import re
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import chromadb
+import numpy as np
 
 from student.doc_summarizer.services.embeddings import get_embed
 
 CHROMA_DB_DIR = "student/chroma_store"
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
+# Entries kept per user; eviction trims a further tenth so it runs rarely.
+MEMORY_MAX_PER_USER = int(os.getenv("CHAT_MEMORY_MAX_PER_USER", 500))
+# Cosine distance under which a new memory is merged into an existing one.
+MEMORY_MERGE_DISTANCE = float(os.getenv("CHAT_MEMORY_MERGE_DISTANCE", 0.08))
+# User collections whose handle and count stay cached.
+MEMORY_CACHED_USERS = int(os.getenv("CHAT_MEMORY_CACHED_USERS", 1024))
+
+LEGACY_COLLECTION = "chat_memory"
+
 try:
     chroma_client = chromadb.Client(chromadb.config.Settings(
         chroma_db_impl="duckdb+parquet",
         persist_directory=CHROMA_DB_DIR
     ))
-
-    collection = chroma_client.get_or_create_collection(
-        name="chat_memory",
-        metadata={"hnsw:space": "cosine"}
-    )
-
-    if not hasattr(collection, "_client"):
-        collection._client = chroma_client
 except Exception as exc:
     chroma_client = None
-    collection = None
 
 
-def add_memory(user_id: str, text: str):
-    """Add a short memory (text) for a user into the `chat_memory` collection."""
-    if collection is None:
-        raise RuntimeError("Chroma client not initialized")
+class _UserMemory:
+    """Cached state of one user's collection."""
+
+    def __init__(self, user_id: str, collection, count: int):
+        self.user_id = user_id
+        self.collection = collection
+        self.count = count
+        self.lock = threading.Lock()
+
+
+_users: "OrderedDict[str, _UserMemory]" = OrderedDict()
+_users_lock = threading.Lock()
+# Serializes opening collections, so a user's legacy entries move once.
+_open_lock = threading.Lock()
+_legacy_empty = False
+# Search hits per user not yet written to the entries' last_used.
+_touched: Dict[str, Dict[str, float]] = {}
+_touched_lock = threading.Lock()
+
+
+def _collection_name(user_id: str) -> str:
+    """Chroma collection name for a user (3-63 chars, alphanumeric ends)."""
+    if re.fullmatch(r"[A-Za-z0-9_-]{0,39}[A-Za-z0-9]", user_id):
+        return f"chat_memory_{user_id}"
+    digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:20]
+    return f"chat_memory_h_{digest}"
+
+
+def _user_memory(user_id: str) -> _UserMemory:
+    """Open (and cache) a user's collection."""
+    with _users_lock:
+        memory = _users.get(user_id)
+        if memory is not None:
+            _users.move_to_end(user_id)
+            return memory
 
+    with _open_lock:
+        with _users_lock:
+            memory = _users.get(user_id)
+        if memory is not None:
+            return memory
+
+        collection = chroma_client.get_or_create_collection(
+            name=_collection_name(user_id),
+            metadata={"hnsw:space": "cosine"}
+        )
+        if not hasattr(collection, "_client"):
+            collection._client = chroma_client
+        memory = _UserMemory(user_id, collection, chroma_client._count(collection.id))
+        _adopt_legacy(user_id, memory)
+
+        with _users_lock:
+            _users[user_id] = memory
+            while len(_users) > MEMORY_CACHED_USERS:
+                _users.popitem(last=False)
+    return memory
+
+
+def _adopt_legacy(user_id: str, memory: _UserMemory) -> None:
+    """Move the user's entries out of the old shared collection."""
+    global _legacy_empty
+    if _legacy_empty:
+        return
     try:
-        embedder = get_embed()
-        embeddings = embedder.embed_documents([text])
-    except Exception as exc:
-        print(f"[chroma_memory] embedding error: {exc}")
+        legacy = chroma_client.get_collection(LEGACY_COLLECTION)
+    except Exception:
+        _legacy_empty = True
+        return
+    if chroma_client._count(legacy.id) == 0:
+        _legacy_empty = True
         return
 
-    doc_id = f"{user_id}_{uuid.uuid4()}"
-
+    found = chroma_client._get(
+        legacy.id,
+        where={"user_id": user_id},
+        include=["embeddings", "metadatas", "documents"],
+    )
+    ids = found.get("ids") or []
+    if not ids:
+        return
+    # Old entries carry no timestamps; their order stands in for age.
+    now = time.time()
     chroma_client._add(
-        [doc_id],
-        collection.id,
-        embeddings,
-        [{"user_id": user_id}],
-        [text]
+        ids,
+        memory.collection.id,
+        found["embeddings"],
+        [_metadata(user_id, now - len(ids) + i) for i in range(len(ids))],
+        found["documents"],
     )
+    chroma_client._delete(legacy.id, ids=ids)
+    memory.count += len(ids)
+    _evict(memory)
+    print(f"[chroma_memory] moved {len(ids)} memories of {user_id} to their own collection")
+
+
+def _metadata(user_id: str, now: float, hits: int = 1) -> Dict:
+    return {"user_id": user_id, "last_used": now, "hits": hits}
+
+
+def _normalized(embeddings) -> np.ndarray:
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
 
 
-def search_memory(user_id: str, query: str):
-    """Search the `chat_memory` collection for entries relevant to `query`.
+def _merge_batch(texts: List[str], embeddings) -> List[int]:
+    """Indexes to keep from one user's batch, dropping near-repeats of later items."""
+    if len(texts) < 2:
+        return list(range(len(texts)))
+    vectors = _normalized(embeddings)
+    similarity = vectors @ vectors.T
+    keep = []
+    for i in range(len(texts)):
+        later = similarity[i, i + 1:]
+        if not (later.size and later.max() >= 1.0 - MEMORY_MERGE_DISTANCE):
+            keep.append(i)
+    return keep
 
+
+def _store(user_id: str, texts: List[str], embeddings) -> None:
+    """Insert one user's memories, merging near-duplicates, then enforce the cap."""
+    memory = _user_memory(user_id)
+    keep = _merge_batch(texts, embeddings)
+    texts = [texts[i] for i in keep]
+    embeddings = [embeddings[i] for i in keep]
+    now = time.time()
+
+    with memory.lock:
+        new_ids, new_embeddings, new_texts = [], [], []
+        matches = None
+        if memory.count:
+            matches = chroma_client._query(
+                memory.collection.id,
+                query_embeddings=embeddings,
+                n_results=1,
+                include=["metadatas", "distances"],
+            )
+        for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+            if matches and matches["ids"][i] and matches["distances"][i][0] <= MEMORY_MERGE_DISTANCE:
+                # The newer wording replaces the old one and refreshes it.
+                hits = (matches["metadatas"][i][0] or {}).get("hits", 1) + 1
+                chroma_client._update(
+                    memory.collection.id,
+                    [matches["ids"][i][0]],
+                    embeddings=[embedding],
+                    metadatas=[_metadata(user_id, now, hits)],
+                    documents=[text],
+                )
+                continue
+            new_ids.append(f"{user_id}_{uuid.uuid4()}")
+            new_embeddings.append(embedding)
+            new_texts.append(text)
+
+        if new_ids:
+            chroma_client._add(
+                new_ids,
+                memory.collection.id,
+                new_embeddings,
+                [_metadata(user_id, now) for _ in new_ids],
+                new_texts,
+            )
+            memory.count += len(new_ids)
+        _evict(memory)
+
+
+def _evict(memory: _UserMemory) -> None:
+    """Drop least recently used entries once the collection is over its cap."""
+    if memory.count <= MEMORY_MAX_PER_USER:
+        return
+    found = chroma_client._get(memory.collection.id, include=["metadatas"])
+    ids = found.get("ids") or []
+    with _touched_lock:
+        touched = dict(_touched.get(memory.user_id, {}))
+    recency = {
+        doc_id: max((meta or {}).get("last_used", 0), touched.get(doc_id, 0))
+        for doc_id, meta in zip(ids, found.get("metadatas") or [])
+    }
+    target = MEMORY_MAX_PER_USER - MEMORY_MAX_PER_USER // 10
+    victims = sorted(ids, key=lambda doc_id: recency.get(doc_id, 0))[:max(0, len(ids) - target)]
+    if victims:
+        chroma_client._delete(memory.collection.id, ids=victims)
+        with _touched_lock:
+            pending = _touched.get(memory.user_id, {})
+            for doc_id in victims:
+                pending.pop(doc_id, None)
+    memory.count = len(ids) - len(victims)
+
+
+def add_memory(user_id: str, text: str, embedding: Optional[List[float]] = None):
+    """Add a short memory (text) for a user."""
+    add_memories([(user_id, text)], [embedding])
+
+
+def add_memories(
+    items: List[Tuple[str, str]],
+    embeddings: Optional[Sequence[Optional[List[float]]]] = None,
+):
+    """Add several ``(user_id, text)`` memories with one embedding pass.
+
+    ``embeddings`` may carry vectors already computed for some items (None
+    for the rest); only the missing ones are embedded.
+    """
+    if chroma_client is None:
+        raise RuntimeError("Chroma client not initialized")
+    if not items:
+        return
+
+    embeddings = list(embeddings) if embeddings is not None else [None] * len(items)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        try:
+            embedder = get_embed()
+            computed = embedder.embed_documents([items[i][1] for i in missing])
+        except Exception as exc:
+            print(f"[chroma_memory] embedding error: {exc}")
+            return
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+
+    per_user: Dict[str, Tuple[List[str], List]] = {}
+    for (user_id, text), embedding in zip(items, embeddings):
+        texts, vectors = per_user.setdefault(user_id, ([], []))
+        texts.append(text)
+        vectors.append(embedding)
+    for user_id, (texts, vectors) in per_user.items():
+        _store(user_id, texts, vectors)
+
+
+def search_memory(user_id: str, query: str, embedding: Optional[List[float]] = None):
+    """Search the user's memories for entries relevant to ``query``.
+
+    ``embedding`` is the query's vector when the caller already has it.
     Returns a list of matching document texts (may be empty).
     """
-    if collection is None:
+    if chroma_client is None:
         return []
 
     try:
-        embedder = get_embed()
-        query_embed = embedder.embed_query(query)
-
-        try:
-            max_results = chroma_client._count(collection.id)
-        except Exception:
-            max_results = 3
-
-        if max_results == 0:
+        memory = _user_memory(user_id)
+        if memory.count == 0:
             return []
 
-        n_results = min(3, max_results)
+        query_embed = embedding
+        if query_embed is None:
+            query_embed = get_embed().embed_query(query)
 
         results = chroma_client._query(
-            collection.id,
+            memory.collection.id,
             query_embeddings=[query_embed],
-            n_results=n_results,
-            where={"user_id": user_id}
+            n_results=min(3, memory.count),
+            include=["documents"],
         )
 
+        now = time.time()
+        with _touched_lock:
+            pending = _touched.setdefault(user_id, {})
+            for doc_id in (results.get("ids") or [[]])[0]:
+                pending[doc_id] = now
+
         docs = results.get("documents", [[]])[0]
         return docs or []
 
     except Exception as exc:
         print(f"[chroma_memory] search error: {exc}")
         return []
+
+
+def flush_recency() -> int:
+    """Write buffered search hits to their entries' ``last_used``.
+
+    Returns the number of entries updated. Hits that cannot be written are
+    dropped; recency is a hint for eviction, not data.
+    """
+    if chroma_client is None:
+        return 0
+    with _touched_lock:
+        pending = dict(_touched)
+        _touched.clear()
+
+    written = 0
+    for user_id, hits in pending.items():
+        try:
+            memory = _user_memory(user_id)
+            with memory.lock:
+                found = chroma_client._get(
+                    memory.collection.id, ids=list(hits), include=["metadatas"]
+                )
+                ids = found.get("ids") or []
+                if not ids:
+                    continue
+                metadatas = [
+                    {**(meta or {}), "last_used": max((meta or {}).get("last_used", 0), hits[doc_id])}
+                    for doc_id, meta in zip(ids, found.get("metadatas") or [])
+                ]
+                chroma_client._update(memory.collection.id, ids, metadatas=metadatas)
+                written += len(ids)
+        except Exception as exc:
+            print(f"[chroma_memory] recency write failed: {exc}")
+    return written
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, DateTime, Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -49,9 +49,52 @@ class Document(Base):
     content_type = Column(String(50))
     status = Column(String(20), default="pending")  # pending, processing, completed, failed
     error_message = Column(String(512), nullable=True)
+    chunk_count = Column(Integer, default=0)  # Chunks embedded and stored
+    chunks_dropped = Column(Integer, default=0)  # Near-duplicate chunks skipped
+    owner = Column(String(50), nullable=True, index=True)  # Uploader; re-uploads version in place
+    version = Column(Integer, default=1)
+    boilerplate = Column(Text, nullable=True)  # JSON list of stripped page-furniture lines
+
+class DocumentPage(Base):
+    __tablename__ = "document_pages"
+
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, nullable=False, index=True)
+    page_number = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    chunk_count = Column(Integer, default=0)
+    parent_count = Column(Integer, default=0)
+    chunks_dropped = Column(Integer, default=0)
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+def add_missing_columns():
+    """Add model columns missing from existing tables (idempotent).
+
+    ``create_all`` only creates tables, so a column added to a model would
+    otherwise break every query against an older database. New columns are
+    added as NULL; code reading them treats NULL as the default.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            added = [column for column in table.columns if column.name not in present]
+            for column in added:
+                conn.execute(text(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                    f"{column.type.compile(dialect=engine.dialect)} NULL"
+                ))
+                print(f"[database] added column {table.name}.{column.name}")
+            for index in table.indexes:
+                if any(column in added for column in index.columns):
+                    index.create(conn)
 
 def get_db():
     db = SessionLocal()
@@ -57,6 +57,10 @@ class DocumentResponse(BaseModel):
     file_size: int
     status: str
     error_message: Optional[str] = None
+    chunk_count: Optional[int] = None
+    chunks_dropped: Optional[int] = None
+    owner: Optional[str] = None
+    version: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -0,0 +1,37 @@
+"""Shared Redis connection settings and client."""
+import os
+
+import redis
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
+
+_pool = redis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,
+    decode_responses=True
+)
+_r = redis.Redis(connection_pool=_pool)
+
+
+def get_redis() -> redis.Redis:
+    """Return the process-wide Redis client (string responses)."""
+    return _r
+
+
+_binary_pool = redis.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,
+)
+_rb = redis.Redis(connection_pool=_binary_pool)
+
+
+def get_redis_binary() -> redis.Redis:
+    """Return the process-wide Redis client that leaves responses as bytes."""
+    return _rb
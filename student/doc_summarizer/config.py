@@ -13,12 +13,52 @@ ALLOWED_CONTENT_TYPES = [
     "image/jpg",
 ]
 
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 150
+# Chunk sizes are in embedding-tokenizer (bge-m3) tokens. Parent windows are
+# what the LLM finally sees; the small child chunks inside them are what gets
+# embedded, matched and reranked.
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+CHILD_CHUNK_TOKENS = 64
+CHILD_CHUNK_OVERLAP_TOKENS = 8
 BATCH_EMBED_SIZE = 32
+# Page furniture: short lines repeated on at least this share of pages are
+# stripped before chunking. Near-duplicate chunks within this SimHash
+# distance (bits out of 64; keep <= 3) are collapsed before embedding.
+BOILERPLATE_PAGE_RATIO = 0.5
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_MAX_LINE_CHARS = 120
+SIMHASH_MAX_DISTANCE = 3
+
 TOP_K_VECTOR = 20
 TOP_K_RETURN = 5
 
+# Library-wide search: route the query to the best matching documents first
+# (via their summary embeddings), then search chunks only inside those.
+TOP_K_DOCUMENTS = 3
+TOP_K_PER_DOCUMENT = 10
+LIBRARY_SEARCH_WORKERS = 4
+
+# Semantic answer cache for /ask: a question whose embedding is at least this
+# cosine-similar to a cached one (same document) reuses the cached answer.
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SECONDS = 60 * 60
+ANSWER_CACHE_MAX_DOCS = 256
+ANSWER_CACHE_MAX_PER_DOC = 64
+
+# Chat context: reranked parent passages per (source, question) are cached,
+# and documents a chat has selected keep their chunk vectors in memory.
+CONTEXT_CACHE_TTL_SECONDS = 10 * 60
+CONTEXT_CACHE_MAX_ENTRIES = 1024
+CONTEXT_CANDIDATES = 10
+WARM_DOCUMENTS_MAX = 8
+WARM_DOCUMENT_TTL_SECONDS = 30 * 60
+
+# /ask deadline and per-stage budgets (seconds). Reranking is skipped (vector
+# order kept) when its usual duration no longer fits; the LLM gets the rest.
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", 45))
+ASK_EMBED_BUDGET = 5.0
+ASK_RETRIEVE_BUDGET = 10.0
+
 
 def ensure_directories() -> None:
     """Ensure project data directories exist."""
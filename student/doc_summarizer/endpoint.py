@@ -1,17 +1,33 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Optional
 from uuid import uuid4
 
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
 from sqlalchemy.orm import Session, sessionmaker
 
-from student.core.database import engine, get_db, Document
+from student.core.database import engine, get_db, Document, User
 from student.core.models import DocumentResponse
-from student.doc_summarizer.config import ALLOWED_CONTENT_TYPES, UPLOAD_DIR
-from student.doc_summarizer.services.search import perform_search
+from student.doc_summarizer.config import (
+    ALLOWED_CONTENT_TYPES,
+    ASK_DEADLINE_SECONDS,
+    ASK_EMBED_BUDGET,
+    ASK_RETRIEVE_BUDGET,
+    UPLOAD_DIR,
+)
+from student.doc_summarizer.services import answer_cache
+from student.doc_summarizer.services.embeddings import get_embed
+from student.doc_summarizer.services.search import (
+    expand_to_parents,
+    perform_library_search,
+    perform_search,
+)
 from student.doc_summarizer.services.vector_store import get_documents_collection
-from student.utils.llm import answer_with_llm
+from student.middleware.dependencies import get_optional_user
+from student.utils.context_packing import Section, pack_prompt
+from student.utils.deadline import DeadlineExceeded, call_stage, request_deadline, timed
+from student.utils.llm import answer_prompt_template, answer_with_llm, is_error_answer
 
 router = APIRouter()
 SessionLocal = sessionmaker(bind=engine)
@@ -32,7 +48,17 @@ def get_document(doc_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/upload-and-process", response_model=DocumentResponse)
-async def upload_and_process(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_and_process(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user),
+):
+    """Upload a document and queue it for processing.
+
+    A signed-in user re-uploading a file with the same name creates a new
+    version of their existing document; the worker then re-embeds only the
+    pages whose content changed. Anonymous uploads are always new documents.
+    """
     if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(
             status_code=400,
@@ -49,30 +75,76 @@ async def upload_and_process(file: UploadFile = File(...), db: Session = Depends
         with open(file_path, "wb") as fh:
             fh.write(content)
 
-        new_doc = Document(
-            filename=file.filename,
-            file_path=file_path,
-            upload_date=datetime.now(),
-            file_size=len(content),
-            content_type=file.content_type,
-            status="pending",
-        )
-        db.add(new_doc)
+        owner = current_user.username if current_user else None
+        doc = None
+        if owner:
+            # Anonymous uploads have no owner to match, so each one stays a
+            # separate document rather than replacing someone else's.
+            doc = (
+                db.query(Document)
+                .filter(
+                    Document.filename == file.filename,
+                    Document.owner == owner,
+                    Document.content_type == file.content_type,
+                )
+                .order_by(Document.id.desc())
+                .first()
+            )
+
+        previous_path = None
+        if doc:
+            previous_path = doc.file_path
+            doc.file_path = file_path
+            doc.upload_date = datetime.now()
+            doc.file_size = len(content)
+            doc.status = "pending"
+            doc.version = (doc.version or 1) + 1
+        else:
+            doc = Document(
+                filename=file.filename,
+                file_path=file_path,
+                upload_date=datetime.now(),
+                file_size=len(content),
+                content_type=file.content_type,
+                status="pending",
+                owner=owner,
+                version=1,
+            )
+            db.add(doc)
         db.commit()
-        db.refresh(new_doc)
+        db.refresh(doc)
 
-        process_document_task.delay(new_doc.id, file_path, file.content_type)
-        return new_doc
+        # The worker deletes the replaced file once this version is stored;
+        # a task for the previous version may still be reading it.
+        process_document_task.delay(doc.id, file_path, file.content_type, previous_path)
+        return doc
 
     except Exception as exc:  # pragma: no cover - surfaced to client
         print(f"[upload] error: {exc}")
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+def queue_summary_backfill() -> None:
+    """Queue summary embeddings for documents ingested without one."""
+    try:
+        from student.workers.tasks import backfill_document_summaries_task
+
+        backfill_document_summaries_task.delay()
+    except Exception as exc:
+        print(f"[startup] summary backfill not queued: {exc}")
+
+
+def _search(doc_id: Optional[str], query: str, query_embed=None):
+    """Search one document, or the whole library when no doc_id is given."""
+    if doc_id:
+        return perform_search(doc_id, query, query_embed=query_embed)
+    return perform_library_search(query, query_embed=query_embed)
+
+
 @router.post("/search")
-def search_document(doc_id: str, query: str):
+def search_document(query: str, doc_id: Optional[str] = None):
     try:
-        results = perform_search(doc_id, query)
+        results = _search(doc_id, query)
         return {
             "count": len(results),
             "top_match": results[0] if results else None,
@@ -84,20 +156,63 @@ def search_document(doc_id: str, query: str):
 
 
 @router.post("/ask")
-def ask_document(doc_id: str, query: str):
+def ask_document(query: str, doc_id: Optional[str] = None):
+    # Every stage runs against one deadline; "timings" reports each stage's
+    # budget, time spent and outcome.
+    with request_deadline(ASK_DEADLINE_SECONDS, "ask") as deadline:
+        try:
+            return _ask(query, doc_id, deadline)
+        except DeadlineExceeded as exc:
+            print(f"[ask] {exc}: {deadline.report()}")
+            raise HTTPException(status_code=504, detail=str(exc))
+
+
+def _ask(query: str, doc_id: Optional[str], deadline):
     try:
-        results = perform_search(doc_id, query)
+        # Near-identical questions about the same document are answered from
+        # the semantic cache; the embedding is reused for retrieval on a miss.
+        cache_key = doc_id or answer_cache.LIBRARY_KEY
+        query_embed = call_stage("embed", get_embed().embed_query, query, budget=ASK_EMBED_BUDGET)
+        with timed("cache"):
+            cached, generation = answer_cache.lookup(cache_key, query_embed)
+        if cached:
+            return {**cached, "cached": True, "timings": deadline.report()}
+
+        results = call_stage(
+            "retrieve", _search, doc_id, query, query_embed=query_embed, budget=ASK_RETRIEVE_BUDGET
+        )
         if not results:
-            return {"answer": "I couldn't find any relevant information in the document."}
+            return {
+                "answer": "I couldn't find any relevant information in the document.",
+                "timings": deadline.report(),
+            }
 
-        context_text = "\n\n".join([r["text"] for r in results])
-        answer = answer_with_llm(query, context_text)
+        # Rerank ran on the small child chunks; the LLM gets their parents,
+        # most relevant first, cut to what fits the model's context window.
+        with timed("pack"):
+            packed = pack_prompt(
+                answer_prompt_template(),
+                query,
+                [Section("context", expand_to_parents(results), share=1.0)],
+            )
+        # The LLM call is bounded by what is left of the deadline.
+        with timed("generate"):
+            answer = answer_with_llm(query, packed.text("context"))
         if answer.startswith("Error communicating with LLM"):
+            if not deadline.remaining():
+                raise DeadlineExceeded("generate did not finish within the deadline")
             raise HTTPException(status_code=503, detail=answer)
 
-        return {"answer": answer, "sources": results}
+        if not is_error_answer(answer):
+            answer_cache.store(cache_key, query_embed, answer, results, generation)
+        return {
+            "answer": answer,
+            "sources": results,
+            "usage": packed.usage,
+            "timings": deadline.report(),
+        }
 
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as exc:
         print(f"[ask] error: {exc}")
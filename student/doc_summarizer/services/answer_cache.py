@@ -0,0 +1,172 @@
+"""Semantic answer cache for ``/ask``.
+
+Entries are ``(question embedding, answer, sources)`` grouped per document.
+A new question hits when its embedding is within
+``ANSWER_CACHE_THRESHOLD`` cosine similarity of a cached question for the
+same document. Both levels are LRU-bounded and entries expire after
+``ANSWER_CACHE_TTL_SECONDS``.
+
+The cache lives in each API process. Reprocessing a document bumps a
+generation counter in Redis (the Celery worker runs elsewhere), and a
+lookup that sees a newer generation drops that document's entries. An
+answer is stored under the generation its lookup saw, so one generated
+while the document was being reprocessed is never served.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from student.core.redis_client import get_redis
+from student.doc_summarizer.config import (
+    ANSWER_CACHE_MAX_DOCS,
+    ANSWER_CACHE_MAX_PER_DOC,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+)
+from student.utils import metrics
+
+# Cache key used for library-wide questions (no doc_id).
+LIBRARY_KEY = "__library__"
+
+
+@dataclass
+class _Entry:
+    embedding: np.ndarray
+    answer: str
+    sources: List[Dict[str, object]]
+    created: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _DocEntries:
+    generation: int
+    entries: "OrderedDict[int, _Entry]" = field(default_factory=OrderedDict)
+
+
+_lock = threading.Lock()
+_docs: "OrderedDict[str, _DocEntries]" = OrderedDict()
+_next_id = 0
+_hits = 0
+_lookups = 0
+
+
+def _generation_key(doc_key: str) -> str:
+    return f"answer_cache_gen:{doc_key}"
+
+
+def _generation(doc_key: str) -> int:
+    try:
+        return int(get_redis().get(_generation_key(doc_key)) or 0)
+    except Exception:
+        return 0
+
+
+def _record(hit: bool) -> None:
+    global _hits, _lookups
+    _lookups += 1
+    _hits += int(hit)
+    metrics.incr("answer_cache.hits" if hit else "answer_cache.misses")
+    metrics.set_gauge("answer_cache.hit_rate", _hits / _lookups)
+
+
+def lookup(doc_key: str, query_embed: List[float]) -> Tuple[Optional[Dict[str, object]], int]:
+    """Return ``{"answer", "sources"}`` for a close enough cached question.
+
+    The document's current generation is returned with it, to be passed to
+    :func:`store` on a miss.
+    """
+    generation = _generation(doc_key)
+    query = np.asarray(query_embed, dtype=np.float32)
+    now = time.monotonic()
+
+    with _lock:
+        doc = _docs.get(doc_key)
+        if doc is not None and doc.generation != generation:
+            del _docs[doc_key]
+            doc = None
+        if doc is None:
+            _record(False)
+            return None, generation
+
+        for entry_id in [i for i, e in doc.entries.items() if now - e.created > ANSWER_CACHE_TTL_SECONDS]:
+            del doc.entries[entry_id]
+            metrics.incr("answer_cache.expired")
+        if not doc.entries:
+            _record(False)
+            return None, generation
+
+        ids = list(doc.entries)
+        matrix = np.stack([doc.entries[i].embedding for i in ids])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < ANSWER_CACHE_THRESHOLD:
+            _record(False)
+            return None, generation
+
+        entry_id = ids[best]
+        doc.entries.move_to_end(entry_id)
+        _docs.move_to_end(doc_key)
+        entry = doc.entries[entry_id]
+        _record(True)
+        return {"answer": entry.answer, "sources": entry.sources}, generation
+
+
+def store(
+    doc_key: str,
+    query_embed: List[float],
+    answer: str,
+    sources: List[Dict[str, object]],
+    generation: int,
+) -> None:
+    """Cache an answer for a document/question pair.
+
+    ``generation`` is the one :func:`lookup` returned before the answer was
+    generated; an answer from before a reprocess never replaces newer entries.
+    """
+    global _next_id
+    embedding = np.asarray(query_embed, dtype=np.float32)
+
+    with _lock:
+        doc = _docs.get(doc_key)
+        if doc is not None and doc.generation > generation:
+            metrics.incr("answer_cache.stale_writes")
+            return
+        if doc is None or doc.generation != generation:
+            doc = _DocEntries(generation=generation)
+            _docs[doc_key] = doc
+        _docs.move_to_end(doc_key)
+
+        _next_id += 1
+        doc.entries[_next_id] = _Entry(embedding, answer, sources)
+        while len(doc.entries) > ANSWER_CACHE_MAX_PER_DOC:
+            doc.entries.popitem(last=False)
+            metrics.incr("answer_cache.evictions")
+        while len(_docs) > ANSWER_CACHE_MAX_DOCS:
+            _docs.popitem(last=False)
+            metrics.incr("answer_cache.evictions")
+
+
+def invalidate(*doc_keys: str) -> None:
+    """Drop cached answers for a document everywhere.
+
+    Pass every key the document can be asked by (its id and its filename);
+    library-wide answers are dropped as well.
+    """
+    keys = [str(k) for k in doc_keys if k] + [LIBRARY_KEY]
+    try:
+        pipe = get_redis().pipeline()
+        for key in keys:
+            pipe.incr(_generation_key(key))
+        pipe.execute()
+    except Exception as exc:
+        print(f"[answer_cache] invalidation failed: {exc}")
+    with _lock:
+        for key in keys:
+            _docs.pop(key, None)
+    metrics.incr("answer_cache.invalidations")
@@ -1,10 +1,271 @@
-"""Chunking helpers for document ingestion."""
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+"""Chunking helpers for document ingestion.
 
-from student.doc_summarizer.config import CHUNK_SIZE, CHUNK_OVERLAP
+Text is cut into segments (sentences, lines, paragraphs) in a single regex
+pass, each segment is measured in embedding-tokenizer tokens, and segments
+are packed greedily into chunks of at most ``max_tokens``. Chunks end on a
+paragraph break when one comes late enough, and consecutive chunks share a
+tail of whole segments as overlap.
+"""
+from __future__ import annotations
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP,
-    separators=["\n\n", "\n", ". ", "? ", "! ", "; ", " "],
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from student.doc_summarizer.config import (
+    CHILD_CHUNK_OVERLAP_TOKENS,
+    CHILD_CHUNK_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENS,
+)
+
+# Paragraph break, sentence end, or a plain line break.
+_BOUNDARY_RE = re.compile(r"\n[ \t]*\n\s*|(?<=[.!?;])\s+|\n")
+
+# A chunk that has reached this share of its budget is closed at the next
+# paragraph break instead of running on into the following paragraph.
+_PARAGRAPH_FILL = 0.75
+
+# Streamed text with no boundary at all (garbled OCR) is force-cut here.
+_MAX_PENDING_CHARS = 64 * 1024
+
+_TOKENIZE_BATCH = 512
+
+
+@dataclass
+class Segment:
+    text: str
+    tokens: int
+    sep: str = " "
+
+
+def _separator(boundary: str) -> str:
+    if boundary.count("\n") >= 2:
+        return "\n\n"
+    if "\n" in boundary:
+        return "\n"
+    return " "
+
+
+def _join(segments: List[Segment]) -> str:
+    parts = []
+    for segment in segments[:-1]:
+        parts.append(segment.text)
+        parts.append(segment.sep)
+    parts.append(segments[-1].text)
+    return "".join(parts)
+
+
+def _split_boundaries(text: str) -> List[Tuple[str, str]]:
+    """Return ``(segment_text, separator)`` pairs in one pass over ``text``."""
+    pieces: List[Tuple[str, str]] = []
+    start = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        piece = text[start:match.start()].strip()
+        if piece:
+            pieces.append((piece, _separator(match.group())))
+        elif pieces and _separator(match.group()) == "\n\n":
+            pieces[-1] = (pieces[-1][0], "\n\n")
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        pieces.append((tail, " "))
+    return pieces
+
+
+class _Packer:
+    """Greedy packing state shared by the batch and streaming paths."""
+
+    def __init__(self, max_tokens: int, overlap_tokens: int) -> None:
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.current: List[Segment] = []
+        self.tokens = 0
+        self.carried = 0
+
+    def push(self, segment: Segment) -> Optional[List[Segment]]:
+        """Add a segment; return a finished chunk's segments if one closed."""
+        finished = None
+        if len(self.current) > self.carried and self.tokens + segment.tokens > self.max_tokens:
+            finished = self.current
+            self._start_after(finished, carry_overlap=True)
+        if self.tokens + segment.tokens > self.max_tokens:
+            # Carried overlap cannot fit next to this segment; drop it.
+            self._start_after([], carry_overlap=False)
+
+        self.current.append(segment)
+        self.tokens += segment.tokens
+
+        if (
+            finished is None
+            and segment.sep == "\n\n"
+            and self.tokens >= self.max_tokens * _PARAGRAPH_FILL
+        ):
+            finished = self.current
+            self._start_after(finished, carry_overlap=False)
+        return finished
+
+    def finish(self) -> Optional[List[Segment]]:
+        """Return the trailing chunk unless it is nothing but carried overlap."""
+        current, has_new = self.current, len(self.current) > self.carried
+        self._start_after([], carry_overlap=False)
+        return current if has_new else None
+
+    def _start_after(self, finished: List[Segment], carry_overlap: bool) -> None:
+        carried: List[Segment] = []
+        carried_tokens = 0
+        if carry_overlap and self.overlap_tokens:
+            for segment in reversed(finished):
+                if carried_tokens + segment.tokens > self.overlap_tokens:
+                    break
+                carried.insert(0, segment)
+                carried_tokens += segment.tokens
+        self.current = carried
+        self.tokens = carried_tokens
+        self.carried = len(carried)
+
+
+class TokenChunker:
+    """Single-pass, token-budgeted chunker that also accepts streamed text.
+
+    Use :meth:`split_text` for a whole string, or :meth:`feed` repeatedly
+    followed by :meth:`flush` when text arrives in pieces (page by page,
+    from OCR, etc.).
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = CHUNK_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        max_segment_tokens: Optional[int] = None,
+        tokenizer=None,
+    ) -> None:
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_segment_tokens = min(max_segment_tokens or max_tokens, max_tokens)
+        self._tokenizer = tokenizer
+        self._buffer = ""
+        self._stream = _Packer(max_tokens, overlap_tokens)
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from student.doc_summarizer.services.embeddings import get_embed_tokenizer
+
+            self._tokenizer = get_embed_tokenizer()
+        return self._tokenizer
+
+    def segment(self, text: str) -> List[Segment]:
+        """Cut text into token-measured segments no larger than the cap."""
+        pieces = _split_boundaries(text)
+        segments: List[Segment] = []
+        for offset in range(0, len(pieces), _TOKENIZE_BATCH):
+            batch = pieces[offset:offset + _TOKENIZE_BATCH]
+            encoded = self.tokenizer(
+                [piece for piece, _ in batch],
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )["input_ids"]
+            for (piece, sep), ids in zip(batch, encoded):
+                if len(ids) <= self.max_segment_tokens:
+                    segments.append(Segment(piece, len(ids), sep))
+                else:
+                    segments.extend(self._split_long(piece, sep))
+        return segments
+
+    def _split_long(self, text: str, sep: str) -> List[Segment]:
+        """Cut an over-long sentence at token offsets."""
+        encoded = self.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )
+        offsets = encoded["offset_mapping"]
+        step = self.max_segment_tokens
+        segments: List[Segment] = []
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + step]
+            piece = text[window[0][0]:window[-1][1]].strip()
+            if piece:
+                segments.append(Segment(piece, len(window), " "))
+        if segments:
+            segments[-1].sep = sep
+        return segments
+
+    def pack(self, segments: Iterable[Segment]) -> Iterator[List[Segment]]:
+        """Pack already-measured segments into chunk-sized groups."""
+        packer = _Packer(self.max_tokens, self.overlap_tokens)
+        for segment in segments:
+            finished = packer.push(segment)
+            if finished:
+                yield finished
+        last = packer.finish()
+        if last:
+            yield last
+
+    def feed(self, text: str) -> Iterator[str]:
+        """Consume a piece of streamed text, yielding chunks as they close."""
+        self._buffer += text
+        last_end = 0
+        for match in _BOUNDARY_RE.finditer(self._buffer):
+            # A boundary touching the end of the buffer may still grow
+            # (e.g. "\n" becoming a paragraph break), so leave it pending.
+            if match.end() < len(self._buffer):
+                last_end = match.end()
+
+        if not last_end and len(self._buffer) > _MAX_PENDING_CHARS:
+            last_end = self._buffer.rfind(" ", 0, _MAX_PENDING_CHARS) + 1 or _MAX_PENDING_CHARS
+
+        if not last_end:
+            return
+
+        ready, self._buffer = self._buffer[:last_end], self._buffer[last_end:]
+        for segment in self.segment(ready):
+            finished = self._stream.push(segment)
+            if finished:
+                yield _join(finished)
+
+    def flush(self) -> Iterator[str]:
+        """Emit whatever is still buffered once the stream has ended."""
+        ready, self._buffer = self._buffer, ""
+        for segment in self.segment(ready):
+            finished = self._stream.push(segment)
+            if finished:
+                yield _join(finished)
+        last = self._stream.finish()
+        if last:
+            yield _join(last)
+
+    def split_text(self, text: str) -> List[str]:
+        """Chunk a complete string."""
+        return [_join(group) for group in self.pack(self.segment(text))]
+
+
+text_splitter = TokenChunker(
+    max_tokens=CHUNK_TOKENS,
+    overlap_tokens=CHUNK_OVERLAP_TOKENS,
+    max_segment_tokens=CHILD_CHUNK_TOKENS,
 )
+
+child_splitter = TokenChunker(
+    max_tokens=CHILD_CHUNK_TOKENS,
+    overlap_tokens=CHILD_CHUNK_OVERLAP_TOKENS,
+)
+
+
+def split_parent_child(text: str) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """Split text into parent windows and the small child chunks inside them.
+
+    Text is tokenized once: segments are capped at the child budget, so the
+    children of each parent are packed from its already-measured segments.
+    Returns ``(parents, children)`` where each child is a
+    ``(parent_index, child_text)`` pair.
+    """
+    parents: List[str] = []
+    children: List[Tuple[int, str]] = []
+    for parent_index, group in enumerate(text_splitter.pack(text_splitter.segment(text))):
+        parents.append(_join(group))
+        for child_group in child_splitter.pack(group):
+            children.append((parent_index, _join(child_group)))
+    return parents, children
@@ -0,0 +1,207 @@
+"""Question-aware document context for the chat path.
+
+Chat turns retrieve like ``perform_search``: the question's vector selects
+candidate chunks of the chat's document, the reranker orders them, and the
+best ones are expanded to their parent windows. Two in-process caches keep
+that cheap across turns:
+
+* passages per ``(source, question hash)``, TTL- and LRU-bounded, so a
+  repeated question skips retrieval and reranking entirely;
+* "warm" documents: every chunk vector of a document a chat has selected
+  (see :func:`prefetch`), so candidates come from one matrix product instead
+  of a Chroma query.
+
+Reprocessing a document bumps a generation counter in Redis (the Celery
+worker runs elsewhere); entries of an older generation are dropped on
+lookup.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from student.core.redis_client import get_redis
+from student.doc_summarizer.config import (
+    CONTEXT_CACHE_MAX_ENTRIES,
+    CONTEXT_CACHE_TTL_SECONDS,
+    CONTEXT_CANDIDATES,
+    WARM_DOCUMENT_TTL_SECONDS,
+    WARM_DOCUMENTS_MAX,
+)
+from student.doc_summarizer.services.embeddings import get_reranker
+from student.doc_summarizer.services.search import expand_to_parents, perform_search, rank
+from student.doc_summarizer.services.vector_store import (
+    get_chroma_client,
+    get_documents_collection,
+)
+from student.utils import metrics
+
+
+@dataclass
+class _Passages:
+    generation: int
+    passages: List[str]
+    created: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _WarmDocument:
+    generation: int
+    matrix: np.ndarray  # one normalized row per chunk
+    texts: List[str]
+    metadatas: List[Dict[str, object]]
+    used: float = field(default_factory=time.monotonic)
+
+
+_lock = threading.Lock()
+_passages: "OrderedDict[Tuple[str, str], _Passages]" = OrderedDict()
+_warm: "OrderedDict[str, _WarmDocument]" = OrderedDict()
+_warming = set()
+
+
+def _generation_key(source: str) -> str:
+    return f"context_cache_gen:{source}"
+
+
+def _generation(source: str) -> int:
+    try:
+        return int(get_redis().get(_generation_key(source)) or 0)
+    except Exception:
+        return 0
+
+
+def question_hash(question: str) -> str:
+    """Hash of the question with case and spacing normalized."""
+    normalized = " ".join(question.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _cached(key: Tuple[str, str], generation: int) -> Optional[List[str]]:
+    with _lock:
+        entry = _passages.get(key)
+        if entry is None:
+            return None
+        if entry.generation != generation or time.monotonic() - entry.created > CONTEXT_CACHE_TTL_SECONDS:
+            del _passages[key]
+            return None
+        _passages.move_to_end(key)
+        return entry.passages
+
+
+def _remember(key: Tuple[str, str], generation: int, passages: List[str]) -> None:
+    with _lock:
+        _passages[key] = _Passages(generation, passages)
+        _passages.move_to_end(key)
+        while len(_passages) > CONTEXT_CACHE_MAX_ENTRIES:
+            _passages.popitem(last=False)
+            metrics.incr("context_cache.evictions")
+
+
+def _warm_document(source: str, generation: int) -> Optional[_WarmDocument]:
+    with _lock:
+        doc = _warm.get(source)
+        if doc is None:
+            return None
+        if doc.generation != generation or time.monotonic() - doc.used > WARM_DOCUMENT_TTL_SECONDS:
+            del _warm[source]
+            return None
+        doc.used = time.monotonic()
+        _warm.move_to_end(source)
+        return doc
+
+
+def _warm_candidates(doc: _WarmDocument, query_embed: List[float]):
+    """Top chunks of a warm document by cosine similarity."""
+    query = np.asarray(query_embed, dtype=np.float32)
+    scores = doc.matrix @ query
+    n = min(CONTEXT_CANDIDATES, len(doc.texts))
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top])]
+    return [doc.texts[i] for i in top], [doc.metadatas[i] for i in top]
+
+
+def chat_context(source: str, question: str, query_embed: List[float]) -> List[str]:
+    """Parent passages of ``source`` for ``question``, most relevant first."""
+    generation = _generation(source)
+    key = (source, question_hash(question))
+
+    passages = _cached(key, generation)
+    if passages is not None:
+        metrics.incr("context_cache.hits")
+        return passages
+    metrics.incr("context_cache.misses")
+
+    doc = _warm_document(source, generation)
+    if doc is not None and doc.texts:
+        metrics.incr("context_cache.warm_retrievals")
+        texts, metadatas = _warm_candidates(doc, query_embed)
+        results = rank(question, texts, metadatas)
+    else:
+        results = perform_search(source, question, query_embed)
+
+    passages = expand_to_parents(results)
+    # Passages in vector order (reranker skipped for the deadline) are not kept.
+    if passages and results[0]["score"] is not None:
+        _remember(key, generation, passages)
+    return passages
+
+
+def prefetch(source: str) -> bool:
+    """Load every chunk vector of ``source`` into memory (and the reranker).
+
+    Returns False if the document is already warm or being warmed.
+    """
+    generation = _generation(source)
+    with _lock:
+        if source in _warming:
+            return False
+        _warming.add(source)
+    try:
+        if _warm_document(source, generation) is not None:
+            return False
+
+        started = time.perf_counter()
+        found = get_chroma_client()._get(
+            get_documents_collection().id,
+            where={"source": source},
+            include=["embeddings", "documents", "metadatas"],
+        )
+        texts = found.get("documents") or []
+        if not texts:
+            return False
+        matrix = np.asarray(found["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        doc = _WarmDocument(generation, matrix, texts, found.get("metadatas") or [{} for _ in texts])
+
+        with _lock:
+            _warm[source] = doc
+            _warm.move_to_end(source)
+            while len(_warm) > WARM_DOCUMENTS_MAX:
+                _warm.popitem(last=False)
+        # The first chat turn would otherwise pay for loading the reranker.
+        get_reranker()
+        metrics.observe("context_cache.prefetch_seconds", time.perf_counter() - started)
+        metrics.set_gauge("context_cache.warm_documents", len(_warm))
+        return True
+    finally:
+        with _lock:
+            _warming.discard(source)
+
+
+def invalidate(source: str) -> None:
+    """Drop cached passages and vectors of a document in every API process."""
+    try:
+        get_redis().incr(_generation_key(source))
+    except Exception as exc:
+        print(f"[context_cache] invalidation failed: {exc}")
+    with _lock:
+        _warm.pop(source, None)
+        for key in [k for k in _passages if k[0] == source]:
+            del _passages[key]
@@ -0,0 +1,145 @@
+"""Boilerplate and near-duplicate removal ahead of embedding.
+
+Two passes run before any chunk reaches the embedding model:
+
+* page furniture (headers, footers, page numbers, copyright lines,
+  watermarks) is found as short lines that recur on many pages and is
+  stripped from every page;
+* near-duplicate chunks are collapsed using 64-bit SimHash fingerprints,
+  bucketed by 16-bit bands so only likely matches are compared.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from student.doc_summarizer.config import (
+    BOILERPLATE_MAX_LINE_CHARS,
+    BOILERPLATE_MIN_PAGES,
+    BOILERPLATE_PAGE_RATIO,
+    SIMHASH_MAX_DISTANCE,
+)
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACE_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+")
+_NUMBERED_LINE_CHARS = 40
+
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def _line_key(line: str) -> str:
+    """Normalize a line so 'Page 3 of 40' and 'Page 4 of 40' compare equal.
+
+    Digits are only masked on short lines (page numbers, running heads);
+    longer lines must repeat verbatim to count as furniture.
+    """
+    key = _SPACE_RE.sub(" ", line.strip().lower())
+    if len(key) <= _NUMBERED_LINE_CHARS:
+        key = _DIGITS_RE.sub("#", key)
+    return key
+
+
+def strip_page_furniture(pages: List[str]) -> Tuple[List[str], Set[str]]:
+    """Remove lines repeated across pages.
+
+    A short line counts as furniture when its normalized form appears on at
+    least ``BOILERPLATE_PAGE_RATIO`` of the pages (and on no fewer than
+    ``BOILERPLATE_MIN_PAGES``). Returns the cleaned pages and the set of
+    normalized lines that were removed.
+    """
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return pages, set()
+
+    page_counts: Counter = Counter()
+    for page in pages:
+        keys = {
+            _line_key(line)
+            for line in page.splitlines()
+            if line.strip() and len(line.strip()) <= BOILERPLATE_MAX_LINE_CHARS
+        }
+        page_counts.update(keys)
+
+    threshold = max(BOILERPLATE_MIN_PAGES, int(len(pages) * BOILERPLATE_PAGE_RATIO))
+    furniture = {key for key, count in page_counts.items() if count >= threshold}
+    if not furniture:
+        return pages, furniture
+
+    return strip_lines(pages, furniture), furniture
+
+
+def strip_lines(pages: List[str], furniture: Set[str]) -> List[str]:
+    """Drop lines whose normalized form is in ``furniture``."""
+    cleaned = []
+    for page in pages:
+        kept = [line for line in page.splitlines() if _line_key(line) not in furniture]
+        cleaned.append("\n".join(kept))
+    return cleaned
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word trigrams (single words for very short text)."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) >= 3:
+        features = [" ".join(words[i:i + 3]) for i in range(len(words) - 2)]
+    else:
+        features = words
+
+    weights = [0] * 64
+    for feature in features:
+        digest = int.from_bytes(
+            hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for bit in range(64):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+
+    value = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            value |= 1 << bit
+    return value
+
+
+def _bands(value: int) -> List[Tuple[int, int]]:
+    return [(band, value >> (band * _BAND_BITS) & _BAND_MASK) for band in range(_BANDS)]
+
+
+def dedupe_chunks(chunks: List[str], seen: Iterable[int] = ()) -> Tuple[List[int], int]:
+    """Return indexes of chunks to keep (first occurrence wins) and the drop count.
+
+    ``seen`` holds SimHashes of chunks already stored; near-duplicates of
+    those are dropped too. With four 16-bit bands, any two fingerprints
+    within three bits of each other share at least one band, so only
+    same-band chunks are compared.
+    """
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    kept_hashes: List[int] = []
+    kept: List[int] = []
+
+    for value in seen:
+        for band in _bands(value):
+            buckets.setdefault(band, []).append(len(kept_hashes))
+        kept_hashes.append(value)
+
+    for index, chunk in enumerate(chunks):
+        value = simhash(chunk)
+        bands = _bands(value)
+        duplicate = any(
+            bin(value ^ kept_hashes[other]).count("1") <= SIMHASH_MAX_DISTANCE
+            for band in bands
+            for other in buckets.get(band, ())
+        )
+        if duplicate:
+            continue
+
+        slot = len(kept_hashes)
+        kept_hashes.append(value)
+        kept.append(index)
+        for band in bands:
+            buckets.setdefault(band, []).append(slot)
+
+    return kept, len(chunks) - len(kept)
@@ -1,45 +1,88 @@
 """Embedding and reranker helpers used by the doc_summarizer."""
 from __future__ import annotations
 
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 
 from langchain_huggingface import HuggingFaceEmbeddings
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 
+from student.doc_summarizer.config import TOP_K_RETURN
+
+EMBED_MODEL = "BAAI/bge-m3"
+
 _embed = None
+_embed_tokenizer = None
 _reranker_tokenizer = None
 _reranker_model = None
+# Models are loaded lazily and may be requested from several threads at once.
+_load_lock = threading.Lock()
 
 
 def get_embed() -> HuggingFaceEmbeddings:
     """Return a singleton HuggingFace embedding model."""
     global _embed
     if _embed is None:
-        print("Loading Embedding Model...")
-        _embed = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-m3",
-            model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
+        with _load_lock:
+            if _embed is None:
+                print("Loading Embedding Model...")
+                _embed = HuggingFaceEmbeddings(
+                    model_name=EMBED_MODEL,
+                    model_kwargs={"device": "cpu"},
+                    encode_kwargs={"normalize_embeddings": True},
+                )
     return _embed
 
 
+def get_embed_tokenizer():
+    """Return the embedding model's tokenizer (used to size chunks)."""
+    global _embed_tokenizer
+    if _embed_tokenizer is None:
+        with _load_lock:
+            if _embed_tokenizer is None:
+                _embed_tokenizer = AutoTokenizer.from_pretrained(EMBED_MODEL)
+    return _embed_tokenizer
+
+
 def get_reranker():
     """Return the tokenizer/model pair for reranking results."""
     global _reranker_tokenizer, _reranker_model
     if _reranker_model is None:
-        print("Loading Reranker Model...")
-        _reranker_tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-reranker-base")
-        _reranker_model = AutoModelForSequenceClassification.from_pretrained(
-            "BAAI/bge-reranker-base"
-        )
-        _reranker_model.eval()
+        with _load_lock:
+            if _reranker_model is None:
+                print("Loading Reranker Model...")
+                _reranker_tokenizer = AutoTokenizer.from_pretrained("BAAI/bge-reranker-base")
+                model = AutoModelForSequenceClassification.from_pretrained(
+                    "BAAI/bge-reranker-base"
+                )
+                model.eval()
+                _reranker_model = model
     return _reranker_tokenizer, _reranker_model
 
 
-def rerank(query: str, chunks: List[str]) -> List[Dict[str, object]]:
-    """Return top reranked chunks for a query."""
+def warm_models() -> None:
+    """Load the embedder and reranker (and run each once) before serving.
+
+    Request stages have budgets of a few seconds; a first load inside one
+    would time out while still holding a pool worker.
+    """
+    get_embed().embed_query("warm up")
+    rerank("warm up", ["warm up"])
+
+
+def rerank(
+    query: str,
+    chunks: List[str],
+    metadatas: Optional[List[Dict[str, object]]] = None,
+    top_k: int = TOP_K_RETURN,
+) -> List[Dict[str, object]]:
+    """Return top reranked chunks for a query.
+
+    When ``metadatas`` is given (one per chunk), the originating document's
+    ``source`` and ``sql_doc_id`` and the chunk's ``parent_id`` are carried
+    over onto each result.
+    """
     if not chunks:
         return []
 
@@ -58,6 +101,12 @@ def rerank(query: str, chunks: List[str]) -> List[Dict[str, object]]:
         if score != score or score in (float("inf"), float("-inf")):
             score = 0.0
         clean_text = " ".join(chunks[idx].replace("\n", " ").split())
-        sanitized_results.append({"score": round(score, 4), "text": clean_text})
+        result: Dict[str, object] = {"score": round(score, 4), "text": clean_text}
+        if metadatas is not None:
+            meta = metadatas[idx] or {}
+            result["source"] = meta.get("source")
+            result["sql_doc_id"] = meta.get("sql_doc_id")
+            result["parent_id"] = meta.get("parent_id")
+        sanitized_results.append(result)
 
-    return sanitized_results[:5]
+    return sanitized_results[:top_k]
@@ -1,43 +1,188 @@
 """Semantic search helper functions."""
 from __future__ import annotations
 
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 
+from student.doc_summarizer.config import (
+    LIBRARY_SEARCH_WORKERS,
+    TOP_K_DOCUMENTS,
+    TOP_K_PER_DOCUMENT,
+    TOP_K_RETURN,
+)
 from student.doc_summarizer.services.embeddings import get_embed, rerank
 from student.doc_summarizer.services.vector_store import (
     get_chroma_client,
     get_documents_collection,
+    get_parent_texts,
+    get_summaries_collection,
 )
+from student.utils.deadline import can_afford, timed
 
+_library_executor = ThreadPoolExecutor(
+    max_workers=LIBRARY_SEARCH_WORKERS, thread_name_prefix="library-search"
+)
 
-def perform_search(doc_id: str, query: str) -> List[Dict[str, object]]:
-    """Retrieve and rerank chunks for a query within a document."""
-    embedder = get_embed()
-    query_embed = embedder.embed_query(query)
 
+def _query_chunks(
+    query_embed: List[float], where_filter: Dict[str, object], n_results: int
+) -> Tuple[List[str], List[Dict[str, object]]]:
+    """Run a filtered chunk query and return (documents, metadatas)."""
     chroma_client = get_chroma_client()
     collection = get_documents_collection()
 
-    where_filter = {"sql_doc_id": int(doc_id)} if doc_id.isdigit() else {"source": doc_id}
-
     try:
         max_results = chroma_client._count(collection.id)
     except Exception:
-        max_results = 10
+        max_results = n_results
 
     if max_results == 0:
-        return []
+        return [], []
 
-    n_results = min(10, max_results)
     results = chroma_client._query(
         collection.id,
         query_embeddings=[query_embed],
-        n_results=n_results,
+        n_results=min(n_results, max_results),
         where=where_filter,
     )
 
-    retrieved_chunks = results.get("documents", [[]])[0]
+    documents = results.get("documents", [[]])[0] or []
+    metadatas = (results.get("metadatas") or [[]])[0] or [{} for _ in documents]
+    return documents, metadatas
+
+
+def rank(
+    query: str, chunks: List[str], metadatas: List[Dict[str, object]]
+) -> List[Dict[str, object]]:
+    """Rerank candidates, or keep their vector order when the request's
+    deadline cannot afford the reranker (results then have ``score`` None)."""
+    if can_afford("rerank"):
+        with timed("rerank"):
+            return rerank(query, chunks, metadatas=metadatas)
+    return [
+        {
+            "score": None,
+            "text": " ".join(chunk.replace("\n", " ").split()),
+            "source": (meta or {}).get("source"),
+            "sql_doc_id": (meta or {}).get("sql_doc_id"),
+            "parent_id": (meta or {}).get("parent_id"),
+        }
+        for chunk, meta in zip(chunks[:TOP_K_RETURN], metadatas[:TOP_K_RETURN])
+    ]
+
+
+def perform_search(
+    doc_id: str, query: str, query_embed: Optional[List[float]] = None
+) -> List[Dict[str, object]]:
+    """Retrieve and rerank chunks for a query within a document."""
+    if query_embed is None:
+        query_embed = get_embed().embed_query(query)
+
+    where_filter = {"sql_doc_id": int(doc_id)} if doc_id.isdigit() else {"source": doc_id}
+
+    retrieved_chunks, metadatas = _query_chunks(query_embed, where_filter, 10)
     if not retrieved_chunks:
         return []
 
-    return rerank(query, retrieved_chunks)
+    return rank(query, retrieved_chunks, metadatas)
+
+
+def expand_to_parents(results: List[Dict[str, object]]) -> List[str]:
+    """Swap matched child chunks for their parent windows, keeping rank order.
+
+    Children sharing a parent collapse into one entry; chunks indexed before
+    parent windows existed fall back to their own text.
+    """
+    parent_ids = [r["parent_id"] for r in results if r.get("parent_id")]
+    try:
+        parents = get_parent_texts(list(dict.fromkeys(parent_ids)))
+    except Exception as exc:
+        print(f"[search] parent lookup failed: {exc}")
+        parents = {}
+
+    expanded: List[str] = []
+    seen = set()
+    for result in results:
+        parent_id = result.get("parent_id")
+        key = parent_id if parent_id in parents else result["text"]
+        if key in seen:
+            continue
+        seen.add(key)
+        expanded.append(parents.get(parent_id) or result["text"])
+    return expanded
+
+
+def route_documents(query_embed: List[float], top_docs: int = TOP_K_DOCUMENTS) -> List[int]:
+    """Pick the documents whose summary embedding best matches the query."""
+    chroma_client = get_chroma_client()
+    collection = get_summaries_collection()
+
+    try:
+        total = chroma_client._count(collection.id)
+    except Exception:
+        total = top_docs
+
+    if total == 0:
+        return []
+
+    results = chroma_client._query(
+        collection.id,
+        query_embeddings=[query_embed],
+        n_results=min(top_docs, total),
+    )
+
+    doc_ids: List[int] = []
+    for meta in (results.get("metadatas") or [[]])[0] or []:
+        sql_doc_id = (meta or {}).get("sql_doc_id")
+        if sql_doc_id is not None and sql_doc_id not in doc_ids:
+            doc_ids.append(sql_doc_id)
+    return doc_ids
+
+
+def perform_library_search(
+    query: str,
+    top_docs: Optional[int] = None,
+    query_embed: Optional[List[float]] = None,
+) -> List[Dict[str, object]]:
+    """Search the whole library in two stages.
+
+    Summary embeddings first select a handful of candidate documents; chunk
+    search then runs in parallel inside those documents only, and the merged
+    candidates are reranked together. Work grows with ``top_docs``, not with
+    the number of documents stored.
+    """
+    if query_embed is None:
+        query_embed = get_embed().embed_query(query)
+    doc_ids = route_documents(query_embed, top_docs or TOP_K_DOCUMENTS)
+    if not doc_ids:
+        return []
+
+    futures = [
+        _library_executor.submit(
+            _query_chunks, query_embed, {"sql_doc_id": doc_id}, TOP_K_PER_DOCUMENT
+        )
+        for doc_id in doc_ids
+    ]
+
+    chunks: List[str] = []
+    metadatas: List[Dict[str, object]] = []
+    seen = set()
+    for future in futures:
+        try:
+            documents, metas = future.result()
+        except Exception as exc:
+            print(f"[library_search] chunk query failed: {exc}")
+            continue
+        for text, meta in zip(documents, metas):
+            if text in seen:
+                continue
+            seen.add(text)
+            chunks.append(text)
+            metadatas.append(meta or {})
+
+    if not chunks:
+        return []
+
+    # Candidates come per document, so without the reranker they keep that
+    # order (best document first) rather than a global one.
+    return rank(query, chunks, metadatas)
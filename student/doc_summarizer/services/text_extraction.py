@@ -1,8 +1,9 @@
 """Text extraction utilities for documents and images."""
 from __future__ import annotations
 
+import hashlib
 import io
-from typing import Tuple
+from typing import Iterable, List, Optional
 
 import easyocr
 import fitz  # PyMuPDF
@@ -55,44 +56,82 @@ def _enhanced_page_ocr(page) -> str:
     return " ".join(stronger)
 
 
-def extract_text(file_content: bytes, content_type: str) -> str:
-    """Extract text from PDFs or images."""
-    text = ""
+def _page_ocr_text(page) -> str:
+    """OCR a page that has (almost) no text layer."""
+    try:
+        mat = fitz.Matrix(2, 2)
+        pix = page.get_pixmap(matrix=mat, alpha=False)
+        img_bytes = pix.tobytes("png")
+        return extract_text_from_image(img_bytes)
+    except Exception:
+        try:
+            pix = page.get_pixmap()
+            img_bytes = pix.tobytes("png")
+            return extract_text_from_image(img_bytes)
+        except Exception:
+            return ""
+
+
+def page_fingerprints(file_content: bytes, content_type: str) -> List[str]:
+    """Return a cheap content hash per page, without running OCR.
+
+    Pages with a text layer are hashed on that text; scanned pages are
+    hashed on a low-resolution render, so an unchanged scan is recognised
+    without being OCR'd again.
+    """
+    if content_type != "application/pdf":
+        return [hashlib.sha256(file_content).hexdigest()]
+
+    fingerprints = []
+    doc = fitz.open(stream=file_content, filetype="pdf")
+    for page in doc:
+        page_text = page.get_text()
+        if len(page_text.strip()) >= 50:
+            payload = page_text.encode("utf-8")
+        else:
+            pix = page.get_pixmap(matrix=fitz.Matrix(0.5, 0.5), alpha=False)
+            payload = pix.samples
+        fingerprints.append(hashlib.sha256(payload).hexdigest())
+    return fingerprints
+
+
+def extract_pages(
+    file_content: bytes,
+    content_type: str,
+    page_numbers: Optional[Iterable[int]] = None,
+) -> List[str]:
+    """Extract text per page from PDFs (an image counts as one page).
+
+    When ``page_numbers`` is given only those pages are extracted, in the
+    order given.
+    """
+    pages: List[str] = []
+    numbers = list(page_numbers) if page_numbers is not None else None
 
     if content_type == "application/pdf":
         doc = fitz.open(stream=file_content, filetype="pdf")
-        full_text = []
-        for page in doc:
+        selected = [doc[n] for n in numbers] if numbers is not None else list(doc)
+        for page in selected:
             page_text = page.get_text()
             if len(page_text.strip()) < 50:
-                try:
-                    mat = fitz.Matrix(2, 2)
-                    pix = page.get_pixmap(matrix=mat, alpha=False)
-                    img_bytes = pix.tobytes("png")
-                    ocr_text = extract_text_from_image(img_bytes)
-                    full_text.append(ocr_text)
-                except Exception:
-                    try:
-                        pix = page.get_pixmap()
-                        img_bytes = pix.tobytes("png")
-                        ocr_text = extract_text_from_image(img_bytes)
-                        full_text.append(ocr_text)
-                    except Exception:
-                        full_text.append("")
+                pages.append(_page_ocr_text(page))
             else:
-                full_text.append(page_text)
-        text = "\n".join(full_text)
+                pages.append(page_text)
 
-        if not text or len(text.strip()) < 30:
-            stronger_text = []
-            for page in doc:
-                stronger_text.append(_enhanced_page_ocr(page))
-            text = "\n".join(stronger_text)
+        text = "\n".join(pages)
+        if selected and (not text or len(text.strip()) < 30):
+            pages = [_enhanced_page_ocr(page) for page in selected]
 
     elif content_type in {"image/jpeg", "image/png", "image/jpg"}:
-        text = extract_text_from_image(file_content)
+        if numbers is None or 0 in numbers:
+            pages.append(extract_text_from_image(file_content))
+
+    return pages
+
 
-    return text
+def extract_text(file_content: bytes, content_type: str) -> str:
+    """Extract text from PDFs or images."""
+    return "\n".join(extract_pages(file_content, content_type))
 
 
 def detect_language(text: str) -> str:
@@ -1,7 +1,10 @@
 """Chroma vector store helpers."""
 from __future__ import annotations
 
+from typing import Callable, Dict, List, Tuple
+
 import chromadb
+import numpy as np
 
 import student.core.chromadb_compat
 from student.doc_summarizer.config import CHROMA_DB_DIR
@@ -10,6 +13,8 @@ student.core.chromadb_compat.restore_env()
 
 _chroma_client = None
 _documents_collection = None
+_summaries_collection = None
+_parents_collection = None
 
 
 def get_chroma_client():
@@ -34,3 +39,142 @@ def get_documents_collection():
         if not hasattr(_documents_collection, "_client"):
             _documents_collection._client = client
     return _documents_collection
+
+
+def get_summaries_collection():
+    """Return the collection holding one summary embedding per document."""
+    global _summaries_collection
+    if _summaries_collection is None:
+        client = get_chroma_client()
+        _summaries_collection = client.get_or_create_collection(
+            name="document_summaries", metadata={"hnsw:space": "cosine"}
+        )
+        if not hasattr(_summaries_collection, "_client"):
+            _summaries_collection._client = client
+    return _summaries_collection
+
+
+def get_parents_collection():
+    """Return the collection holding parent windows for small-to-big retrieval."""
+    global _parents_collection
+    if _parents_collection is None:
+        client = get_chroma_client()
+        _parents_collection = client.get_or_create_collection(
+            name="document_parents", metadata={"hnsw:space": "cosine"}
+        )
+        if not hasattr(_parents_collection, "_client"):
+            _parents_collection._client = client
+    return _parents_collection
+
+
+def get_parent_texts(parent_ids: List[str]) -> Dict[str, str]:
+    """Fetch parent window texts by id."""
+    if not parent_ids:
+        return {}
+    chroma_client = get_chroma_client()
+    collection = get_parents_collection()
+    found = chroma_client._get(collection.id, ids=parent_ids, include=["documents"])
+    return dict(zip(found.get("ids", []), found.get("documents", [])))
+
+
+def centroid_embedding(embeddings: List[List[float]]) -> List[float]:
+    """Collapse several embeddings into a single normalized centroid vector."""
+    centroid = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+    norm = float(np.linalg.norm(centroid))
+    if norm > 0:
+        centroid = centroid / norm
+    return centroid.tolist()
+
+
+def upsert_document_summary(doc_id: int, source: str, embedding: List[float]) -> None:
+    """Store (or replace) the routing embedding for a document."""
+    chroma_client = get_chroma_client()
+    collection = get_summaries_collection()
+    chroma_client._upsert(
+        collection_id=collection.id,
+        ids=[f"doc_{doc_id}"],
+        embeddings=[embedding],
+        metadatas=[{"sql_doc_id": doc_id, "source": source}],
+        documents=[source],
+    )
+
+
+def missing_document_summaries(doc_ids: List[int]) -> List[int]:
+    """The given documents that have no routing embedding yet."""
+    if not doc_ids:
+        return []
+    found = get_chroma_client()._get(
+        get_summaries_collection().id,
+        ids=[f"doc_{doc_id}" for doc_id in doc_ids],
+        include=["metadatas"],
+    )
+    present = set(found.get("ids") or [])
+    return [doc_id for doc_id in doc_ids if f"doc_{doc_id}" not in present]
+
+
+def delete_document_vectors(doc_id: int) -> None:
+    """Remove every chunk and parent window stored for a document."""
+    chroma_client = get_chroma_client()
+    for collection in (get_documents_collection(), get_parents_collection()):
+        chroma_client._delete(collection.id, where={"sql_doc_id": doc_id})
+
+
+def delete_vectors_by_id(chunk_ids: List[str], parent_ids: List[str]) -> None:
+    """Remove specific chunks and parent windows."""
+    chroma_client = get_chroma_client()
+    if chunk_ids:
+        chroma_client._delete(get_documents_collection().id, ids=chunk_ids)
+    if parent_ids:
+        chroma_client._delete(get_parents_collection().id, ids=parent_ids)
+
+
+def move_vectors(
+    collection,
+    moves: Dict[str, str],
+    relabel: Callable[[Dict[str, object]], Dict[str, object]],
+) -> None:
+    """Store existing vectors under new ids without re-embedding them.
+
+    ``moves`` maps old ids to new ones and ``relabel`` returns the updated
+    metadata. Every old id is removed before the new ones are added, so
+    moves may swap ids.
+    """
+    if not moves:
+        return
+    chroma_client = get_chroma_client()
+    found = chroma_client._get(
+        collection.id, ids=list(moves), include=["embeddings", "metadatas", "documents"]
+    )
+    ids = found.get("ids") or []
+    if not ids:
+        return
+    chroma_client._delete(collection.id, ids=ids)
+    chroma_client._add(
+        [moves[i] for i in ids],
+        collection.id,
+        found["embeddings"],
+        [relabel(dict(meta or {})) for meta in found["metadatas"]],
+        found["documents"],
+    )
+
+
+def get_document_chunks(doc_id: int) -> Tuple[List[str], List[Dict[str, object]]]:
+    """Return the stored chunk texts of a document and their metadata."""
+    chroma_client = get_chroma_client()
+    found = chroma_client._get(
+        get_documents_collection().id,
+        where={"sql_doc_id": doc_id},
+        include=["documents", "metadatas"],
+    )
+    return found.get("documents") or [], found.get("metadatas") or []
+
+
+def get_document_embeddings(doc_id: int) -> List[List[float]]:
+    """Return the stored chunk embeddings of a document."""
+    chroma_client = get_chroma_client()
+    found = chroma_client._get(
+        get_documents_collection().id,
+        where={"sql_doc_id": doc_id},
+        include=["embeddings"],
+    )
+    return found.get("embeddings") or []
@@ -6,6 +6,7 @@ from student.core.database import get_db, User
 from student.routers.auth_utils import verify_token
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -19,6 +20,16 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="User not found")
     return user
 
+def get_optional_user(
+    credentials: HTTPAuthorizationCredentials = Depends(optional_security),
+    db: Session = Depends(get_db)
+):
+    """Return the authenticated user, or None when no token was sent."""
+    if credentials is None:
+        return None
+    username = verify_token(credentials.credentials)
+    return db.query(User).filter(User.username == username).first()
+
 def require_admin_or_teacher(current_user: User = Depends(get_current_user)):
     """Require admin or teacher role for access."""
     if current_user.role not in ["admin", "teacher"]:
@@ -0,0 +1,283 @@
+# student/utils/chat_memory_async.py
+"""Chat memory on redis.asyncio, for use directly from async handlers.
+
+Same functions, return values and failure behaviour as
+``chat_memory_impl`` (which stays for worker threads and Celery), built on
+the same keys and Lua scripts from ``chat_memory_schema``. The connection
+pool is opened and closed by the app lifespan via :func:`startup` and
+:func:`shutdown`.
+"""
+
+import json
+import time
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import redis
+import redis.asyncio as aioredis
+
+from student.core.redis_client import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
+from student.utils.chat_memory_schema import (
+    CREATE_CHAT,
+    HISTORY_TTL_SECONDS,
+    LLM_CONTEXT_TTL_SECONDS,
+    MIGRATE_CHAT_LIST,
+    SAVE_MESSAGE,
+    HISTORY_WINDOW,
+    backfill_reads,
+    backfilled_meta,
+    chat_key,
+    chat_list_key,
+    chat_llm_context_key,
+    chat_meta_key,
+    chat_row,
+    chat_summary_key,
+    chat_summary_lock_key,
+    chat_title_key,
+    default_title,
+    history_rows,
+    history_window_args,
+    needs_backfill,
+    next_cursor,
+    page_upper_bound,
+    save_message_call,
+    summary_row,
+)
+from student.utils.executor import run_blocking
+
+_client: Optional[aioredis.Redis] = None
+# History is read as bytes so msgpack-encoded entries survive.
+_binary_client: Optional[aioredis.Redis] = None
+_scripts: Dict[str, object] = {}
+
+
+async def startup() -> None:
+    """Open the shared async pool; called from the app lifespan."""
+    global _client, _binary_client
+    if _client is None:
+        settings = dict(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD)
+        _client = aioredis.Redis(decode_responses=True, **settings)
+        _binary_client = aioredis.Redis(**settings)
+        _scripts["save"] = _client.register_script(SAVE_MESSAGE)
+        _scripts["create"] = _client.register_script(CREATE_CHAT)
+        _scripts["migrate"] = _client.register_script(MIGRATE_CHAT_LIST)
+        _scripts["history"] = _binary_client.register_script(HISTORY_WINDOW)
+
+
+async def shutdown() -> None:
+    global _client, _binary_client
+    if _client is not None:
+        await _client.aclose()
+        await _binary_client.aclose()
+        _client = _binary_client = None
+        _scripts.clear()
+
+
+async def _redis() -> aioredis.Redis:
+    # Outside the app (scripts, benchmarks) the pool opens on first use.
+    if _client is None:
+        await startup()
+    return _client
+
+
+async def _on_chat_list(user_id: str, fn):
+    """Await ``fn()``, converting an old list-typed chat list on first contact."""
+    try:
+        return await fn()
+    except redis.ResponseError as exc:
+        if "WRONGTYPE" not in str(exc):
+            raise
+        await _scripts["migrate"](
+            keys=[chat_list_key(user_id)], args=[time.time(), HISTORY_TTL_SECONDS]
+        )
+        return await fn()
+
+
+# ------------------------------------------------------------
+# Chat Creation + Listing
+# ------------------------------------------------------------
+async def create_chat(user_id: str, title: str | None = None) -> str:
+    """Create a new chat for a user and return chat_id."""
+    chat_id = uuid4().hex
+    title = title or default_title(chat_id)
+
+    try:
+        await _redis()
+        await _scripts["create"](
+            keys=[chat_list_key(user_id), chat_meta_key(user_id, chat_id)],
+            args=[chat_id, title, HISTORY_TTL_SECONDS, time.time()],
+        )
+    except Exception:
+        pass
+
+    return chat_id
+
+
+async def list_chats(user_id: str, limit: int = 100, cursor: str | None = None) -> Dict:
+    """Return a page of chats (most recent first); see ``chat_memory_impl``."""
+    key = chat_list_key(user_id)
+    upper = page_upper_bound(cursor)
+
+    try:
+        r = await _redis()
+        page = await _on_chat_list(
+            user_id,
+            lambda: r.zrevrangebyscore(key, upper, "-inf", start=0, num=limit, withscores=True),
+        )
+        async with r.pipeline(transaction=False) as pipe:
+            for cid, _ in page:
+                pipe.hgetall(chat_meta_key(user_id, cid))
+            metas = await pipe.execute()
+    except Exception:
+        return {"chats": [], "next_cursor": None}
+
+    partial = {cid: meta for (cid, _), meta in zip(page, metas) if needs_backfill(meta)}
+    if partial:
+        try:
+            filled = await _backfill_meta(r, user_id, partial)
+        except Exception:
+            filled = {}
+        metas = [filled.get(cid, meta) for (cid, _), meta in zip(page, metas)]
+
+    chats = [chat_row(cid, meta) for (cid, _), meta in zip(page, metas)]
+    return {"chats": chats, "next_cursor": next_cursor(page, limit)}
+
+
+async def _backfill_meta(r, user_id: str, partial: Dict[str, Dict]) -> Dict[str, Dict]:
+    reads = {cid: backfill_reads(user_id, cid, meta) for cid, meta in partial.items()}
+    async with r.pipeline(transaction=False) as pipe:
+        for ops in reads.values():
+            for _, command, args in ops:
+                getattr(pipe, command)(*args)
+        values = iter(await pipe.execute())
+
+    filled = {}
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for cid, ops in reads.items():
+                found = {field: next(values) for field, _, _ in ops}
+                filled[cid] = meta = backfilled_meta(cid, partial[cid], found)
+                pipe.hset(chat_meta_key(user_id, cid), mapping=meta)
+                pipe.delete(chat_title_key(user_id, cid))
+                if HISTORY_TTL_SECONDS > 0:
+                    pipe.expire(chat_meta_key(user_id, cid), HISTORY_TTL_SECONDS)
+            await pipe.execute()
+    except Exception:
+        pass
+    return filled
+
+
+# ------------------------------------------------------------
+# Message Saving, History Loading, Chat Delete
+# ------------------------------------------------------------
+async def save_message(user_id: str, chat_id: str, role: str, message: str) -> Dict | None:
+    """Append a message in one scripted round trip; None if Redis failed."""
+    entry_obj, keys, args = save_message_call(user_id, chat_id, role, message)
+    try:
+        await _redis()
+        entry_obj["seq"], summarize = await _scripts["save"](keys=keys, args=args)
+    except Exception:
+        return None
+
+    if summarize:
+        # Publishing to the Celery broker is blocking.
+        from student.utils.chat_memory_impl import request_summary
+
+        await run_blocking(request_summary, user_id, chat_id)
+    return entry_obj
+
+
+async def get_history(
+    user_id: str,
+    chat_id: str,
+    limit: int | None = None,
+    before: int | None = None,
+) -> List[Dict]:
+    """Return a window of messages, oldest first; see ``chat_memory_impl``."""
+    try:
+        await _redis()
+        reply = await _scripts["history"](
+            keys=[chat_key(user_id, chat_id), chat_meta_key(user_id, chat_id)],
+            args=history_window_args(limit, before),
+        )
+        return history_rows(reply)
+    except Exception:
+        return []
+
+
+async def clear_history(user_id: str, chat_id: str) -> None:
+    """Delete entire chat + remove from chat list."""
+    async def clear():
+        async with r.pipeline() as pipe:
+            pipe.delete(
+                chat_key(user_id, chat_id),
+                chat_meta_key(user_id, chat_id),
+                chat_summary_key(user_id, chat_id),
+                chat_summary_lock_key(user_id, chat_id),
+                chat_title_key(user_id, chat_id),
+                chat_llm_context_key(user_id, chat_id),
+            )
+            pipe.zrem(chat_list_key(user_id), chat_id)
+            await pipe.execute()
+
+    try:
+        r = await _redis()
+        await _on_chat_list(user_id, clear)
+    except Exception:
+        return
+
+
+async def delete_chat(user_id: str, chat_id: str) -> None:
+    """Alias to clear_history"""
+    await clear_history(user_id, chat_id)
+
+
+async def rename_chat(user_id: str, chat_id: str, title: str) -> None:
+    """Rename the chat title."""
+    try:
+        r = await _redis()
+        async with r.pipeline() as pipe:
+            pipe.hset(chat_meta_key(user_id, chat_id), "title", title)
+            if HISTORY_TTL_SECONDS > 0:
+                pipe.expire(chat_meta_key(user_id, chat_id), HISTORY_TTL_SECONDS)
+            await pipe.execute()
+    except Exception:
+        return
+
+
+# ------------------------------------------------------------
+# Running Summary (written by the Celery task via chat_memory_impl)
+# ------------------------------------------------------------
+async def get_summary(user_id: str, chat_id: str) -> Dict | None:
+    """Return ``{"text", "seq"}``: a summary of every message up to ``seq``."""
+    try:
+        r = await _redis()
+        return summary_row(await r.hgetall(chat_summary_key(user_id, chat_id)))
+    except Exception:
+        return None
+
+
+# ------------------------------------------------------------
+# Ollama KV Context (reused across turns)
+# ------------------------------------------------------------
+async def get_llm_context(user_id: str, chat_id: str) -> Dict | None:
+    """Return the stored ``{"model", "source", "context"}`` for a chat, if any."""
+    try:
+        r = await _redis()
+        raw = await r.get(chat_llm_context_key(user_id, chat_id))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+async def save_llm_context(user_id: str, chat_id: str, data: Dict | None) -> None:
+    """Store (or, with ``None``, drop) the Ollama context for a chat."""
+    key = chat_llm_context_key(user_id, chat_id)
+    try:
+        r = await _redis()
+        if data is None:
+            await r.delete(key)
+        else:
+            await r.set(key, json.dumps(data), ex=LLM_CONTEXT_TTL_SECONDS or None)
+    except Exception:
+        return
@@ -1,54 +1,64 @@
 # student/utils/chat_memory_impl.py
 
-import os
 import json
 import time
-import redis
 from typing import List, Dict
 from uuid import uuid4
 
+import redis
 
-# ------------------------------------------------------------
-# Redis Configuration
-# ------------------------------------------------------------
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_DB = int(os.getenv("REDIS_DB", 0))
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
-
-# Max messages to keep in each chat
-MAX_HISTORY = int(os.getenv("CHAT_MAX_HISTORY", 200))
-
-# Expire chats after 30 days of inactivity
-HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL", 60 * 60 * 24 * 30))
-
-# Redis client
-_pool = redis.ConnectionPool(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    db=REDIS_DB,
-    password=REDIS_PASSWORD,
-    decode_responses=True
+from student.core.redis_client import get_redis, get_redis_binary
+from student.utils.chat_memory_schema import (
+    CREATE_CHAT,
+    HISTORY_TTL_SECONDS,
+    LLM_CONTEXT_TTL_SECONDS,
+    MIGRATE_CHAT_LIST,
+    SAVE_MESSAGE,
+    STORE_SUMMARY,
+    HISTORY_WINDOW,
+    backfill_reads,
+    backfilled_meta,
+    chat_key,
+    chat_list_key,
+    chat_llm_context_key,
+    chat_meta_key,
+    chat_row,
+    chat_summary_key,
+    chat_summary_lock_key,
+    chat_title_key,
+    default_title,
+    history_rows,
+    history_window_args,
+    needs_backfill,
+    next_cursor,
+    page_upper_bound,
+    save_message_call,
+    summary_row,
 )
-_r = redis.Redis(connection_pool=_pool)
-
 
-# ------------------------------------------------------------
-# Redis Key Helpers
-# ------------------------------------------------------------
-def _chat_key(user_id: str, chat_id: str) -> str:
-    """Redis key storing messages for a specific chat."""
-    return f"chat:{user_id}:{chat_id}"
+# Redis client
+_r = get_redis()
 
+_save_message_script = _r.register_script(SAVE_MESSAGE)
+_create_chat_script = _r.register_script(CREATE_CHAT)
+_migrate_script = _r.register_script(MIGRATE_CHAT_LIST)
+_store_summary_script = _r.register_script(STORE_SUMMARY)
 
-def _chat_list_key(user_id: str) -> str:
-    """Redis key storing list of chat_ids for this user."""
-    return f"chat_list:{user_id}"
+# History is read as bytes so msgpack-encoded entries survive.
+_rb = get_redis_binary()
+_history_script = _rb.register_script(HISTORY_WINDOW)
 
 
-def _chat_title_key(user_id: str, chat_id: str) -> str:
-    """Redis key storing a readable title for the chat."""
-    return f"chat_title:{user_id}:{chat_id}"
+def _on_chat_list(user_id: str, fn):
+    """Run a read (or idempotent write) of the chat list, converting an old
+    list-typed key on first contact."""
+    try:
+        return fn()
+    except redis.ResponseError as exc:
+        if "WRONGTYPE" not in str(exc):
+            raise
+        _migrate_script(keys=[chat_list_key(user_id)], args=[time.time(), HISTORY_TTL_SECONDS])
+        return fn()
 
 
 # ------------------------------------------------------------
@@ -57,115 +67,142 @@ def _chat_title_key(user_id: str, chat_id: str) -> str:
 def create_chat(user_id: str, title: str | None = None) -> str:
     """Create a new chat for a user and return chat_id."""
     chat_id = uuid4().hex
-    title = title or f"Chat {chat_id[:6]}"
+    title = title or default_title(chat_id)
 
     try:
-        # Add chat to user's chat list (most recent = left)
-        _r.lpush(_chat_list_key(user_id), chat_id)
-
-        # Save chat title
-        _r.set(_chat_title_key(user_id, chat_id), title)
-
-        # TTL for chat list + title
-        if HISTORY_TTL_SECONDS > 0:
-            _r.expire(_chat_list_key(user_id), HISTORY_TTL_SECONDS)
-            _r.expire(_chat_title_key(user_id, chat_id), HISTORY_TTL_SECONDS)
-
+        # Add to the chat list as most recent and save the title, together
+        _create_chat_script(
+            keys=[chat_list_key(user_id), chat_meta_key(user_id, chat_id)],
+            args=[chat_id, title, HISTORY_TTL_SECONDS, time.time()],
+        )
     except Exception:
         pass  # fail silently — safe
 
     return chat_id
 
 
-def list_chats(user_id: str, limit: int = 100) -> List[Dict]:
-    """Return list of chats (most recent first) with metadata."""
-    key = _chat_list_key(user_id)
+def list_chats(user_id: str, limit: int = 100, cursor: str | None = None) -> Dict:
+    """Return a page of chats (most recent first) with metadata.
+
+    One read of the sorted chat list plus one pipelined HGETALL of the
+    per-chat metadata. ``cursor`` is the ``next_cursor`` of the previous
+    page (the last chat's activity score); it is None on the last page.
+    """
+    key = chat_list_key(user_id)
+    upper = page_upper_bound(cursor)
 
     try:
-        chat_ids = _r.lrange(key, 0, limit - 1)
+        page = _on_chat_list(
+            user_id,
+            lambda: _r.zrevrangebyscore(key, upper, "-inf", start=0, num=limit, withscores=True),
+        )
+        pipe = _r.pipeline(transaction=False)
+        for cid, _ in page:
+            pipe.hgetall(chat_meta_key(user_id, cid))
+        metas = pipe.execute()
     except Exception:
-        return []
-
-    result = []
-
-    for cid in chat_ids:
-        title = _r.get(_chat_title_key(user_id, cid)) or f"Chat {cid[:6]}"
+        return {"chats": [], "next_cursor": None}
 
-        # fetch last message from this chat
+    partial = {cid: meta for (cid, _), meta in zip(page, metas) if needs_backfill(meta)}
+    if partial:
         try:
-            last = _r.lindex(_chat_key(user_id, cid), -1)
-            last_msg = json.loads(last)["message"] if last else ""
-            last_ts = json.loads(last)["ts"] if last else None
+            filled = _backfill_meta(user_id, partial)
         except Exception:
-            last_msg = ""
-            last_ts = None
-
-        result.append({
-            "chat_id": cid,
-            "title": title,
-            "last_message": last_msg,
-            "ts": last_ts
-        })
-
-    return result
+            filled = {}
+        metas = [filled.get(cid, meta) for (cid, _), meta in zip(page, metas)]
+
+    chats = [chat_row(cid, meta) for (cid, _), meta in zip(page, metas)]
+    return {"chats": chats, "next_cursor": next_cursor(page, limit)}
+
+
+def _backfill_meta(user_id: str, partial: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Complete chat_meta for chats written before it existed (once each)."""
+    reads = {cid: backfill_reads(user_id, cid, meta) for cid, meta in partial.items()}
+    pipe = _r.pipeline(transaction=False)
+    for ops in reads.values():
+        for _, command, args in ops:
+            getattr(pipe, command)(*args)
+    values = iter(pipe.execute())
+
+    filled = {}
+    pipe = _r.pipeline(transaction=False)
+    for cid, ops in reads.items():
+        found = {field: next(values) for field, _, _ in ops}
+        filled[cid] = meta = backfilled_meta(cid, partial[cid], found)
+        pipe.hset(chat_meta_key(user_id, cid), mapping=meta)
+        pipe.delete(chat_title_key(user_id, cid))
+        if HISTORY_TTL_SECONDS > 0:
+            pipe.expire(chat_meta_key(user_id, cid), HISTORY_TTL_SECONDS)
+    try:
+        pipe.execute()
+    except Exception:
+        pass
+    return filled
 
 
 # ------------------------------------------------------------
 # Message Saving, History Loading, Chat Delete
 # ------------------------------------------------------------
-def save_message(user_id: str, chat_id: str, role: str, message: str) -> None:
-    """Append a message to this chat & make chat most recent."""
-    key = _chat_key(user_id, chat_id)
-
-    entry_obj = {
-        "id": uuid4().hex,
-        "role": role,
-        "message": message,
-        "ts": int(time.time())
-    }
-    entry = json.dumps(entry_obj)
-
-    try:
-        # Append to message list
-        _r.rpush(key, entry)
-
-        # Keep only last MAX_HISTORY messages
-        _r.ltrim(key, -MAX_HISTORY, -1)
-
-        # Refresh TTL
-        if HISTORY_TTL_SECONDS > 0:
-            _r.expire(key, HISTORY_TTL_SECONDS)
-
-        # Move this chat to the top of chat_list
-        list_key = _chat_list_key(user_id)
-
-        _r.lrem(list_key, 0, chat_id)   # remove duplicates
-        _r.lpush(list_key, chat_id)     # add to top
+def save_message(user_id: str, chat_id: str, role: str, message: str) -> Dict | None:
+    """Append a message to this chat & make chat most recent.
 
-        if HISTORY_TTL_SECONDS > 0:
-            _r.expire(list_key, HISTORY_TTL_SECONDS)
+    Append, trim, TTL refresh, chat-list reordering and the chat metadata
+    update run as one Lua script: a single atomic round trip. Returns the
+    stored entry, or None if Redis was unavailable.
 
+    When the unsummarized part of the chat has grown past the trigger, a
+    summarization is queued on Celery.
+    """
+    entry_obj, keys, args = save_message_call(user_id, chat_id, role, message)
+    try:
+        entry_obj["seq"], summarize = _save_message_script(keys=keys, args=args)
     except Exception:
-        return
+        return None
 
+    if summarize:
+        request_summary(user_id, chat_id)
+    return entry_obj
 
-def get_history(user_id: str, chat_id: str) -> List[Dict]:
-    """Return all messages in one chat."""
-    key = _chat_key(user_id, chat_id)
 
+def get_history(
+    user_id: str,
+    chat_id: str,
+    limit: int | None = None,
+    before: int | None = None,
+) -> List[Dict]:
+    """Return messages in one chat, oldest first, each with its ``seq``.
+
+    ``limit`` keeps only the newest ``limit`` messages (all when None);
+    ``before`` pages back from a ``seq`` (exclusive). One scripted read
+    that transfers only the requested window.
+    """
     try:
-        items = _r.lrange(key, 0, -1)
-        return [json.loads(i) for i in items]
+        reply = _history_script(
+            keys=[chat_key(user_id, chat_id), chat_meta_key(user_id, chat_id)],
+            args=history_window_args(limit, before),
+        )
+        return history_rows(reply)
     except Exception:
         return []
 
 
 def clear_history(user_id: str, chat_id: str) -> None:
     """Delete entire chat + remove from chat list."""
+    def clear():
+        pipe = _r.pipeline()
+        pipe.delete(
+            chat_key(user_id, chat_id),
+            chat_meta_key(user_id, chat_id),
+            chat_summary_key(user_id, chat_id),
+            chat_summary_lock_key(user_id, chat_id),
+            chat_title_key(user_id, chat_id),
+            chat_llm_context_key(user_id, chat_id),
+        )
+        pipe.zrem(chat_list_key(user_id), chat_id)
+        pipe.execute()
+
     try:
-        _r.delete(_chat_key(user_id, chat_id))
-        _r.lrem(_chat_list_key(user_id), 0, chat_id)
-        _r.delete(_chat_title_key(user_id, chat_id))
+        _on_chat_list(user_id, clear)
     except Exception:
         return
 
@@ -178,8 +215,88 @@ def delete_chat(user_id: str, chat_id: str) -> None:
 def rename_chat(user_id: str, chat_id: str, title: str) -> None:
     """Rename the chat title."""
     try:
-        _r.set(_chat_title_key(user_id, chat_id), title)
+        pipe = _r.pipeline()
+        pipe.hset(chat_meta_key(user_id, chat_id), "title", title)
         if HISTORY_TTL_SECONDS > 0:
-            _r.expire(_chat_title_key(user_id, chat_id), HISTORY_TTL_SECONDS)
+            pipe.expire(chat_meta_key(user_id, chat_id), HISTORY_TTL_SECONDS)
+        pipe.execute()
+    except Exception:
+        return
+
+
+# ------------------------------------------------------------
+# Running Summary (older messages, folded by a Celery task)
+# ------------------------------------------------------------
+def request_summary(user_id: str, chat_id: str) -> None:
+    """Queue a summarization; the caller holds the chat's summary lock."""
+    from student.workers.tasks import summarize_chat_task
+
+    try:
+        summarize_chat_task.delay(user_id, chat_id)
+    except Exception as exc:
+        print(f"[chat_memory] could not queue summary: {exc}")
+        release_summary_lock(user_id, chat_id)
+
+
+def release_summary_lock(user_id: str, chat_id: str) -> None:
+    try:
+        _r.delete(chat_summary_lock_key(user_id, chat_id))
+    except Exception:
+        return
+
+
+def get_summary(user_id: str, chat_id: str) -> Dict | None:
+    """Return ``{"text", "seq"}``: a summary of every message up to ``seq``."""
+    try:
+        return summary_row(_r.hgetall(chat_summary_key(user_id, chat_id)))
+    except Exception:
+        return None
+
+
+def store_summary(
+    user_id: str,
+    chat_id: str,
+    text: str,
+    seq: int,
+    folded_tokens: int,
+    seen_seq: int,
+    remaining_tokens: int,
+) -> bool:
+    """Store a summary covering messages up to ``seq``.
+
+    ``folded_tokens`` (the estimate the messages were counted with) comes
+    off the chat's unsummarized total; if nothing was saved after
+    ``seen_seq``, the total becomes ``remaining_tokens`` instead. Returns
+    False if the chat is gone or a newer summary is already stored.
+    """
+    try:
+        return bool(_store_summary_script(
+            keys=[chat_summary_key(user_id, chat_id), chat_meta_key(user_id, chat_id)],
+            args=[text, seq, folded_tokens, HISTORY_TTL_SECONDS, seen_seq, remaining_tokens],
+        ))
+    except Exception:
+        return False
+
+
+# ------------------------------------------------------------
+# Ollama KV Context (reused across turns)
+# ------------------------------------------------------------
+def get_llm_context(user_id: str, chat_id: str) -> Dict | None:
+    """Return the stored ``{"model", "source", "context"}`` for a chat, if any."""
+    try:
+        raw = _r.get(chat_llm_context_key(user_id, chat_id))
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+def save_llm_context(user_id: str, chat_id: str, data: Dict | None) -> None:
+    """Store (or, with ``None``, drop) the Ollama context for a chat."""
+    key = chat_llm_context_key(user_id, chat_id)
+    try:
+        if data is None:
+            _r.delete(key)
+        else:
+            _r.set(key, json.dumps(data), ex=LLM_CONTEXT_TTL_SECONDS or None)
     except Exception:
         return
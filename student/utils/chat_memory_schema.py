@@ -0,0 +1,356 @@
+# student/utils/chat_memory_schema.py
+"""Redis layout of chat memory, shared by the sync and async backends.
+
+Both ``chat_memory_impl`` (redis.Redis) and ``chat_memory_async``
+(redis.asyncio) use these key names, Lua scripts and row helpers, so the
+two can serve the same data side by side.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple, Union
+from uuid import uuid4
+
+from student.utils.context_packing import estimate_tokens
+
+try:
+    import msgpack
+except ImportError:  # optional: compact entries need `pip install msgpack`
+    msgpack = None
+
+
+# ------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------
+
+# Max messages to keep in each chat
+MAX_HISTORY = int(os.getenv("CHAT_MAX_HISTORY", 200))
+
+# Expire chats after 30 days of inactivity
+HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL", 60 * 60 * 24 * 30))
+
+# Characters of the last message kept in the chat metadata for the sidebar
+MESSAGE_PREVIEW_CHARS = int(os.getenv("CHAT_PREVIEW_CHARS", 200))
+
+# How new messages are stored: "json" or the more compact "msgpack".
+# Lists may mix both; readers detect each entry's format.
+CHAT_ENCODING = os.getenv("CHAT_ENCODING", "json").lower()
+if CHAT_ENCODING == "msgpack" and msgpack is None:
+    print("[chat_memory] msgpack not installed; storing messages as JSON")
+    CHAT_ENCODING = "json"
+
+# Once a chat's messages not yet in its running summary pass this many
+# (estimated) tokens, the assistant save queues a summarization; 0 disables.
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", 1200))
+# How long a queued summarization holds the chat's lock if it never finishes.
+SUMMARY_LOCK_SECONDS = int(os.getenv("CHAT_SUMMARY_LOCK_SECONDS", 300))
+# Newest messages always left out of the summary (they stay raw in prompts).
+SUMMARY_KEEP_RECENT = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", 4))
+# Tokens of messages folded in per run, and the summary's own size limit.
+SUMMARY_INPUT_TOKENS = int(os.getenv("CHAT_SUMMARY_INPUT_TOKENS", 2500))
+SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", 300))
+
+# Ollama KV context kept per chat; Ollama unloads idle models after its own
+# keep_alive, so there is no point holding the token context much longer.
+LLM_CONTEXT_TTL_SECONDS = int(os.getenv("CHAT_LLM_CONTEXT_TTL", 60 * 30))
+
+
+# ------------------------------------------------------------
+# Key Helpers
+# ------------------------------------------------------------
+def chat_key(user_id: str, chat_id: str) -> str:
+    """Redis key storing messages for a specific chat."""
+    return f"chat:{user_id}:{chat_id}"
+
+
+def chat_list_key(user_id: str) -> str:
+    """Redis sorted set of this user's chat_ids, scored by last activity."""
+    return f"chat_list:{user_id}"
+
+
+def chat_meta_key(user_id: str, chat_id: str) -> str:
+    """Redis hash with the chat's title, last message preview, ts and count."""
+    return f"chat_meta:{user_id}:{chat_id}"
+
+
+def chat_summary_key(user_id: str, chat_id: str) -> str:
+    """Redis hash with the running summary of older messages and its seq."""
+    return f"chat_summary:{user_id}:{chat_id}"
+
+
+def chat_summary_lock_key(user_id: str, chat_id: str) -> str:
+    """Held while a summarization of the chat is queued or running."""
+    return f"chat_summary_lock:{user_id}:{chat_id}"
+
+
+def chat_title_key(user_id: str, chat_id: str) -> str:
+    """Legacy key holding the chat title, read once to fill chat_meta."""
+    return f"chat_title:{user_id}:{chat_id}"
+
+
+def chat_llm_context_key(user_id: str, chat_id: str) -> str:
+    """Redis key storing the Ollama token context of the last turn."""
+    return f"chat_ctx:{user_id}:{chat_id}"
+
+
+# ------------------------------------------------------------
+# Lua Scripts (one round trip, atomic)
+# ------------------------------------------------------------
+
+# The chat list used to be a Redis list; it is now a sorted set scored by
+# last activity. Scripts that write it convert an old list in place first,
+# keeping its order.
+_MIGRATE_CHAT_LIST = """
+local function migrate_chat_list(key, now, ttl)
+  if redis.call('TYPE', key).ok ~= 'list' then return end
+  local ids = redis.call('LRANGE', key, 0, -1)
+  redis.call('DEL', key)
+  for i, id in ipairs(ids) do
+    if not redis.call('ZSCORE', key, id) then
+      redis.call('ZADD', key, now - i, id)
+    end
+  end
+  if ttl > 0 and #ids > 0 then redis.call('EXPIRE', key, ttl) end
+end
+"""
+
+# Messages are numbered by a per-chat sequence kept in chat_meta ('seq' is
+# the newest message's number), so list position i holds message
+# seq - LLEN + 1 + i. Chats from before the counter start it at LLEN.
+#
+# 'pending_tokens' in chat_meta estimates the tokens of messages not yet
+# folded into the running summary; crossing the trigger takes the summary
+# lock, and the caller queues the summarization.
+
+# KEYS: chat messages, chat list, chat meta, chat summary, summary lock
+# ARGV: entry, max history, ttl seconds, chat_id, activity score,
+#       message preview, message ts, message tokens,
+#       summary trigger tokens (0 = never), lock seconds
+# Returns {new message's seq, 1 if a summarization should be queued}.
+SAVE_MESSAGE = _MIGRATE_CHAT_LIST + """
+local ttl = tonumber(ARGV[3])
+local max = tonumber(ARGV[2])
+migrate_chat_list(KEYS[2], tonumber(ARGV[5]), ttl)
+local seq = redis.call('HGET', KEYS[3], 'seq')
+if not seq then seq = redis.call('LLEN', KEYS[1]) end
+seq = tonumber(seq) + 1
+local count = redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -max, -1)
+if count > max then count = max end
+redis.call('ZADD', KEYS[2], ARGV[5], ARGV[4])
+redis.call('HSET', KEYS[3], 'last_message', ARGV[6], 'ts', ARGV[7], 'count', count, 'seq', seq)
+local pending = redis.call('HINCRBY', KEYS[3], 'pending_tokens', ARGV[8])
+local summarize = 0
+local trigger = tonumber(ARGV[9])
+if trigger > 0 and pending >= trigger then
+  if redis.call('SET', KEYS[5], 1, 'NX', 'EX', ARGV[10]) then summarize = 1 end
+end
+if ttl > 0 then
+  redis.call('EXPIRE', KEYS[1], ttl)
+  redis.call('EXPIRE', KEYS[2], ttl)
+  redis.call('EXPIRE', KEYS[3], ttl)
+  redis.call('EXPIRE', KEYS[4], ttl)
+end
+return {seq, summarize}
+"""
+
+# KEYS: chat messages, chat meta
+# ARGV: limit (0 = everything), before seq ('' = newest)
+# Returns {seq of the first message returned, entries}.
+HISTORY_WINDOW = """
+local len = redis.call('LLEN', KEYS[1])
+local last = tonumber(redis.call('HGET', KEYS[2], 'seq') or len)
+local first = last - len + 1
+local stop = len - 1
+if ARGV[2] ~= '' then stop = math.min(stop, tonumber(ARGV[2]) - first - 1) end
+if stop < 0 then return {0, {}} end
+local start = 0
+local limit = tonumber(ARGV[1])
+if limit > 0 then start = math.max(0, stop - limit + 1) end
+return {first + start, redis.call('LRANGE', KEYS[1], start, stop)}
+"""
+
+# KEYS: chat summary, chat meta
+# ARGV: summary text, seq of the last message it covers, tokens folded in,
+#       ttl seconds, newest seq the summarizer read, tokens it left unfolded
+# Ignored if the chat was deleted meanwhile or a newer summary is stored.
+# With no message saved since the read, pending_tokens is set exactly (this
+# also forgets messages trimmed before they were summarized).
+STORE_SUMMARY = """
+if redis.call('EXISTS', KEYS[2]) == 0 then return 0 end
+local current = tonumber(redis.call('HGET', KEYS[1], 'seq') or 0)
+if tonumber(ARGV[2]) <= current then return 0 end
+redis.call('HSET', KEYS[1], 'text', ARGV[1], 'seq', ARGV[2])
+if redis.call('HGET', KEYS[2], 'seq') == ARGV[5] then
+  redis.call('HSET', KEYS[2], 'pending_tokens', ARGV[6])
+else
+  local pending = redis.call('HINCRBY', KEYS[2], 'pending_tokens', -tonumber(ARGV[3]))
+  if pending < 0 then redis.call('HSET', KEYS[2], 'pending_tokens', 0) end
+end
+local ttl = tonumber(ARGV[4])
+if ttl > 0 then redis.call('EXPIRE', KEYS[1], ttl) end
+return 1
+"""
+
+# KEYS: chat list, chat meta
+# ARGV: chat_id, title, ttl seconds, activity score
+CREATE_CHAT = _MIGRATE_CHAT_LIST + """
+local ttl = tonumber(ARGV[3])
+migrate_chat_list(KEYS[1], tonumber(ARGV[4]), ttl)
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+redis.call('HSET', KEYS[2], 'title', ARGV[2], 'count', 0)
+if ttl > 0 then
+  redis.call('EXPIRE', KEYS[1], ttl)
+  redis.call('EXPIRE', KEYS[2], ttl)
+end
+return 1
+"""
+
+# KEYS: chat list; ARGV: now, ttl seconds
+MIGRATE_CHAT_LIST = _MIGRATE_CHAT_LIST + """
+migrate_chat_list(KEYS[1], tonumber(ARGV[1]), tonumber(ARGV[2]))
+return 1
+"""
+
+
+# ------------------------------------------------------------
+# Row Helpers
+# ------------------------------------------------------------
+def default_title(chat_id: str) -> str:
+    return f"Chat {chat_id[:6]}"
+
+
+def encode_entry(entry: Dict) -> Union[str, bytes]:
+    if CHAT_ENCODING == "msgpack":
+        return msgpack.packb(entry, use_bin_type=True)
+    return json.dumps(entry)
+
+
+def decode_entry(raw: Union[str, bytes]) -> Dict:
+    """Decode an entry stored as JSON or msgpack."""
+    if isinstance(raw, bytes) and raw[:1] != b"{":
+        if msgpack is None:
+            raise ValueError("msgpack entry found but msgpack is not installed")
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
+
+
+def history_window_args(limit: Optional[int], before: Optional[int]) -> List:
+    return [limit or 0, "" if before is None else int(before)]
+
+
+def history_rows(reply) -> List[Dict]:
+    """Decode a HISTORY_WINDOW reply, numbering each entry with its seq."""
+    first_seq, items = reply
+    rows = []
+    for offset, raw in enumerate(items):
+        entry = decode_entry(raw)
+        entry["seq"] = int(first_seq) + offset
+        rows.append(entry)
+    return rows
+
+
+def message_tokens(message: str) -> int:
+    """Estimated tokens a message adds to the unsummarized history."""
+    return estimate_tokens(message)
+
+
+def save_message_call(user_id: str, chat_id: str, role: str, message: str) -> Tuple[Dict, List, List]:
+    """Return ``(entry, keys, args)`` for one SAVE_MESSAGE call.
+
+    Only assistant replies can trigger a summarization, so it runs once a
+    turn is complete.
+    """
+    now = time.time()
+    entry = {
+        "id": uuid4().hex,
+        "role": role,
+        "message": message,
+        "ts": int(now)
+    }
+    keys = [
+        chat_key(user_id, chat_id),
+        chat_list_key(user_id),
+        chat_meta_key(user_id, chat_id),
+        chat_summary_key(user_id, chat_id),
+        chat_summary_lock_key(user_id, chat_id),
+    ]
+    args = [
+        encode_entry(entry),
+        MAX_HISTORY,
+        HISTORY_TTL_SECONDS,
+        chat_id,
+        now,
+        message[:MESSAGE_PREVIEW_CHARS],
+        entry["ts"],
+        message_tokens(message),
+        SUMMARY_TRIGGER_TOKENS if role == "assistant" else 0,
+        SUMMARY_LOCK_SECONDS,
+    ]
+    return entry, keys, args
+
+
+def summary_row(raw: Dict) -> Optional[Dict]:
+    """Shape a chat_summary hash as ``{"text", "seq"}`` (None if empty)."""
+    if not raw or not raw.get("text"):
+        return None
+    return {"text": raw["text"], "seq": int(raw.get("seq") or 0)}
+
+
+def page_upper_bound(cursor: Optional[str]) -> str:
+    """ZREVRANGEBYSCORE max for the page after ``cursor`` (exclusive)."""
+    return f"({cursor}" if cursor else "+inf"
+
+
+def next_cursor(page: List[Tuple[str, float]], limit: int) -> Optional[str]:
+    return repr(page[-1][1]) if len(page) == limit else None
+
+
+def needs_backfill(meta: Dict) -> bool:
+    """True for chats written before chat_meta existed."""
+    return "title" not in meta or "count" not in meta
+
+
+def backfill_reads(user_id: str, chat_id: str, meta: Dict) -> List[Tuple[str, str, tuple]]:
+    """Redis reads needed to complete ``meta``: ``(field, command, args)``.
+
+    Only legacy chats lack the message fields, and their entries are JSON,
+    so these are safe on a string-decoding client.
+    """
+    reads = [("title", "get", (chat_title_key(user_id, chat_id),))]
+    if "last_message" not in meta:
+        reads.append(("last", "lindex", (chat_key(user_id, chat_id), -1)))
+    if "count" not in meta:
+        reads.append(("count", "llen", (chat_key(user_id, chat_id),)))
+    return reads
+
+
+def backfilled_meta(chat_id: str, meta: Dict, found: Dict) -> Dict:
+    """Complete ``meta`` from the legacy title key and the message list.
+
+    Fields already in the hash win.
+    """
+    filled = {"title": found.get("title") or default_title(chat_id)}
+    if "count" in found:
+        filled["count"] = found["count"]
+    if found.get("last"):
+        try:
+            entry = decode_entry(found["last"])
+            filled["last_message"] = entry["message"][:MESSAGE_PREVIEW_CHARS]
+            filled["ts"] = entry["ts"]
+        except Exception:
+            pass
+    filled.update(meta)
+    return {k: str(v) for k, v in filled.items()}
+
+
+def chat_row(chat_id: str, meta: Dict) -> Dict:
+    """Shape a chat_meta hash for the chats API."""
+    return {
+        "chat_id": chat_id,
+        "title": meta.get("title") or default_title(chat_id),
+        "last_message": meta.get("last_message", ""),
+        "ts": int(meta["ts"]) if meta.get("ts") else None,
+        "count": int(meta.get("count") or 0),
+    }
@@ -0,0 +1,84 @@
+"""Per-dependency circuit breakers.
+
+A breaker opens after ``failure_threshold`` consecutive failures and then
+rejects calls for ``cooldown`` seconds. After the cool-down a single trial
+call is let through (half-open): success closes the breaker, failure opens
+it for another cool-down.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict
+
+from student.utils import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = CLOSED
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """Return True if a call may go through now."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                # Let exactly one trial call through.
+                self._state = HALF_OPEN
+                return True
+        metrics.incr(f"breaker.{self.name}.rejected")
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._state = CLOSED
+        metrics.set_gauge(f"breaker.{self.name}.open", 0)
+
+    def release(self) -> None:
+        """Give back a trial call that was abandoned without an outcome."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = OPEN
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.incr(f"breaker.{self.name}.opened")
+            metrics.set_gauge(f"breaker.{self.name}.open", 1)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, failure_threshold: int = 3, cooldown: float = 30.0) -> CircuitBreaker:
+    """Return the process-wide breaker for ``name``, creating it on first use."""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, cooldown)
+        return breaker
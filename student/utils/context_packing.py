@@ -0,0 +1,217 @@
+"""Token-budgeted packing of LLM prompt sections.
+
+Prompts are assembled from a fixed template, the question, and optional
+sections (document context, chat history, semantic memory). This module
+measures everything with the generation model's tokenizer and fits the
+optional sections into what is left of the context window:
+
+* each section first gets its share of the remaining budget;
+* items are taken in priority order (relevance for context, recency for
+  history), and the first item that does not fit is cut at a sentence
+  boundary;
+* budget a section does not use is offered to the others, in section order.
+
+The token counts used are returned so callers can report them per request.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Llama 3.2's tokenizer from an ungated mirror (the meta-llama repo needs HF
+# auth); a local directory works as well.
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "unsloth/Llama-3.2-1B-Instruct")
+# Ollama's num_ctx for the chat model, and room kept free for the answer.
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", 4096))
+LLM_ANSWER_RESERVE = int(os.getenv("LLM_ANSWER_RESERVE", 512))
+
+# Used only when the tokenizer cannot be loaded (offline, gated repo).
+_CHARS_PER_TOKEN = 4
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_tokenizer = None
+_tokenizer_failed = False
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is None and not _tokenizer_failed:
+        with _tokenizer_lock:
+            if _tokenizer is None and not _tokenizer_failed:
+                try:
+                    from transformers import AutoTokenizer
+
+                    _tokenizer = AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+                except Exception as exc:
+                    print(
+                        f"[context_packing] WARNING: tokenizer {LLM_TOKENIZER!r} could not be "
+                        f"loaded ({exc}); token counts fall back to len/{_CHARS_PER_TOKEN} "
+                        f"estimates and prompts may overflow the context window. Set "
+                        f"LLM_TOKENIZER to an accessible repo or a local path."
+                    )
+                    _tokenizer_failed = True
+    return _tokenizer
+
+
+def load_tokenizer() -> bool:
+    """Load the tokenizer ahead of the first request; False if estimating."""
+    return _get_tokenizer() is not None
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate from length, for hot paths that only need a rough count."""
+    if not text:
+        return 0
+    return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens ``text`` costs in the generation model."""
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Keep whole leading sentences of ``text`` that fit in ``budget`` tokens."""
+    if budget <= 0:
+        return ""
+    kept: List[str] = []
+    used = 0
+    for sentence in _SENTENCE_RE.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        cost = count_tokens(sentence) + 1
+        if used + cost > budget:
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept)
+
+
+@dataclass
+class Section:
+    """An optional prompt section.
+
+    ``items`` are listed most important first; ``share`` is the fraction of
+    the free budget reserved for this section before redistribution.
+    ``chronological`` sections are emitted oldest first (history), however
+    they were prioritised.
+    """
+
+    name: str
+    items: List[str]
+    share: float
+    separator: str = "\n\n"
+    chronological: bool = False
+    # Filled in by pack_prompt.
+    kept: List[str] = field(default_factory=list)
+    tokens: int = 0
+    next_item: int = 0
+    cut_cost: int = 0
+
+    @property
+    def text(self) -> str:
+        kept = list(reversed(self.kept)) if self.chronological else self.kept
+        return self.separator.join(kept)
+
+    @property
+    def dropped(self) -> int:
+        return len(self.items) - self.next_item
+
+    @property
+    def wants_more(self) -> bool:
+        return bool(self.cut_cost) or self.next_item < len(self.items)
+
+
+@dataclass
+class PackResult:
+    sections: Dict[str, Section]
+    usage: Dict[str, object]
+
+    def text(self, name: str) -> str:
+        section = self.sections.get(name)
+        return section.text if section else ""
+
+
+def _fill(section: Section, costs: List[int], budget: int) -> int:
+    """Add items from where the section left off; return tokens spent."""
+    spent = 0
+    if section.cut_cost:
+        # Redo the item that was cut, now that there may be more room.
+        section.kept.pop()
+        section.next_item -= 1
+        spent -= section.cut_cost
+        section.cut_cost = 0
+
+    while section.next_item < len(section.items):
+        cost = costs[section.next_item]
+        if cost <= budget - spent:
+            section.kept.append(section.items[section.next_item])
+            section.next_item += 1
+            spent += cost
+            continue
+        partial = truncate_to_tokens(section.items[section.next_item], budget - spent)
+        if partial:
+            section.cut_cost = count_tokens(partial) + 1
+            section.kept.append(partial)
+            section.next_item += 1
+            spent += section.cut_cost
+        break
+
+    section.tokens += spent
+    return spent
+
+
+def pack_prompt(
+    template: str,
+    question: str,
+    sections: List[Section],
+    window: Optional[int] = None,
+    reserve: int = LLM_ANSWER_RESERVE,
+) -> PackResult:
+    """Fit ``sections`` around the template and question.
+
+    ``template`` is the prompt with every section (and the question) empty;
+    ``window`` defaults to ``LLM_CONTEXT_WINDOW``.
+    """
+    window = LLM_CONTEXT_WINDOW if window is None else window
+    template_tokens = count_tokens(template)
+    question_tokens = count_tokens(question)
+    budget = window - reserve
+    free = max(0, budget - template_tokens - question_tokens)
+
+    costs = {s.name: [count_tokens(item) + 1 for item in s.items] for s in sections}
+    total_share = sum(s.share for s in sections) or 1.0
+
+    leftover = 0
+    for section in sections:
+        allowance = int(free * section.share / total_share)
+        leftover += allowance - _fill(section, costs[section.name], allowance)
+
+    # Sections that ran out of room get what the others left unused.
+    for section in sections:
+        if leftover <= 0:
+            break
+        if section.wants_more:
+            leftover -= _fill(section, costs[section.name], leftover)
+
+    usage: Dict[str, object] = {
+        "template": template_tokens,
+        "question": question_tokens,
+    }
+    for section in sections:
+        usage[section.name] = section.tokens
+    usage["total"] = template_tokens + question_tokens + sum(s.tokens for s in sections)
+    usage["budget"] = budget
+    usage["dropped"] = {s.name: s.dropped for s in sections if s.dropped}
+    return PackResult({s.name: s for s in sections}, usage)
@@ -0,0 +1,224 @@
+"""Request deadlines carried through every stage of a request.
+
+An endpoint opens a deadline with :func:`request_deadline`. It lives in a
+contextvar, so blocking helpers run through ``run_blocking`` see it as well.
+Stages run under a budget, capped by what is left of the deadline:
+
+* :func:`run_stage` (awaitables) and :func:`call_stage` (blocking calls)
+  stop waiting when the budget runs out. Required stages raise
+  :class:`DeadlineExceeded`; optional ones return a default, so the request
+  degrades instead of failing. Blocking work cannot be interrupted and
+  finishes in the background, its result unused.
+* :func:`timed` only measures a stage that bounds itself.
+* :func:`can_afford` lets a stage that cannot be interrupted (the reranker)
+  skip itself when its p95 no longer fits.
+* :meth:`Deadline.stream` bounds a token stream.
+
+Each stage's budget, time spent and outcome is kept on the deadline
+(:meth:`Deadline.report`) and observed as the ``stage.<request>.<stage>``
+latency metric.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+from student.utils import metrics
+from student.utils.executor import submit_blocking
+
+
+class DeadlineExceeded(Exception):
+    """A required stage ran out of budget."""
+
+
+class Deadline:
+    """A point in time a request must finish by, plus its stage reports."""
+
+    def __init__(self, seconds: float, name: str, stages: Optional[Dict] = None) -> None:
+        self.name = name
+        self.budget = seconds
+        self.started = time.monotonic()
+        self.expires = self.started + seconds
+        self.stages: Dict[str, Dict[str, Any]] = {} if stages is None else stages
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def child(self, budget: float) -> "Deadline":
+        """Deadline of one stage: ``budget`` or what is left, reporting here."""
+        return Deadline(min(budget, self.remaining()), self.name, self.stages)
+
+    def record(self, stage: str, budget: float, spent: float, status: str = "ok") -> None:
+        self.stages[stage] = {
+            "budget": round(budget, 3),
+            "spent": round(spent, 3),
+            "status": status,
+        }
+        if status != "skipped":
+            metrics.observe(f"stage.{self.name}.{stage}", spent)
+        if status != "ok":
+            metrics.incr(f"stage.{self.name}.{stage}.{status}")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "budget": self.budget,
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "stages": dict(self.stages),
+        }
+
+    async def stream(self, stage: str, items: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Yield from ``items``; raise DeadlineExceeded once the deadline passes."""
+        budget = self.remaining()
+        started = time.monotonic()
+        status = "cancelled"
+        iterator = items.__aiter__()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(iterator.__anext__(), self.remaining())
+                except StopAsyncIteration:
+                    status = "ok"
+                    return
+                except asyncio.TimeoutError:
+                    status = "timeout"
+                    raise DeadlineExceeded(
+                        f"{stage} did not finish within the {self.budget:g}s deadline"
+                    ) from None
+                yield item
+        except Exception:
+            if status == "cancelled":
+                status = "error"
+            raise
+        finally:
+            self.record(stage, budget, time.monotonic() - started, status)
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def request_deadline(seconds: float, name: str) -> Iterator[Deadline]:
+    """Give the enclosed code (and what it awaits or submits) a deadline."""
+    deadline = Deadline(seconds, name)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def time_left(default: float) -> float:
+    """``default``, or less if the current deadline comes sooner."""
+    deadline = _current.get()
+    return default if deadline is None else min(default, deadline.remaining())
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Report the time spent in a stage that bounds itself."""
+    deadline = _current.get()
+    budget = deadline.remaining() if deadline else 0.0
+    started = time.monotonic()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        if deadline is not None:
+            deadline.record(stage, budget, time.monotonic() - started, status)
+
+
+def can_afford(stage: str) -> bool:
+    """False (and the stage reported skipped) if its p95 exceeds the time left."""
+    deadline = _current.get()
+    if deadline is None:
+        return True
+    typical = metrics.percentile(f"stage.{deadline.name}.{stage}", 95)
+    if typical is None or typical <= deadline.remaining():
+        return True
+    deadline.record(stage, deadline.remaining(), 0.0, "skipped")
+    return False
+
+
+def _timed_out(deadline: Deadline, stage: str, budget: float, started: float, optional: bool) -> None:
+    deadline.record(stage, budget, time.monotonic() - started, "degraded" if optional else "timeout")
+    if not optional:
+        raise DeadlineExceeded(f"{stage} exceeded its {budget:.2f}s budget")
+
+
+async def run_stage(
+    stage: str,
+    awaitable: Awaitable[Any],
+    budget: float,
+    optional: bool = False,
+    default: Any = None,
+) -> Any:
+    """Await ``awaitable`` within ``budget`` seconds of the current deadline."""
+    deadline = _current.get()
+    if deadline is None:
+        return await awaitable
+
+    child = deadline.child(budget)
+    token = _current.set(child)
+    started = time.monotonic()
+    try:
+        value = await asyncio.wait_for(awaitable, child.budget)
+    except asyncio.TimeoutError:
+        _timed_out(deadline, stage, child.budget, started, optional)
+        return default
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        deadline.record(stage, child.budget, time.monotonic() - started, "error")
+        raise
+    finally:
+        _current.reset(token)
+    deadline.record(stage, child.budget, time.monotonic() - started)
+    return value
+
+
+def call_stage(
+    stage: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    budget: float,
+    optional: bool = False,
+    default: Any = None,
+    **kwargs: Any,
+) -> Any:
+    """Run blocking ``fn`` on the pool and wait at most ``budget`` seconds."""
+    deadline = _current.get()
+    if deadline is None:
+        return fn(*args, **kwargs)
+
+    child = deadline.child(budget)
+    token = _current.set(child)
+    try:
+        future = submit_blocking(fn, *args, **kwargs)
+    finally:
+        _current.reset(token)
+    started = time.monotonic()
+    try:
+        value = future.result(timeout=child.budget)
+    except FutureTimeoutError:
+        if future.done():
+            raise
+        _timed_out(deadline, stage, child.budget, started, optional)
+        return default
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        deadline.record(stage, child.budget, time.monotonic() - started, "error")
+        raise
+    deadline.record(stage, child.budget, time.monotonic() - started)
+    return value
@@ -0,0 +1,41 @@
+"""Bounded thread pool for blocking calls made from async handlers.
+
+Redis, Chroma and the bge-m3 embedder are synchronous. Calling them directly
+inside an ``async def`` stalls every other request on the event loop, so
+handlers hand them to this pool instead. The pool is bounded so a burst of
+chats queues here rather than spawning unbounded threads.
+
+Calls run in a copy of the caller's context, so contextvars such as the
+request deadline (``utils.deadline``) carry over, as with ``asyncio.to_thread``.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 8))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run ``fn(*args, **kwargs)`` on the blocking pool and await the result."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, functools.partial(context.run, fn, *args, **kwargs)
+    )
+
+
+def submit_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """Schedule ``fn`` on the blocking pool without waiting for it."""
+    return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def shutdown() -> None:
+    """Stop accepting work; called from the app lifespan on shutdown."""
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -1,11 +1,26 @@
 """Utility helpers for interacting with the local Ollama LLM server."""
 from __future__ import annotations
 
+import contextvars
+import json
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from typing import Optional
 
-import requests
+import httpx
+
+from student.utils import metrics
+from student.utils.circuit_breaker import get_breaker
+from student.utils.deadline import time_left
+from student.utils.ollama_client import (
+    GENERATE_ENDPOINT,
+    OLLAMA_CONNECT_TIMEOUT,
+    get_sync_client,
+)
+from student.utils.singleflight import SingleFlight, flight_key
 
 # ---------------------------------------------------------------------------
 # Configuration (override via environment variables if needed)
@@ -13,10 +28,19 @@ import requests
 
 DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
 FALLBACK_MODEL = os.getenv("OLLAMA_FALLBACK_MODEL", "llama3:latest")
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
 OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
 
-GENERATE_ENDPOINT = f"{OLLAMA_BASE_URL}/api/generate"
+# A model that fails this many times in a row is skipped for the cool-down.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Hedged mode: if the primary model has not produced a first token by its
+# recent p95 time-to-first-token, the fallback model is asked as well and
+# whichever answers first wins.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "3"))  # until p95 is known
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "8"))
 
 
 @dataclass
@@ -30,6 +54,19 @@ class LLMError(Exception):
         return self.message
 
 
+# answer_with_llm reports failures as text; these prefixes mark such replies.
+_ERROR_PREFIXES = (
+    "Error communicating with LLM",
+    "LLM returned an empty response",
+    "Model '",
+)
+
+
+def is_error_answer(answer: str) -> bool:
+    """Return True when ``answer_with_llm`` returned an error message."""
+    return answer.startswith(_ERROR_PREFIXES)
+
+
 def _build_prompt(question: str, context: str) -> str:
     return f"""
 You are an answer extraction model.
@@ -50,41 +87,80 @@ ANSWER:
 """
 
 
-def _call_ollama(model: str, prompt: str) -> str:
+def answer_prompt_template() -> str:
+    """The answer prompt with no context or question, for token budgeting."""
+    return _build_prompt("", "")
+
+
+def _call_ollama(
+    model: str,
+    prompt: str,
+    first_token: Optional[threading.Event] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Optional[str]:
+    """Generate a full answer from ``model``.
+
+    The response is streamed so time-to-first-token can be measured (and
+    signalled through ``first_token``). Returns None if ``cancel`` is set
+    before the answer is complete. The request deadline, if any, caps
+    OLLAMA_TIMEOUT.
+    """
     payload = {
         "model": model,
         "prompt": prompt,
         "temperature": 0,
-        "stream": False,
+        "stream": True,
     }
-
-    response = requests.post(
-        GENERATE_ENDPOINT,
-        json=payload,
-        timeout=OLLAMA_TIMEOUT,
-    )
-
-    # Ollama returns 404 for "model not found", so handle it explicitly
-    if response.status_code == 404:
-        try:
-            detail = response.json().get("error", response.text)
-        except ValueError:
-            detail = response.text
-        raise LLMError(
-            message=f"Model '{model}' is not available. Run: ollama pull {model}",
-            model=model,
-        ) from None
+    timeout = time_left(OLLAMA_TIMEOUT)
+    started = time.perf_counter()
+    deadline = started + timeout
+    parts = []
 
     try:
-        response.raise_for_status()
-        data = response.json()
+        with get_sync_client().stream(
+            "POST",
+            GENERATE_ENDPOINT,
+            json=payload,
+            timeout=httpx.Timeout(timeout, connect=min(OLLAMA_CONNECT_TIMEOUT, timeout)),
+        ) as response:
+            # Ollama returns 404 for "model not found", so handle it explicitly
+            if response.status_code == 404:
+                raise LLMError(
+                    message=f"Model '{model}' is not available. Run: ollama pull {model}",
+                    model=model,
+                ) from None
+            response.raise_for_status()
+
+            for line in response.iter_lines():
+                if cancel is not None and cancel.is_set():
+                    return None
+                if time.perf_counter() > deadline:
+                    raise LLMError(
+                        f"Error communicating with LLM: {model} timed out", model=model
+                    )
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise LLMError(f"Error communicating with LLM: {data['error']}", model=model)
+                token = data.get("response", "")
+                if token and not parts:
+                    metrics.observe(f"llm.{model}.ttft", time.perf_counter() - started)
+                    if first_token is not None:
+                        first_token.set()
+                parts.append(token)
+                if data.get("done"):
+                    break
+    except LLMError:
+        raise
     except Exception as exc:
         raise LLMError(f"Error communicating with LLM: {exc}", model=model) from exc
 
-    answer = data.get("response", "").strip()
+    answer = "".join(parts).strip()
     if not answer:
         raise LLMError("LLM returned an empty response.", model=model)
 
+    metrics.observe(f"llm.{model}.latency", time.perf_counter() - started)
     return answer
 
 
@@ -107,8 +183,15 @@ def _sanitize_answer(answer: str) -> str:
     return cleaned or "I could not find the answer in the provided document."
 
 
+_answers_in_flight = SingleFlight("answer")
+
+
 def answer_with_llm(question: str, context: str) -> str:
-    """Generate an answer using Ollama with automatic fallback handling."""
+    """Generate an answer using Ollama with automatic fallback handling.
+
+    Identical concurrent requests (same prompt and model chain) share one
+    generation.
+    """
     if not context:
         return "I could not find the answer in the provided document."
 
@@ -118,11 +201,24 @@ def answer_with_llm(question: str, context: str) -> str:
     if FALLBACK_MODEL and FALLBACK_MODEL not in models_to_try:
         models_to_try.append(FALLBACK_MODEL)
 
+    key = flight_key(models=models_to_try, prompt=prompt)
+    return _answers_in_flight.do(key, lambda: _generate_answer(prompt, models_to_try))
+
+
+def _generate_answer(prompt: str, models_to_try: list) -> str:
+    """Return the first answer from the model chain (or the last error).
+
+    Models whose circuit breaker is open are skipped without a request.
+    """
+    if LLM_HEDGE and len(models_to_try) > 1 and _breaker(models_to_try[0]).allow():
+        return _generate_hedged(prompt, models_to_try[0], models_to_try[1])
+
     last_error: Optional[LLMError] = None
     for model in models_to_try:
+        if not _breaker(model).allow():
+            continue
         try:
-            raw_answer = _call_ollama(model, prompt)
-            return _sanitize_answer(raw_answer)
+            return _sanitize_answer(_call_model(model, prompt))
         except LLMError as exc:
             last_error = exc
             continue
@@ -130,4 +226,131 @@ def answer_with_llm(question: str, context: str) -> str:
     # All models failed; report the most recent error.
     if last_error:
         return str(last_error)
-    return "Error communicating with LLM: Unknown error"
\ No newline at end of file
+    return "Error communicating with LLM: every model is cooling down after failures"
+
+
+def _breaker(model: str):
+    return get_breaker(
+        f"llm.{model}",
+        failure_threshold=LLM_BREAKER_FAILURES,
+        cooldown=LLM_BREAKER_COOLDOWN,
+    )
+
+
+def _call_model(model: str, prompt: str, first_token=None, cancel=None) -> Optional[str]:
+    """``_call_ollama`` with the outcome recorded on the model's breaker.
+
+    Callers must have been admitted by the breaker's ``allow()``.
+    """
+    breaker = _breaker(model)
+    try:
+        answer = _call_ollama(model, prompt, first_token=first_token, cancel=cancel)
+    except LLMError:
+        if time_left(OLLAMA_TIMEOUT) <= 0:
+            # The request's deadline ran out, which says nothing about the model.
+            breaker.release()
+            raise
+        metrics.incr(f"llm.{model}.failures")
+        breaker.record_failure()
+        raise
+    if answer is None:
+        breaker.release()
+    else:
+        breaker.record_success()
+    return answer
+
+
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge"
+)
+
+
+def _submit(fn, *args):
+    """Run ``fn`` on the hedge pool in the caller's context (its deadline)."""
+    return _hedge_executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _hedge_delay(model: str) -> float:
+    p95 = metrics.percentile(f"llm.{model}.ttft", 95)
+    delay = LLM_HEDGE_DELAY if p95 is None else p95
+    return min(max(delay, LLM_HEDGE_MIN_DELAY), OLLAMA_TIMEOUT)
+
+
+def _generate_hedged(prompt: str, primary: str, fallback: str) -> str:
+    """Ask ``primary``; also ask ``fallback`` if the first token is late.
+
+    The primary must already have been admitted by its breaker. The fallback
+    is also used when the primary fails outright.
+    """
+    cancel = threading.Event()
+    first_token = threading.Event()
+    primary_future = _submit(_call_model, primary, prompt, first_token, cancel)
+    # A primary that fails early ends the wait as well.
+    primary_future.add_done_callback(lambda _: first_token.set())
+    pending = {primary_future}
+    hedged = False
+
+    try:
+        if not first_token.wait(_hedge_delay(primary)) and _breaker(fallback).allow():
+            metrics.incr("llm.hedged")
+            pending.add(_submit(_call_model, fallback, prompt, None, cancel))
+            hedged = True
+
+        last_error: Optional[LLMError] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    answer = future.result()
+                except LLMError as exc:
+                    last_error = exc
+                    if future is primary_future and not hedged and _breaker(fallback).allow():
+                        pending.add(_submit(_call_model, fallback, prompt))
+                        hedged = True
+                    continue
+                if answer is not None:
+                    if future is not primary_future:
+                        metrics.incr("llm.hedge_wins")
+                    return _sanitize_answer(answer)
+        return str(last_error) if last_error else "Error communicating with LLM: Unknown error"
+    finally:
+        # Stop whichever generation lost the race.
+        cancel.set()
+
+
+def _build_summary_prompt(previous: str, transcript: str, max_words: int) -> str:
+    return f"""
+You maintain a running summary of a conversation between a user and an
+assistant about a document.
+
+Update the summary with the new messages below. Keep facts, names, numbers,
+decisions and open questions the user may refer back to; drop greetings and
+repetition. Write plain prose in at most {max_words} words. Return only the
+summary.
+
+CURRENT SUMMARY:
+{previous or "(none yet)"}
+
+NEW MESSAGES:
+{transcript}
+
+UPDATED SUMMARY:
+"""
+
+
+def summarize_with_llm(previous: str, transcript: str, max_words: int = 200) -> str:
+    """Fold ``transcript`` into the running summary ``previous``.
+
+    Uses the same model chain and breakers as answers; raises ``LLMError``
+    when no model produced a summary.
+    """
+    prompt = _build_summary_prompt(previous, transcript, max_words)
+    last_error: Optional[LLMError] = None
+    for model in dict.fromkeys((DEFAULT_MODEL, FALLBACK_MODEL)):
+        if not model or not _breaker(model).allow():
+            continue
+        try:
+            return _call_model(model, prompt)
+        except LLMError as exc:
+            last_error = exc
+    raise last_error or LLMError("Error communicating with LLM: every model is cooling down after failures")
@@ -0,0 +1,63 @@
+"""In-process metrics: counters, gauges and latency percentiles.
+
+Kept deliberately small: values live in this process only and are exposed
+as a JSON snapshot at ``/api/metrics``.
+"""
+from __future__ import annotations
+
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+# Latency reservoirs keep the most recent samples only.
+SAMPLE_WINDOW = 1024
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Increase a counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Record the current value of something that goes up and down."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one latency (or size) sample."""
+    with _lock:
+        _samples[name].append(value)
+
+
+def percentile(name: str, q: float) -> Optional[float]:
+    """Return the q-th percentile (0-100) of recent samples, if any."""
+    with _lock:
+        values = sorted(_samples.get(name, ()))
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def snapshot() -> Dict[str, object]:
+    """Return every metric as plain JSON-friendly data."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        names = list(_samples)
+    summaries = {}
+    for name in names:
+        summaries[name] = {
+            "count": len(_samples[name]),
+            "p50": percentile(name, 50),
+            "p95": percentile(name, 95),
+            "p99": percentile(name, 99),
+        }
+    return {"counters": counters, "gauges": gauges, "latencies": summaries}
@@ -0,0 +1,84 @@
+"""Shared, pooled HTTP clients for the local Ollama server.
+
+One ``httpx.AsyncClient`` (streaming chat) and one ``httpx.Client``
+(blocking ``/api/ask`` answers) are kept for the life of the app so
+connections are reused with keep-alive instead of being set up per request.
+Both are created in the FastAPI lifespan and closed on shutdown; code running
+outside the app (Celery workers, scripts) gets them lazily on first use.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+GENERATE_ENDPOINT = f"{OLLAMA_BASE_URL}/api/generate"
+
+# Connection pool shared by all concurrent generations.
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 16))
+OLLAMA_KEEPALIVE_SECONDS = float(os.getenv("OLLAMA_KEEPALIVE_SECONDS", 60))
+
+# Connecting to a local server should be instant; reads cover prompt
+# prefill (before the first token) and the gap between streamed tokens.
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", 120))
+OLLAMA_POOL_TIMEOUT = float(os.getenv("OLLAMA_POOL_TIMEOUT", 30))
+
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+_sync_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OLLAMA_POOL_SIZE,
+        max_keepalive_connections=OLLAMA_POOL_SIZE,
+        keepalive_expiry=OLLAMA_KEEPALIVE_SECONDS,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=OLLAMA_CONNECT_TIMEOUT,
+        read=OLLAMA_READ_TIMEOUT,
+        write=OLLAMA_CONNECT_TIMEOUT,
+        pool=OLLAMA_POOL_TIMEOUT,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the shared async client (streaming path)."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+    return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    """Return the shared blocking client (non-streaming path)."""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        with _sync_lock:
+            if _sync_client is None or _sync_client.is_closed:
+                _sync_client = httpx.Client(limits=_limits(), timeout=_timeout())
+    return _sync_client
+
+
+async def startup() -> None:
+    """Open both clients; called from the app lifespan."""
+    get_async_client()
+    get_sync_client()
+
+
+async def shutdown() -> None:
+    """Close both clients and their pooled connections."""
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
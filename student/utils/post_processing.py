@@ -0,0 +1,173 @@
+"""Write-behind queue for work that follows a streamed chat answer.
+
+Once the last token has been sent, the question still has to be embedded
+into semantic memory, and memories the turn's search returned marked as
+recently used. Doing that inside the SSE generator holds the
+connection open and blocks the event loop, so turns are queued here instead
+and a background task drains them in batches on the blocking pool (at most
+one embedding pass per batch; turns usually carry their question's vector
+already).
+
+The assistant reply is saved by the stream itself before it ends, so the
+next turn and a history reload see it in order. Only turns cut short by a
+disconnect, which can no longer await, leave the reply to this queue.
+
+The queue is bounded: when it is full the caller is told so and runs the
+turn itself, so nothing is dropped under load.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from student.core.chroma_memory import add_memories, flush_recency
+from student.utils import metrics
+from student.utils.chat_memory_impl import save_llm_context, save_message
+from student.utils.executor import run_blocking, submit_blocking
+
+POST_QUEUE_MAXSIZE = int(os.getenv("POST_QUEUE_MAXSIZE", 1000))
+POST_BATCH_SIZE = int(os.getenv("POST_BATCH_SIZE", 32))
+POST_BATCH_WAIT_SECONDS = float(os.getenv("POST_BATCH_WAIT_SECONDS", 0.05))
+
+
+@dataclass
+class ChatTurn:
+    """Everything needed to finish a chat turn after streaming."""
+
+    user_id: str
+    chat_id: str
+    question: str
+    reply: str
+    remember: bool = False
+    # Ollama context to reuse next turn; None with reset_context clears it.
+    llm_context: Optional[Dict] = None
+    reset_context: bool = False
+    # The question's vector from retrieval, reused for the memory insert.
+    embedding: Optional[List[float]] = None
+    # Set once the stream has saved the reply itself.
+    reply_saved: bool = False
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def process_turns(turns: List[ChatTurn]) -> None:
+    """Persist unsaved replies and add memories for a batch of turns (blocking)."""
+    for turn in turns:
+        if not turn.reply_saved:
+            save_message(turn.user_id, turn.chat_id, "assistant", turn.reply)
+        if turn.llm_context is not None or turn.reset_context:
+            save_llm_context(turn.user_id, turn.chat_id, turn.llm_context)
+
+    remembered = [turn for turn in turns if turn.remember]
+    if remembered:
+        try:
+            add_memories(
+                [(turn.user_id, turn.question) for turn in remembered],
+                [turn.embedding for turn in remembered],
+            )
+        except Exception as exc:
+            print(f"[post_processing] memory write failed: {exc}")
+            metrics.incr("post_processing.memory_errors")
+
+    # Memories returned by searches since the last batch become recently used.
+    metrics.incr("post_processing.recency_writes", flush_recency())
+
+
+class PostProcessor:
+    """Bounded asyncio queue drained in batches by one background task."""
+
+    def __init__(
+        self,
+        maxsize: int = POST_QUEUE_MAXSIZE,
+        batch_size: int = POST_BATCH_SIZE,
+        batch_wait: float = POST_BATCH_WAIT_SECONDS,
+    ) -> None:
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Drain what is queued, then stop the worker."""
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def submit(self, turn: ChatTurn) -> bool:
+        """Queue a turn; return False if the caller must process it itself."""
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait(turn)
+        except asyncio.QueueFull:
+            metrics.incr("post_processing.rejected")
+            return False
+        metrics.incr("post_processing.enqueued")
+        metrics.set_gauge("post_processing.depth", self._queue.qsize())
+        return True
+
+    async def finish(self, turn: ChatTurn) -> None:
+        """Queue a turn, or run it on the blocking pool if the queue is full."""
+        if not self.submit(turn):
+            await run_blocking(process_turns, [turn])
+
+    def finish_nowait(self, turn: ChatTurn) -> None:
+        """Like :meth:`finish`, for callers that can no longer await.
+
+        Used by streams cancelled mid-answer, where any further ``await``
+        would be cancelled as well.
+        """
+        if not self.submit(turn):
+            submit_blocking(process_turns, [turn])
+
+    async def _next_batch(self) -> List[ChatTurn]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await run_blocking(process_turns, batch)
+                metrics.incr("post_processing.processed", len(batch))
+            except Exception as exc:
+                print(f"[post_processing] batch failed: {exc}")
+                metrics.incr("post_processing.errors", len(batch))
+            finally:
+                now = time.monotonic()
+                for turn in batch:
+                    metrics.observe("post_processing.lag_seconds", now - turn.enqueued_at)
+                    self._queue.task_done()
+                metrics.observe("post_processing.batch_size", len(batch))
+                metrics.set_gauge("post_processing.depth", self._queue.qsize())
+
+
+post_processor = PostProcessor()
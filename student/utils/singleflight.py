@@ -0,0 +1,159 @@
+"""Single-flight deduplication of identical in-flight LLM generations.
+
+When a whole class asks the same question at once, only the first request
+(the leader) talks to Ollama. Blocking callers that arrive while it runs wait
+for and share its result; streaming callers subscribe to one upstream token
+stream, replaying the tokens already produced before following it live.
+
+Calls are keyed by a hash of everything that determines the output (model,
+prompt, reused context). A finished call is forgotten immediately, so this
+is deduplication of concurrent work only, not a cache.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from student.utils import metrics
+
+
+def flight_key(**parts: Any) -> str:
+    """Stable hash of the inputs that determine a generation."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Blocking single-flight: concurrent callers with one key share one call."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f"singleflight.{self.name}.shared")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.incr(f"singleflight.{self.name}.leaders")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class _Broadcast:
+    """One upstream token stream fanned out to any number of subscribers."""
+
+    def __init__(self) -> None:
+        self.tokens: List[str] = []
+        self.result: Dict[str, Any] = {}
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def pump(self, upstream: AsyncIterator[str]) -> None:
+        try:
+            async for token in upstream:
+                async with self.changed:
+                    self.tokens.append(token)
+                    self.changed.notify_all()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as exc:
+            self.error = exc
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+
+class StreamFanout:
+    """Async single-flight for token streams."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._streams: Dict[str, _Broadcast] = {}
+
+    async def subscribe(
+        self,
+        key: str,
+        factory: Callable[[Dict[str, Any]], AsyncIterator[str]],
+        result: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """Yield the tokens of the generation for ``key``, starting it if needed.
+
+        ``factory(result)`` opens the upstream stream and fills ``result``
+        when it ends; every subscriber gets a copy in its own ``result``.
+        The upstream is cancelled once its last subscriber goes away.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.create_task(broadcast.pump(factory(broadcast.result)))
+            broadcast.task.add_done_callback(lambda _: self._forget(key, broadcast))
+            metrics.incr(f"singleflight.{self.name}.leaders")
+        else:
+            metrics.incr(f"singleflight.{self.name}.shared")
+
+        broadcast.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(
+                        lambda: broadcast.done or len(broadcast.tokens) > position
+                    )
+                    pending = broadcast.tokens[position:]
+                    finished = broadcast.done
+                position += len(pending)
+                for token in pending:
+                    yield token
+                if finished and position == len(broadcast.tokens):
+                    break
+
+            if result is not None:
+                result.update(broadcast.result)
+            if broadcast.error is not None and not isinstance(
+                broadcast.error, asyncio.CancelledError
+            ):
+                raise broadcast.error
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done and broadcast.task:
+                self._forget(key, broadcast)
+                broadcast.task.cancel()
+                metrics.incr(f"singleflight.{self.name}.upstream_cancelled")
+
+    def _forget(self, key: str, broadcast: _Broadcast) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
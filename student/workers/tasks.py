@@ -1,22 +1,134 @@
+import json
+import os
+from difflib import SequenceMatcher
+from typing import Optional
+
 from student.core.celerey_app import celery_app
 from sqlalchemy.orm import sessionmaker
-from student.core.database import engine, Document
+from student.core.database import engine, Document, DocumentPage
 
 # Ensure each worker process initializes its own Chroma client state.
 import student.core.chromadb_compat
-from student.doc_summarizer.services.chunking import text_splitter
+from student.doc_summarizer.services import answer_cache, context_cache
+from student.doc_summarizer.services.chunking import split_parent_child
+from student.doc_summarizer.services.dedup import (
+    dedupe_chunks,
+    simhash,
+    strip_lines,
+    strip_page_furniture,
+)
 from student.doc_summarizer.services.embeddings import get_embed
-from student.doc_summarizer.services.text_extraction import extract_text, detect_language
+from student.doc_summarizer.services.text_extraction import (
+    detect_language,
+    extract_pages,
+    page_fingerprints,
+)
 from student.doc_summarizer.services.vector_store import (
+    centroid_embedding,
+    delete_document_vectors,
+    delete_vectors_by_id,
     get_chroma_client,
+    get_document_chunks,
+    get_document_embeddings,
     get_documents_collection,
+    get_parents_collection,
+    missing_document_summaries,
+    move_vectors,
+    upsert_document_summary,
+)
+from student.utils.chat_memory_impl import (
+    get_history,
+    get_summary,
+    release_summary_lock,
+    store_summary,
+)
+from student.utils.chat_memory_schema import (
+    SUMMARY_INPUT_TOKENS,
+    SUMMARY_KEEP_RECENT,
+    SUMMARY_MAX_TOKENS,
+    message_tokens,
 )
+from student.utils.context_packing import truncate_to_tokens
+from student.utils.llm import LLMError, summarize_with_llm
+
+
+def _chunk_id(doc_id: int, page: int, index: int) -> str:
+    return f"doc_{doc_id}_p{page}_chunk_{index}"
+
+
+def _parent_id(doc_id: int, page: int, index: int) -> str:
+    return f"doc_{doc_id}_p{page}_parent_{index}"
+
+
+def _kept_chunks(doc_id: int, replaced_pages) -> list:
+    """Texts of the stored chunks that an incremental run leaves in place."""
+    texts, metadatas = get_document_chunks(doc_id)
+    return [
+        text for text, meta in zip(texts, metadatas)
+        if (meta or {}).get("page") not in replaced_pages
+    ]
+
+
+def _match_pages(old_rows, fingerprints) -> dict:
+    """Pair pages of the new upload with stored pages of identical content.
+
+    Matching is by content hash rather than page number, so inserting or
+    deleting a page only shifts the pages after it. Returns
+    ``{new page number: old row}``.
+    """
+    numbers = sorted(old_rows)
+    matcher = SequenceMatcher(
+        None, [old_rows[n].content_hash for n in numbers], list(fingerprints), autojunk=False
+    )
+    matched = {}
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for k in range(size):
+            matched[new_start + k] = old_rows[numbers[old_start + k]]
+    return matched
+
+
+def _move_pages(doc_id: int, moves: dict, rows_by_page: dict) -> None:
+    """Renumber the chunks and parent windows of pages that only moved."""
+    chunk_moves, parent_moves = {}, {}
+    for old, new in moves.items():
+        row = rows_by_page[old]
+        for i in range(row.chunk_count or 0):
+            chunk_moves[_chunk_id(doc_id, old, i)] = _chunk_id(doc_id, new, i)
+        for j in range(row.parent_count or 0):
+            parent_moves[_parent_id(doc_id, old, j)] = _parent_id(doc_id, new, j)
+
+    def relabel(meta):
+        meta["page"] = moves.get(meta.get("page"), meta.get("page"))
+        if meta.get("parent_id") in parent_moves:
+            meta["parent_id"] = parent_moves[meta["parent_id"]]
+        return meta
+
+    move_vectors(get_documents_collection(), chunk_moves, relabel)
+    move_vectors(get_parents_collection(), parent_moves, relabel)
+
+
+def _stale_ids(doc_id: int, rows):
+    """Chunk and parent ids previously stored for the given page rows."""
+    chunk_ids, parent_ids = [], []
+    for row in rows:
+        chunk_ids += [_chunk_id(doc_id, row.page_number, i) for i in range(row.chunk_count or 0)]
+        parent_ids += [_parent_id(doc_id, row.page_number, j) for j in range(row.parent_count or 0)]
+    return chunk_ids, parent_ids
 
 
 @celery_app.task(bind=True, max_retries=3)
-def process_document_task(self, doc_id: int, file_path: str, content_type: str):
+def process_document_task(
+    self, doc_id: int, file_path: str, content_type: str, previous_path: Optional[str] = None
+):
     """Process a document: extract text, create embeddings, and store chunks.
 
+    Every page is fingerprinted first. On a re-upload, pages are matched to
+    the stored ones by hash; only inserted or edited pages are extracted and
+    embedded again. Chunks of pages that merely moved are renumbered, chunks
+    of edited or removed pages are deleted by id, and the rest stay in place.
+    ``previous_path`` (the replaced upload) is deleted once this version is
+    stored; a task for a version that has since been replaced does nothing.
+
     The worker creates its own ChromaDB client and collection to avoid
     sharing a Collection instance across processes (which can lack
     internal `_client` state).
@@ -28,6 +140,9 @@ def process_document_task(self, doc_id: int, file_path: str, content_type: str):
         doc = db.query(Document).filter(Document.id == doc_id).first()
         if not doc:
             raise ValueError(f"Document with id {doc_id} not found")
+        if doc.file_path != file_path:
+            print(f"[Celery] Doc {doc_id}: {file_path} was replaced by a newer upload, skipping")
+            return "superseded"
 
         doc.status = "processing"
         db.commit()
@@ -35,37 +150,127 @@ def process_document_task(self, doc_id: int, file_path: str, content_type: str):
         with open(file_path, "rb") as f:
             content = f.read()
 
-        text = extract_text(content, content_type)
-        lang = detect_language(text)
+        fingerprints = page_fingerprints(content, content_type)
+        old_rows = {
+            row.page_number: row
+            for row in db.query(DocumentPage).filter(DocumentPage.document_id == doc.id)
+        }
+        incremental = bool(old_rows)
 
-        chunks = text_splitter.split_text(text)
-        if not chunks:
+        matched = _match_pages(old_rows, fingerprints)
+        changed = [n for n in range(len(fingerprints)) if n not in matched]
+        still_used = {row.page_number for row in matched.values()}
+        stale_rows = [row for n, row in old_rows.items() if n not in still_used]
+        moves = {row.page_number: n for n, row in matched.items() if row.page_number != n}
+
+        pages = extract_pages(content, content_type, changed)
+
+        # Headers, footers and watermarks repeated on every page would
+        # otherwise be embedded once per page. A partial re-upload reuses
+        # the furniture found when the whole document was ingested.
+        if incremental:
+            furniture = set(json.loads(doc.boilerplate or "[]"))
+            pages = strip_lines(pages, furniture)
+        else:
+            pages, furniture = strip_page_furniture(pages)
+            doc.boilerplate = json.dumps(sorted(furniture))
+            if furniture:
+                print(f"[Celery] Doc {doc.id}: stripped {len(furniture)} repeated page lines")
+
+        # On a re-upload the chunks of unchanged pages stay; they still count
+        # for the document's language and as near-duplicate candidates.
+        kept_texts = (
+            _kept_chunks(doc.id, {row.page_number for row in stale_rows}) if incremental else []
+        )
+        lang = detect_language("\n".join(kept_texts + pages))
+
+        # Small child chunks are embedded and matched; their larger parent
+        # windows are only fetched when building the final LLM context.
+        page_parents = {}
+        children = []  # (page_number, parent_index, text)
+        for page_number, page_text in zip(changed, pages):
+            parents, page_children = split_parent_child(page_text)
+            page_parents[page_number] = parents
+            children += [(page_number, j, child) for j, child in page_children]
+
+        keep, _ = dedupe_chunks(
+            [child for _, _, child in children], seen=[simhash(text) for text in kept_texts]
+        )
+        kept_set = set(keep)
+        dropped_per_page = {}
+        for i, (page_number, _, _) in enumerate(children):
+            if i not in kept_set:
+                dropped_per_page[page_number] = dropped_per_page.get(page_number, 0) + 1
+        children = [children[i] for i in keep]
+        chunks = [child for _, _, child in children]
+
+        unchanged_chunks = sum(row.chunk_count or 0 for row in matched.values())
+        if not chunks and not unchanged_chunks:
             # Provide more debug info for failures so we can see why splitting failed
+            text = "\n".join(pages)
             sample = (text or "")[:200]
             print(f"[Celery] No chunks for doc {doc.id}. extracted_text_len={len(text or '')} sample={sample!r}")
             raise ValueError("No text chunks generated from document")
 
-        embeddings = get_embed().embed_documents(chunks)
-
-        ids = [f"doc_{doc.id}_chunk_{i}" for i in range(len(chunks))]
-        metadatas = [{
-            "source": doc.filename,
-            "sql_doc_id": doc.id,
-            "lang": lang,
-            "chunk_index": i
-        } for i in range(len(chunks))]
+        embeddings = get_embed().embed_documents(chunks) if chunks else []
 
         chroma_client = get_chroma_client()
         collection = get_documents_collection()
 
-        # Insert embeddings via the shared client to ensure persistence across processes.
-        chroma_client._add(
-            ids,
-            collection.id,
-            embeddings,
-            metadatas,
-            chunks
-        )
+        if incremental:
+            chunk_ids, parent_ids = _stale_ids(doc.id, stale_rows)
+            delete_vectors_by_id(chunk_ids, parent_ids)
+            # After the stale ids are gone, so moved pages can take them.
+            _move_pages(doc.id, moves, old_rows)
+        else:
+            # Clears chunks left by a failed attempt or an older id scheme.
+            delete_document_vectors(doc.id)
+
+        ids = []
+        metadatas = []
+        page_counts = {}
+        for (page_number, parent_index, _) in children:
+            i = page_counts.get(page_number, 0)
+            page_counts[page_number] = i + 1
+            ids.append(_chunk_id(doc.id, page_number, i))
+            metadatas.append({
+                "source": doc.filename,
+                "sql_doc_id": doc.id,
+                "lang": lang,
+                "page": page_number,
+                "chunk_index": i,
+                "parent_id": _parent_id(doc.id, page_number, parent_index),
+            })
+
+        if chunks:
+            # Insert embeddings via the shared client to ensure persistence across processes.
+            chroma_client._add(
+                ids,
+                collection.id,
+                embeddings,
+                metadatas,
+                chunks
+            )
+
+            # Parent windows reuse their children's vectors (centroid), so they
+            # cost no extra embedding pass.
+            child_embeddings = {}
+            for (page_number, parent_index, _), embedding in zip(children, embeddings):
+                child_embeddings.setdefault((page_number, parent_index), []).append(embedding)
+            kept_parents = sorted(child_embeddings)
+            chroma_client._add(
+                [_parent_id(doc.id, n, j) for n, j in kept_parents],
+                get_parents_collection().id,
+                [centroid_embedding(child_embeddings[key]) for key in kept_parents],
+                [{"source": doc.filename, "sql_doc_id": doc.id, "page": n} for n, _ in kept_parents],
+                [page_parents[n][j] for n, j in kept_parents],
+            )
+
+        # One centroid vector per document lets library-wide search route a
+        # query to candidate documents before touching any chunks.
+        all_embeddings = get_document_embeddings(doc.id) if incremental else embeddings
+        if all_embeddings:
+            upsert_document_summary(doc.id, doc.filename, centroid_embedding(all_embeddings))
 
         # Ensure data is flushed to disk so future processes (API, workers)
         # can see the new embeddings immediately.
@@ -74,16 +279,45 @@ def process_document_task(self, doc_id: int, file_path: str, content_type: str):
         except Exception:
             pass
 
+        for row in stale_rows:
+            db.delete(row)
+        for n, row in matched.items():
+            row.page_number = n
+        for page_number in changed:
+            db.add(DocumentPage(
+                document_id=doc.id,
+                page_number=page_number,
+                content_hash=fingerprints[page_number],
+                chunk_count=page_counts.get(page_number, 0),
+                parent_count=len(page_parents.get(page_number, [])),
+                chunks_dropped=dropped_per_page.get(page_number, 0),
+            ))
+        db.flush()
+
+        rows = db.query(DocumentPage).filter(DocumentPage.document_id == doc.id).all()
         doc.status = "completed"
         doc.error_message = None
+        doc.chunk_count = sum(row.chunk_count or 0 for row in rows)
+        doc.chunks_dropped = sum(row.chunks_dropped or 0 for row in rows)
         db.commit()
-        print(f"✅ [Celery] Document {doc_id} processing complete.")
+
+        # Cached /ask answers were built from the previous chunks.
+        answer_cache.invalidate(doc.id, doc.filename)
+        context_cache.invalidate(doc.filename)
+        if previous_path and previous_path != file_path and os.path.exists(previous_path):
+            os.remove(previous_path)
+        print(
+            f"✅ [Celery] Document {doc_id} processing complete "
+            f"({len(changed)} of {len(fingerprints)} pages embedded, {len(moves)} moved, "
+            f"{len(stale_rows)} dropped)."
+        )
         return "success"
 
     except Exception as e:
         print(f"❌ [Celery] Error processing document {doc_id}: {e}")
         # Mark the DB record as failed before retrying so we have a trace.
         try:
+            db.rollback()
             doc.status = "failed"
             doc.error_message = str(e)
             db.commit()
@@ -95,3 +329,95 @@ def process_document_task(self, doc_id: int, file_path: str, content_type: str):
     finally:
         db.close()
 
+
+@celery_app.task
+def backfill_document_summaries_task():
+    """Add routing embeddings for documents ingested before they existed.
+
+    Library-wide search only reaches documents with a summary embedding.
+    The centroid is computed from the chunk vectors already stored, so
+    nothing is re-embedded. Idempotent; queued at API startup.
+    """
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    try:
+        docs = {
+            doc.id: doc.filename
+            for doc in db.query(Document).filter(Document.status == "completed")
+        }
+    finally:
+        db.close()
+
+    added = 0
+    for doc_id in missing_document_summaries(list(docs)):
+        embeddings = get_document_embeddings(doc_id)
+        if embeddings:
+            upsert_document_summary(doc_id, docs[doc_id], centroid_embedding(embeddings))
+            added += 1
+
+    if added:
+        try:
+            get_chroma_client().persist()
+        except Exception:
+            pass
+    print(f"✅ [Celery] Added summary embeddings for {added} documents")
+    return added
+
+
+def _messages_to_fold(unsummarized):
+    """Oldest unsummarized messages within the input budget, newest left raw."""
+    candidates = unsummarized[:max(0, len(unsummarized) - SUMMARY_KEEP_RECENT)]
+    fold, used = [], 0
+    for message in candidates:
+        cost = message_tokens(message["message"])
+        if fold and used + cost > SUMMARY_INPUT_TOKENS:
+            break
+        fold.append(message)
+        used += cost
+    return fold
+
+
+@celery_app.task
+def summarize_chat_task(user_id: str, chat_id: str):
+    """Fold a chat's older messages into its running summary.
+
+    Queued by ``save_message`` once the unsummarized messages pass
+    CHAT_SUMMARY_TRIGGER_TOKENS; prompts then carry the summary plus only
+    the messages after it. A long backlog is folded over several runs. On
+    failure nothing is stored and the lock is released, so the next reply
+    queues another attempt.
+    """
+    try:
+        current = get_summary(user_id, chat_id) or {"text": "", "seq": 0}
+        history = get_history(user_id, chat_id)
+        unsummarized = [m for m in history if m["seq"] > current["seq"]]
+        fold = _messages_to_fold(unsummarized)
+        if not fold:
+            return "nothing to summarize"
+
+        # Only a single oversized message can exceed the input budget.
+        transcript = "\n".join(
+            f"{m['role']}: {truncate_to_tokens(m['message'], SUMMARY_INPUT_TOKENS)}"
+            if message_tokens(m["message"]) > SUMMARY_INPUT_TOKENS
+            else f"{m['role']}: {m['message']}"
+            for m in fold
+        )
+        summary = summarize_with_llm(
+            current["text"], transcript, max_words=SUMMARY_MAX_TOKENS * 3 // 4
+        )
+        summary = truncate_to_tokens(summary, SUMMARY_MAX_TOKENS) or summary
+
+        folded = sum(message_tokens(m["message"]) for m in fold)
+        remaining = sum(message_tokens(m["message"]) for m in unsummarized[len(fold):])
+        store_summary(
+            user_id, chat_id, summary, fold[-1]["seq"], folded, history[-1]["seq"], remaining
+        )
+        print(f"✅ [Celery] Chat {chat_id}: folded {len(fold)} messages into its summary")
+        return "success"
+
+    except LLMError as e:
+        print(f"❌ [Celery] Error summarizing chat {chat_id}: {e}")
+        return "failed"
+
+    finally:
+        release_summary_lock(user_id, chat_id)
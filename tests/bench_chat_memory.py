@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: chat memory from async code — sync client on the event loop,
+sync client on the blocking pool, and the redis.asyncio backend.
+
+Each simulated request saves a message, reads the chat history and lists
+the user's chats, the Redis work of one chat turn plus a sidebar refresh.
+Reports throughput and event-loop lag (how late a 5 ms ticker fires),
+which is what every other request on the server feels.
+
+Needs a running Redis (REDIS_HOST / REDIS_PORT). Writes under a throwaway
+user id and deletes its chats afterwards.
+
+Usage:
+    python tests/bench_chat_memory.py
+    python tests/bench_chat_memory.py --concurrency 200 --requests 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from student.utils import chat_memory_async, chat_memory_impl
+from student.utils.executor import run_blocking
+
+TICK = 0.005
+
+
+async def lag_probe(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        samples.append(time.perf_counter() - start - TICK)
+
+
+async def sync_on_loop(user_id, chat_id):
+    chat_memory_impl.save_message(user_id, chat_id, "user", "benchmark question")
+    chat_memory_impl.get_history(user_id, chat_id, limit=11)
+    chat_memory_impl.list_chats(user_id, limit=20)
+
+
+async def sync_on_pool(user_id, chat_id):
+    await run_blocking(chat_memory_impl.save_message, user_id, chat_id, "user", "benchmark question")
+    await run_blocking(chat_memory_impl.get_history, user_id, chat_id, 11)
+    await run_blocking(chat_memory_impl.list_chats, user_id, 20)
+
+
+async def native_async(user_id, chat_id):
+    await chat_memory_async.save_message(user_id, chat_id, "user", "benchmark question")
+    await chat_memory_async.get_history(user_id, chat_id, limit=11)
+    await chat_memory_async.list_chats(user_id, limit=20)
+
+
+async def run_mode(label, request, args):
+    user_id = f"bench-{uuid.uuid4().hex[:8]}"
+    chat_ids = [chat_memory_impl.create_chat(user_id) for _ in range(args.chats)]
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(chat_ids[i % len(chat_ids)])
+
+    async def worker():
+        while not queue.empty():
+            await request(user_id, queue.get_nowait())
+
+    lags, stop = [], asyncio.Event()
+    probe = asyncio.create_task(lag_probe(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+
+    for chat_id in chat_ids:
+        chat_memory_impl.delete_chat(user_id, chat_id)
+
+    lags.sort()
+    p99 = lags[int(0.99 * (len(lags) - 1))] if lags else 0.0
+    print(
+        f"  {label:<16} {args.requests / elapsed:>10.0f} "
+        f"{(statistics.mean(lags) if lags else 0) * 1000:>10.2f} "
+        f"{p99 * 1000:>10.2f} {(lags[-1] if lags else 0) * 1000:>10.2f}"
+    )
+
+
+async def main_async(args):
+    await chat_memory_async.startup()
+    print(f"{args.requests} requests, concurrency {args.concurrency}\n")
+    print(f"  {'':<16} {'req/s':>10} {'lag mean':>10} {'lag p99':>10} {'lag max':>10}  (ms)")
+    await run_mode("sync on loop", sync_on_loop, args)
+    await run_mode("sync on pool", sync_on_pool, args)
+    await run_mode("redis.asyncio", native_async, args)
+    await chat_memory_async.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=50, help="chats per run")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark: TokenChunker vs LangChain's RecursiveCharacterTextSplitter.
+
+Compares throughput on large inputs and the spread of bge-m3 token counts
+per chunk (the thing that drives embedding padding and truncation).
+
+Usage:
+    python tests/bench_chunking.py                 # synthetic OCR-like text
+    python tests/bench_chunking.py big_ocr.txt     # your own extracted text
+    python tests/bench_chunking.py --mb 8          # larger synthetic input
+"""
+import argparse
+import random
+import statistics
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from student.doc_summarizer.config import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS
+from student.doc_summarizer.services.chunking import TokenChunker
+from student.doc_summarizer.services.embeddings import get_embed_tokenizer
+
+# The character-based settings the ingestion pipeline used before.
+LEGACY_CHUNK_SIZE = 1000
+LEGACY_CHUNK_OVERLAP = 150
+EMBED_MAX_TOKENS = 512
+
+WORDS = (
+    "the court held that fundamental rights article constitution state "
+    "citizen equality liberty 1950 section clause (a) (b) per cent "
+    "Rs. 10,000 judgment petitioner respondent 2.3.1 Fig. e.g. i.e."
+).split()
+
+
+def synthetic_text(megabytes: float, seed: int = 7) -> str:
+    """OCR-ish text: ragged line wraps, short headings, long run-ons."""
+    rng = random.Random(seed)
+    target = int(megabytes * 1024 * 1024)
+    parts = []
+    size = 0
+    while size < target:
+        kind = rng.random()
+        if kind < 0.1:
+            piece = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).upper()
+            piece += "\n\n"
+        elif kind < 0.2:
+            piece = " ".join(rng.choice(WORDS) for _ in range(rng.randint(150, 400))) + "\n"
+        else:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 35)))
+            piece = sentence + rng.choice([". ", ".\n", "; ", "? ", ". \n\n"])
+        parts.append(piece)
+        size += len(piece)
+    return "".join(parts)
+
+
+def token_stats(chunks, tokenizer):
+    counts = [
+        len(ids)
+        for ids in tokenizer(chunks, add_special_tokens=True)["input_ids"]
+    ]
+    return {
+        "chunks": len(counts),
+        "mean": statistics.mean(counts),
+        "stdev": statistics.pstdev(counts),
+        "min": min(counts),
+        "max": max(counts),
+        "truncated": sum(1 for c in counts if c > EMBED_MAX_TOKENS),
+    }
+
+
+def timed(label, fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<28} {best:8.3f}s")
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", nargs="?", help="text file to chunk")
+    parser.add_argument("--mb", type=float, default=4.0, help="synthetic size in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.path:
+        with open(args.path, encoding="utf-8", errors="ignore") as fh:
+            text = fh.read()
+    else:
+        text = synthetic_text(args.mb)
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+    print(f"Input: {mb:.2f} MB")
+
+    tokenizer = get_embed_tokenizer()
+    legacy = RecursiveCharacterTextSplitter(
+        chunk_size=LEGACY_CHUNK_SIZE,
+        chunk_overlap=LEGACY_CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", "? ", "! ", "; ", " "],
+    )
+    native = TokenChunker(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer=tokenizer)
+
+    def streamed():
+        chunker = TokenChunker(CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer=tokenizer)
+        out = []
+        for start in range(0, len(text), 64 * 1024):
+            out.extend(chunker.feed(text[start:start + 64 * 1024]))
+        out.extend(chunker.flush())
+        return out
+
+    print("\nWall time (best of %d):" % args.repeat)
+    legacy_chunks, legacy_s = timed("RecursiveCharacterTextSplitter", lambda: legacy.split_text(text), args.repeat)
+    native_chunks, native_s = timed("TokenChunker.split_text", lambda: native.split_text(text), args.repeat)
+    streamed_chunks, streamed_s = timed("TokenChunker.feed (64 KB)", streamed, args.repeat)
+
+    print("\nThroughput:")
+    for label, secs in (("legacy", legacy_s), ("native", native_s), ("streamed", streamed_s)):
+        print(f"  {label:<10} {mb / secs:8.2f} MB/s")
+
+    print(f"\nbge-m3 tokens per chunk (limit {EMBED_MAX_TOKENS}):")
+    print(f"  {'':<10} {'chunks':>7} {'mean':>7} {'stdev':>7} {'min':>5} {'max':>5} {'>limit':>7}")
+    for label, chunks in (("legacy", legacy_chunks), ("native", native_chunks), ("streamed", streamed_chunks)):
+        st = token_stats(chunks, tokenizer)
+        print(
+            f"  {label:<10} {st['chunks']:>7} {st['mean']:>7.1f} {st['stdev']:>7.1f} "
+            f"{st['min']:>5} {st['max']:>5} {st['truncated']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
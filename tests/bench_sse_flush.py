@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark: server CPU per streamed token, one SSE frame per token vs
+coalesced frames (student.utils.sse).
+
+A throwaway server process streams synthetic tokens at a fixed rate, framed
+exactly as /chat/stream frames them, to many concurrent clients. The server
+reports its own CPU time, so the figure excludes the clients and Ollama.
+
+Usage:
+    python tests/bench_sse_flush.py                     # 200 streams
+    python tests/bench_sse_flush.py --streams 500 --rate 60
+    python tests/bench_sse_flush.py --flush-ms 50 --flush-chars 1024
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+import httpx
+
+PORT = 8765
+TOKENS = [" the", " court", " held", " that", " the", " statute", ",", "\n", " and"]
+
+
+def serve(flush_ms, flush_chars, tokens, rate, port):
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    from student.utils.sse import TokenCoalescer, sse_event
+
+    app = FastAPI()
+
+    async def upstream():
+        for i in range(tokens):
+            await asyncio.sleep(1 / rate)
+            yield TOKENS[i % len(TOKENS)]
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            coalescer = TokenCoalescer(flush_ms=flush_ms, max_chars=flush_chars)
+            async for chunk in coalescer.chunks(upstream()):
+                yield sse_event(chunk)
+            yield sse_event("[END]")
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/cpu")
+    async def cpu():
+        return JSONResponse({"cpu": time.process_time()})
+
+    uvicorn.run(app, port=port, log_level="warning")
+
+
+async def client(http, stats):
+    start = time.perf_counter()
+    first = None
+    async with http.stream("GET", "/stream") as response:
+        async for raw in response.aiter_raw():
+            if first is None:
+                first = time.perf_counter() - start
+            stats["bytes"] += len(raw)
+            stats["writes"] += 1
+    stats["ttft"].append(first or 0.0)
+
+
+async def measure(args, streams):
+    limits = httpx.Limits(max_connections=streams + 1)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=120
+    ) as http:
+        for _ in range(100):
+            try:
+                await http.get("/cpu")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        before = (await http.get("/cpu")).json()["cpu"]
+        stats = {"bytes": 0, "writes": 0, "ttft": []}
+        wall = time.perf_counter()
+        await asyncio.gather(*(client(http, stats) for _ in range(streams)))
+        wall = time.perf_counter() - wall
+        after = (await http.get("/cpu")).json()["cpu"]
+    stats["cpu"] = after - before
+    stats["wall"] = wall
+    return stats
+
+
+def run_mode(label, flush_ms, args):
+    server = multiprocessing.Process(
+        target=serve,
+        args=(flush_ms, args.flush_chars, args.tokens, args.rate, PORT),
+        daemon=True,
+    )
+    server.start()
+    try:
+        stats = asyncio.run(measure(args, args.streams))
+    finally:
+        server.terminate()
+        server.join()
+
+    tokens = args.tokens * args.streams
+    ttft = sorted(stats["ttft"])
+    print(
+        f"  {label:<22} {stats['cpu'] / tokens * 1e6:>10.1f} {stats['cpu']:>8.2f} "
+        f"{stats['writes'] / args.streams:>12.1f} {ttft[len(ttft) // 2] * 1000:>9.1f} "
+        f"{stats['wall']:>7.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=300, help="tokens per stream")
+    parser.add_argument("--rate", type=float, default=40, help="tokens per second per stream")
+    parser.add_argument("--flush-ms", type=float, default=30)
+    parser.add_argument("--flush-chars", type=int, default=512)
+    args = parser.parse_args()
+
+    print(
+        f"{args.streams} streams x {args.tokens} tokens at {args.rate:.0f} tokens/s\n"
+    )
+    print(f"  {'':<22} {'us/token':>10} {'cpu s':>8} {'reads/stream':>12} {'ttft ms':>9} {'wall s':>7}")
+    run_mode("per-token frames", 0, args)
+    run_mode(f"coalesced ({args.flush_ms:.0f} ms)", args.flush_ms, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark: WebSocket chat (/ws/chat) vs SSE chat (/chat/stream).
+
+Runs the same multi-turn conversations over both transports against a live
+server and reports connections opened, time to first token and time per
+turn. SSE opens a request per turn; each WebSocket client keeps one
+connection for all its turns.
+
+Usage:
+    python tests/bench_ws_vs_sse.py --source notes.pdf
+    python tests/bench_ws_vs_sse.py --source notes.pdf --clients 50 --turns 5
+    python tests/bench_ws_vs_sse.py --base-url http://host:8000 --source notes.pdf
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+import websockets
+
+QUESTIONS = [
+    "Summarise the main argument of this document.",
+    "What evidence supports it?",
+    "Which sections are the most important?",
+    "Are there any definitions I should know?",
+    "What are the key dates mentioned?",
+]
+
+
+class Stats:
+    def __init__(self):
+        self.connections = 0
+        self.ttft = []
+        self.turn = []
+        self.errors = 0
+
+    def row(self, label, wall):
+        def p(values, q):
+            if not values:
+                return float("nan")
+            values = sorted(values)
+            return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+        turns = len(self.turn)
+        print(
+            f"  {label:<6} {self.connections:>6} {turns:>6} {self.errors:>6} "
+            f"{p(self.ttft, 50) * 1000:>9.0f} {p(self.ttft, 95) * 1000:>9.0f} "
+            f"{statistics.mean(self.turn) if turns else float('nan'):>9.2f} "
+            f"{turns / wall if wall else 0:>8.2f}"
+        )
+
+
+async def sse_client(client, args, stats, questions):
+    chat_id = f"bench-{uuid.uuid4().hex[:8]}"
+    for question in questions:
+        body = {"chat_id": chat_id, "question": question, "source": args.source}
+        start = time.perf_counter()
+        first = None
+        stats.connections += 1
+        try:
+            async with client.stream("POST", "/chat/stream", json=body) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if line == "data: [END]":
+                        break
+                    if first is None:
+                        first = time.perf_counter() - start
+        except httpx.HTTPError:
+            stats.errors += 1
+            continue
+        if first is not None:
+            stats.ttft.append(first)
+        stats.turn.append(time.perf_counter() - start)
+
+
+async def ws_client(url, args, stats, questions):
+    chat_id = f"bench-{uuid.uuid4().hex[:8]}"
+    stats.connections += 1
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            for question in questions:
+                start = time.perf_counter()
+                first = None
+                await ws.send(json.dumps({
+                    "type": "ask", "chat_id": chat_id,
+                    "question": question, "source": args.source,
+                }))
+                async for raw in ws:
+                    message = json.loads(raw)
+                    kind = message.get("type")
+                    if kind == "ping":
+                        await ws.send(json.dumps({"type": "pong"}))
+                    elif kind == "token" and first is None:
+                        first = time.perf_counter() - start
+                    elif kind == "error":
+                        stats.errors += 1
+                        break
+                    elif kind == "end":
+                        break
+                if first is not None:
+                    stats.ttft.append(first)
+                stats.turn.append(time.perf_counter() - start)
+    except (OSError, websockets.WebSocketException):
+        stats.errors += 1
+
+
+async def run(args):
+    questions = (QUESTIONS * args.turns)[:args.turns]
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=0)
+    timeout = httpx.Timeout(args.timeout)
+
+    print(f"{args.clients} clients x {args.turns} turns against {args.base_url}\n")
+    print(f"  {'':<6} {'conns':>6} {'turns':>6} {'errors':>6} "
+          f"{'ttft p50':>9} {'ttft p95':>9} {'turn s':>9} {'turns/s':>8}")
+
+    sse = Stats()
+    # No keep-alive: each SSE turn is a fresh request, as a browser tab does.
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(sse_client(client, args, sse, questions) for _ in range(args.clients)))
+        sse.row("sse", time.perf_counter() - start)
+
+    ws = Stats()
+    url = args.base_url.replace("http", "ws", 1) + "/ws/chat"
+    start = time.perf_counter()
+    await asyncio.gather(*(ws_client(url, args, ws, questions) for _ in range(args.clients)))
+    ws.row("ws", time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--source", required=True, help="an uploaded PDF filename")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
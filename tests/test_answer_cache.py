@@ -0,0 +1,106 @@
+"""Unit tests for the semantic /ask answer cache (Redis replaced by a dict)."""
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("redis")
+
+from student.doc_summarizer.services import answer_cache  # noqa: E402
+
+A = [1.0, 0.0, 0.0]
+A_NEAR = [0.99, 0.1, 0.0]
+B = [0.0, 1.0, 0.0]
+
+
+class FakePipeline:
+    def __init__(self, generations):
+        self.generations = generations
+
+    def incr(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def execute(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self):
+        self.generations = {}
+
+    def get(self, key):
+        return self.generations.get(key)
+
+    def pipeline(self):
+        return FakePipeline(self.generations)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(answer_cache, "get_redis", lambda: fake)
+    monkeypatch.setattr(answer_cache, "_docs", answer_cache.OrderedDict())
+    return fake
+
+
+def test_similar_question_hits(redis):
+    answer_cache.store("1", A, "answer", [{"text": "t"}], 0)
+    assert answer_cache.lookup("1", A_NEAR)[0] == {"answer": "answer", "sources": [{"text": "t"}]}
+    assert answer_cache.lookup("1", B)[0] is None
+
+
+def test_entries_are_per_document(redis):
+    answer_cache.store("1", A, "answer", [], 0)
+    assert answer_cache.lookup("2", A)[0] is None
+
+
+def test_entries_expire(redis, monkeypatch):
+    answer_cache.store("1", A, "answer", [], 0)
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_TTL_SECONDS", -1)
+    assert answer_cache.lookup("1", A)[0] is None
+
+
+def test_least_recently_used_entry_is_evicted(redis, monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_MAX_PER_DOC", 2)
+    answer_cache.store("1", A, "a", [], 0)
+    answer_cache.store("1", B, "b", [], 0)
+    assert answer_cache.lookup("1", A)[0]["answer"] == "a"  # A is now the most recent
+    answer_cache.store("1", [0.0, 0.0, 1.0], "c", [], 0)
+    assert answer_cache.lookup("1", A)[0]["answer"] == "a"
+    assert answer_cache.lookup("1", B)[0] is None
+
+
+def test_least_recently_used_document_is_evicted(redis, monkeypatch):
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE_MAX_DOCS", 1)
+    answer_cache.store("1", A, "a", [], 0)
+    answer_cache.store("2", A, "b", [], 0)
+    assert answer_cache.lookup("1", A)[0] is None
+    assert answer_cache.lookup("2", A)[0]["answer"] == "b"
+
+
+def test_newer_generation_drops_entries(redis):
+    answer_cache.store("1", A, "a", [], 0)
+    redis.generations[answer_cache._generation_key("1")] = 1
+    assert answer_cache.lookup("1", A)[0] is None
+
+
+def test_invalidate_drops_document_and_library_answers(redis):
+    answer_cache.store("1", A, "by id", [], 0)
+    answer_cache.store("notes.pdf", A, "by name", [], 0)
+    answer_cache.store(answer_cache.LIBRARY_KEY, A, "library", [], 0)
+    answer_cache.invalidate(1, "notes.pdf")
+    for key in ("1", "notes.pdf", answer_cache.LIBRARY_KEY):
+        assert answer_cache.lookup(key, A)[0] is None
+
+
+def test_answer_from_before_a_reprocess_is_not_served(redis):
+    _, generation = answer_cache.lookup("1", A)
+    answer_cache.invalidate("1")  # the document is reprocessed while the LLM answers
+    answer_cache.store("1", A, "stale", [], generation)
+    assert answer_cache.lookup("1", A) == (None, 1)
+
+
+def test_stale_answer_does_not_replace_newer_entries(redis):
+    redis.generations[answer_cache._generation_key("1")] = 1
+    answer_cache.store("1", A, "fresh", [], 1)
+    answer_cache.store("1", B, "stale", [], 0)
+    assert answer_cache.lookup("1", A)[0]["answer"] == "fresh"
+    assert answer_cache.lookup("1", B)[0] is None
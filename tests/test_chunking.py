@@ -0,0 +1,81 @@
+"""Unit tests for the token-aware chunker (no models needed)."""
+import re
+
+import pytest
+
+from student.doc_summarizer.services.chunking import TokenChunker
+
+
+class WordTokenizer:
+    """Stands in for the bge-m3 tokenizer: one token per word."""
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, **_):
+        if isinstance(text, list):
+            return {"input_ids": [self(t)["input_ids"] for t in text]}
+        spans = [m.span() for m in re.finditer(r"\S+", text)]
+        encoded = {"input_ids": list(range(len(spans)))}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = spans
+        return encoded
+
+
+def words(text):
+    return len(text.split())
+
+
+def sentences(n, length=3):
+    return " ".join(
+        " ".join(f"s{i}w{j}" for j in range(length - 1)) + f" s{i}end." for i in range(n)
+    )
+
+
+def chunker(max_tokens=10, overlap_tokens=3, **kwargs):
+    return TokenChunker(max_tokens, overlap_tokens, tokenizer=WordTokenizer(), **kwargs)
+
+
+def test_chunks_stay_within_budget():
+    chunks = chunker().split_text(sentences(20))
+    assert len(chunks) > 1
+    assert all(words(chunk) <= 10 for chunk in chunks)
+
+
+def test_every_sentence_is_kept():
+    text = sentences(20)
+    joined = " ".join(chunker(overlap_tokens=0).split_text(text))
+    assert joined.split() == text.split()
+
+
+def test_consecutive_chunks_share_overlap():
+    chunks = chunker().split_text(sentences(12))
+    for previous, current in zip(chunks, chunks[1:]):
+        last_sentence = previous.split(". ")[-1].rstrip(".")
+        assert current.startswith(last_sentence)
+
+
+def test_long_sentence_is_cut_at_token_offsets():
+    text = " ".join(f"w{i}" for i in range(25)) + "."
+    chunks = chunker(overlap_tokens=0).split_text(text)
+    assert [words(chunk) for chunk in chunks] == [10, 10, 5]
+
+
+def test_paragraph_break_closes_a_nearly_full_chunk():
+    first = "a b c d. e f g h."
+    chunks = chunker(overlap_tokens=0).split_text(first + "\n\nnext para.")
+    assert chunks == [first, "next para."]
+
+
+def test_streaming_matches_batch():
+    text = sentences(15) + "\n\n" + sentences(7)
+    batch = chunker().split_text(text)
+
+    streaming = chunker()
+    streamed = []
+    for start in range(0, len(text), 17):
+        streamed += list(streaming.feed(text[start:start + 17]))
+    streamed += list(streaming.flush())
+    assert streamed == batch
+
+
+def test_overlap_must_be_smaller_than_budget():
+    with pytest.raises(ValueError):
+        chunker(max_tokens=5, overlap_tokens=5)
@@ -0,0 +1,103 @@
+"""Unit tests for circuit breaker state transitions."""
+import pytest
+
+from student.utils import circuit_breaker
+from student.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, get_breaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+def opened_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=30)
+    for _ in range(3):
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_rejects_during_cooldown(clock):
+    breaker = opened_breaker()
+    clock.now += 29
+    assert not breaker.allow()
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = opened_breaker()
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(clock):
+    breaker = opened_breaker()
+    clock.now += 30
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_for_another_cooldown(clock):
+    breaker = opened_breaker()
+    clock.now += 30
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_released_trial_can_be_retried(clock):
+    breaker = opened_breaker()
+    clock.now += 30
+    breaker.allow()
+    breaker.release()
+    assert breaker.state == OPEN
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+def test_release_does_not_touch_a_closed_breaker(clock):
+    breaker = CircuitBreaker("test")
+    breaker.release()
+    assert breaker.state == CLOSED
+
+
+def test_get_breaker_returns_one_breaker_per_name():
+    assert get_breaker("test-registry") is get_breaker("test-registry")
+    assert get_breaker("test-registry") is not get_breaker("test-registry-other")
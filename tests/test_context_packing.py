@@ -0,0 +1,73 @@
+"""Unit tests for token-budgeted prompt packing (len/4 token estimates)."""
+import pytest
+
+from student.utils import context_packing
+from student.utils.context_packing import Section, pack_prompt
+
+# 40 characters: 10 tokens, 11 with its separator.
+ITEM = "x" * 40
+# 28 characters: 7 tokens, 8 with its separator.
+SENTENCES = [f"Sentence number {i} goes here." for i in range(10)]
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.setattr(context_packing, "_tokenizer", None)
+    monkeypatch.setattr(context_packing, "_tokenizer_failed", True)
+
+
+def test_prompt_fits_window_minus_reserve():
+    result = pack_prompt(
+        "T" * 40,
+        "Q" * 20,
+        [Section("context", [ITEM] * 20, share=0.6), Section("history", [ITEM] * 20, share=0.4)],
+        window=200,
+        reserve=50,
+    )
+    assert result.usage["budget"] == 150
+    assert result.usage["total"] <= 150
+
+
+def test_sections_split_the_budget_by_share():
+    context = Section("context", [ITEM] * 20, share=0.5)
+    history = Section("history", [ITEM] * 20, share=0.5)
+    pack_prompt("", "", [context, history], window=100, reserve=0)
+    assert context.tokens + history.tokens <= 100
+    assert abs(context.tokens - history.tokens) <= 11
+
+
+def test_unused_share_goes_to_other_sections():
+    context = Section("context", [ITEM], share=0.5)
+    history = Section("history", [ITEM] * 20, share=0.5)
+    pack_prompt("", "", [context, history], window=100, reserve=0)
+    assert context.tokens == 11
+    assert history.tokens == 88
+
+
+def test_item_that_does_not_fit_is_cut_at_a_sentence():
+    context = Section("context", [" ".join(SENTENCES)], share=1.0)
+    pack_prompt("", "", [context], window=30, reserve=0)
+    assert context.text == " ".join(SENTENCES[:3])
+    assert context.tokens <= 30
+
+
+def test_chronological_sections_are_emitted_oldest_first():
+    history = Section("history", ["newest", "middle", "oldest"], share=1.0, separator="\n",
+                      chronological=True)
+    result = pack_prompt("", "", [history], window=100, reserve=0)
+    assert result.text("history") == "oldest\nmiddle\nnewest"
+
+
+def test_usage_reports_tokens_and_dropped_items():
+    result = pack_prompt(
+        "T" * 40,
+        "Q" * 20,
+        [Section("context", [ITEM] * 10, share=1.0)],
+        window=100,
+        reserve=20,
+    )
+    assert result.usage["template"] == 10
+    assert result.usage["question"] == 5
+    assert result.usage["context"] == 55
+    assert result.usage["total"] == 70
+    assert result.usage["dropped"] == {"context": 5}
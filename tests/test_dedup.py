@@ -0,0 +1,68 @@
+"""Unit tests for page-furniture stripping and SimHash near-duplicate removal."""
+from student.doc_summarizer.services.dedup import (
+    dedupe_chunks,
+    simhash,
+    strip_lines,
+    strip_page_furniture,
+)
+
+PARAGRAPH = (
+    "Photosynthesis converts light energy into chemical energy stored in glucose, "
+    "releasing oxygen as a by-product of splitting water molecules in the chloroplast. "
+    "The light-dependent reactions take place in the thylakoid membranes, while the Calvin "
+    "cycle fixes carbon dioxide in the stroma using ATP and NADPH produced earlier."
+)
+BODIES = [
+    "Cells divide by mitosis.",
+    "Enzymes lower activation energy.",
+    "DNA stores genes.",
+    "Osmosis moves water.",
+    "Ribosomes build proteins.",
+]
+
+
+def page(n, body):
+    return f"ACME Biology Handbook\n{body}\nPage {n} of 12\n© 2024 ACME"
+
+
+def test_repeated_lines_are_stripped_from_every_page():
+    pages = [page(n, body) for n, body in enumerate(BODIES, 1)]
+    cleaned, furniture = strip_page_furniture(pages)
+    assert cleaned == BODIES
+    assert "acme biology handbook" in furniture
+    assert "page # of #" in furniture
+
+
+def test_too_few_pages_are_left_alone():
+    pages = [page(1, "one"), page(2, "two")]
+    assert strip_page_furniture(pages) == (pages, set())
+
+
+def test_long_lines_must_repeat_verbatim():
+    line = "This sentence is long enough that its digits are not masked: chapter 1 intro"
+    pages = [line.replace("1", str(n)) + "\n" + body for n, body in enumerate(BODIES, 1)]
+    cleaned, _ = strip_page_furniture(pages)
+    assert cleaned == pages
+
+
+def test_strip_lines_reuses_known_furniture():
+    _, furniture = strip_page_furniture([page(n, body) for n, body in enumerate(BODIES, 1)])
+    assert strip_lines([page(40, "new body")], furniture) == ["new body"]
+
+
+def test_simhash_is_close_for_near_duplicates():
+    near = PARAGRAPH.replace("earlier.", "earlier on.")
+    other = "The French Revolution began in 1789 with the storming of the Bastille in Paris."
+    assert bin(simhash(PARAGRAPH) ^ simhash(near)).count("1") <= 3
+    assert bin(simhash(PARAGRAPH) ^ simhash(other)).count("1") > 3
+
+
+def test_dedupe_keeps_first_occurrence():
+    chunks = [PARAGRAPH, "Something else entirely about volcanoes and lava.", PARAGRAPH]
+    assert dedupe_chunks(chunks) == ([0, 1], 1)
+
+
+def test_dedupe_drops_near_duplicates_of_seen_chunks():
+    chunks = [PARAGRAPH, "Something else entirely about volcanoes and lava."]
+    keep, dropped = dedupe_chunks(chunks, seen=[simhash(PARAGRAPH)])
+    assert (keep, dropped) == ([1], 1)
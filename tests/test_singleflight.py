@@ -0,0 +1,144 @@
+"""Unit tests for single-flight deduplication of blocking and streaming generations."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from student.utils.singleflight import SingleFlight, StreamFanout, flight_key
+
+
+def test_flight_key_ignores_argument_order():
+    assert flight_key(model="m", prompt="p") == flight_key(prompt="p", model="m")
+    assert flight_key(model="m", prompt="p") != flight_key(model="m", prompt="q")
+
+
+def run_concurrently(flight, fn, callers=5):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do("key", fn))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    results, errors = run_concurrently(SingleFlight("test"), slow)
+    assert calls == [1]
+    assert results == ["answer"] * 5
+    assert errors == []
+
+
+def test_leader_error_reaches_every_caller():
+    def failing():
+        time.sleep(0.2)
+        raise RuntimeError("ollama down")
+
+    results, errors = run_concurrently(SingleFlight("test"), failing)
+    assert results == []
+    assert len(errors) == 5
+    assert all(str(exc) == "ollama down" for exc in errors)
+
+
+def test_finished_call_is_not_cached():
+    flight = SingleFlight("test")
+    calls = []
+    flight.do("key", lambda: calls.append(1))
+    flight.do("key", lambda: calls.append(1))
+    assert calls == [1, 1]
+
+
+class Upstream:
+    """Token stream that releases one token per ``step()``."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.opened = 0
+        self.cancelled = False
+        self.ready = asyncio.Semaphore(0)
+
+    def step(self, n=1):
+        for _ in range(n):
+            self.ready.release()
+
+    async def stream(self, result):
+        self.opened += 1
+        try:
+            for token in self.tokens:
+                await self.ready.acquire()
+                yield token
+            result["done"] = True
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(stream):
+    return [token async for token in stream]
+
+
+def test_subscribers_share_one_upstream():
+    async def scenario():
+        fanout = StreamFanout("test")
+        upstream = Upstream(["a", "b", "c"])
+        first_result, second_result = {}, {}
+        first = asyncio.ensure_future(
+            collect(fanout.subscribe("key", upstream.stream, first_result))
+        )
+        upstream.step()
+        await asyncio.sleep(0.01)
+        # A late subscriber replays the tokens already produced.
+        second = asyncio.ensure_future(
+            collect(fanout.subscribe("key", upstream.stream, second_result))
+        )
+        await asyncio.sleep(0.01)
+        upstream.step(2)
+        return upstream, await first, await second, first_result, second_result
+
+    upstream, first, second, first_result, second_result = asyncio.run(scenario())
+    assert upstream.opened == 1
+    assert first == second == ["a", "b", "c"]
+    assert first_result == second_result == {"done": True}
+
+
+def test_upstream_is_cancelled_when_last_subscriber_leaves():
+    async def scenario():
+        fanout = StreamFanout("test")
+        upstream = Upstream(["a", "b", "c"])
+        stream = fanout.subscribe("key", upstream.stream)
+        upstream.step()
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+        return fanout, upstream
+
+    fanout, upstream = asyncio.run(scenario())
+    assert upstream.cancelled
+    assert fanout._streams == {}
+
+
+def test_upstream_error_reaches_subscribers():
+    async def failing(result):
+        yield "a"
+        raise RuntimeError("ollama down")
+
+    async def scenario():
+        return await collect(StreamFanout("test").subscribe("key", failing))
+
+    with pytest.raises(RuntimeError, match="ollama down"):
+        asyncio.run(scenario())
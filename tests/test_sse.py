@@ -0,0 +1,67 @@
+"""Unit tests for SSE framing and token coalescing."""
+import asyncio
+import time
+
+from student.utils.sse import TokenCoalescer, sse_event
+
+
+def test_single_line_event():
+    assert sse_event("hello") == "data: hello\n\n"
+
+
+def test_multi_line_event_gets_a_data_field_per_line():
+    assert sse_event("a\nb\n") == "data: a\ndata: b\ndata: \n\n"
+
+
+async def stream(tokens, stall_before=None, stall=0.0):
+    for token in tokens:
+        if token == stall_before:
+            await asyncio.sleep(stall)
+        yield token
+
+
+def coalesce(tokens, **kwargs):
+    """Frames produced for ``tokens`` and the seconds each was sent after start."""
+    async def scenario():
+        coalescer = TokenCoalescer(**kwargs.pop("options", {}))
+        start = time.monotonic()
+        frames, times = [], []
+        async for frame in coalescer.chunks(stream(tokens, **kwargs)):
+            frames.append(frame)
+            times.append(time.monotonic() - start)
+        return coalescer, frames, times
+
+    return asyncio.run(scenario())
+
+
+def test_first_token_goes_out_alone_then_tokens_are_grouped():
+    tokens = [f"t{i} " for i in range(10)]
+    coalescer, frames, _ = coalesce(tokens, options={"flush_ms": 1000})
+    assert frames == ["t0 ", "".join(tokens[1:])]
+    assert coalescer.text == "".join(tokens)
+    assert coalescer.frames == 2
+
+
+def test_max_chars_forces_a_flush():
+    _, frames, _ = coalesce(["ab"] * 5, options={"flush_ms": 1000, "max_chars": 4})
+    assert frames == ["ab", "abab", "abab"]
+
+
+def test_stalled_generation_flushes_on_time():
+    _, frames, times = coalesce(
+        ["a", "b", "c"], stall_before="c", stall=0.3, options={"flush_ms": 20}
+    )
+    assert frames == ["a", "b", "c"]
+    # "b" is sent once the window passes, not when "c" finally arrives.
+    assert times[1] < 0.2
+
+
+def test_zero_window_sends_a_frame_per_token():
+    _, frames, _ = coalesce(["a", "b", "c"], options={"flush_ms": 0})
+    assert frames == ["a", "b", "c"]
+
+
+def test_empty_stream_yields_nothing():
+    coalescer, frames, _ = coalesce([])
+    assert frames == []
+    assert coalescer.frames == 0